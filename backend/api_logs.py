@@ -2,6 +2,7 @@
 ログ確認用のAPIエンドポイント
 """
 from flask import Blueprint, jsonify, request
+from utils.log_reader import parse_time
 from utils.logger import debug_log, log_info
 
 logs_bp = Blueprint('logs', __name__)
@@ -26,6 +27,39 @@ def get_logs(log_type):
             'message': str(e)
         }), 500
 
+@logs_bp.route('/api/logs/<log_type>/query', methods=['GET'])
+def query_logs(log_type):
+    """
+    ローテーション済みのファイルも含めてログを検索
+    クエリ: start / end（ISO 8601の日時）, level（INFO/ERROR など）, path（リクエストのパス）, limit（最大件数）
+    """
+    try:
+        result = debug_log.query_logs(
+            log_type,
+            start=parse_time(request.args.get('start')),
+            end=parse_time(request.args.get('end')),
+            level=request.args.get('level'),
+            path=request.args.get('path'),
+            limit=request.args.get('limit', 100, type=int)
+        )
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 500
+    
+    return jsonify({
+        'success': True,
+        'log_type': log_type,
+        'entries': result['entries'],
+        'truncated': result['truncated']
+    })
+
 @logs_bp.route('/api/logs/clear/<log_type>', methods=['POST'])
 def clear_logs(log_type):
     """ログをクリア"""
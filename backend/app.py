@@ -1,11 +1,10 @@
 import os
 import sys
 import json
-import base64
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
-import tempfile
+import threading
 import time
 
 # Lambdaのコードを再利用するためパスを追加
@@ -13,10 +12,24 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from utils.csv_analyzer import CSVAnalyzer
 from utils.user_sync import UserSyncManager
+from utils.upload_store import UploadSessionStore
+from utils.parse_cache import ParsedCSVCache
+from utils.user_directory import UserDirectory
+from utils.fingerprint_store import FingerprintStore
+from utils.job_queue import TERMINAL_STATUSES, JobQueue
+from utils.sync_progress import progress_counts, progress_event
+from utils.diff_store import OPERATIONS, SyncDiff, write_diff
+from utils.sync_plan import load_plan, plan_artifact, plan_id, plan_stamp
+from utils.sync_log import SyncLogWriter, iter_log, log_artifact
+from utils.metrics import metrics
 from utils.logger import log_info, log_error, log_access, log_debug
 
 app = Flask(__name__)
 
+# forkserverで起動したワーカープロセス（カラム分析のプロセスプールなど）は、python app.py で起動した場合に
+# このファイルを __mp_main__ として読み込み直すため、その場合はメトリクスの書き出し・起動ログ・ジョブの実行を開始しない
+worker_process_import = __name__ == '__mp_main__'
+
 # 環境変数の読み込み
 from dotenv import load_dotenv
 load_dotenv()
@@ -35,16 +48,69 @@ CORS(app, origins=cors_origins,
 from api_logs import logs_bp
 app.register_blueprint(logs_bp)
 
-# アップロードされたCSVを一時的に保存
-uploaded_csv_data = {}
+# アップロードされたCSVをディスク上に保存（ワーカープロセス間で共有）
+upload_store = UploadSessionStore(
+    os.getenv('UPLOAD_FOLDER', os.path.join(os.path.dirname(__file__), 'uploads')),
+    ttl_seconds=int(os.getenv('UPLOAD_SESSION_TTL', '3600')),
+    max_bytes=int(os.getenv('UPLOAD_STORE_MAX_BYTES', str(512 * 1024 * 1024))),
+    max_sessions=int(os.getenv('UPLOAD_STORE_MAX_SESSIONS', '100')),
+    in_use=lambda: active_sync_sessions()
+)
+
+
+def active_sync_sessions():
+    """
+    待機中・実行中の同期ジョブが参照するセッション（期限切れ・上限超過でも削除しない）
+    ジョブキュー（sync_jobs）は後で作成するため、呼び出し時に参照する
+    """
+    return {payload.get('sessionId') for payload in sync_jobs.active_payloads()}
+
+
+# フィールド自動検出のカラム分析を並列化するワーカー数（1の場合は直列）
+analyzer_workers = int(os.getenv('ANALYZER_WORKERS', '1'))
+
+# 解析済みCSVのキャッシュ（アップロード・プレビュー・実行で共有）
+parse_cache = ParsedCSVCache(
+    os.getenv('PARSE_CACHE_DIR', os.path.join(os.path.dirname(__file__), 'cache', 'parsed')),
+    max_bytes=int(os.getenv('PARSE_CACHE_MAX_BYTES', str(1024 * 1024 * 1024)))
+)
+
+# 既存ユーザー一覧（USER_DIRECTORY_SOURCE=cognito の場合はCognitoから取得してスナップショットを保存）
+user_directory = UserDirectory(
+    store_dir=os.getenv(
+        'USER_DIRECTORY_DIR',
+        os.path.join(os.path.dirname(__file__), 'cache', 'directory')
+    ),
+    source_path=os.getenv(
+        'EXISTING_USERS_FILE',
+        os.path.join(os.path.dirname(__file__), '../sample-data/existing-saas-users.json')
+    ),
+    cognito_user_pool_id=(
+        os.getenv('COGNITO_USER_POOL_ID') if os.getenv('USER_DIRECTORY_SOURCE') == 'cognito' else None
+    ),
+    ttl_seconds=int(os.getenv('USER_DIRECTORY_TTL', '300'))
+)
+
+# 前回の同期結果のフィンガープリント（変更のない行の比較・反映を省略）
+fingerprint_store = FingerprintStore(
+    os.getenv('FINGERPRINT_DB', os.path.join(os.path.dirname(__file__), 'cache', 'fingerprints.sqlite'))
+)
+
+# 処理段階ごとのメトリクス（ワーカープロセスごとの計測値をディレクトリに書き出して合算する）
+if not worker_process_import:
+    metrics.configure(
+        os.getenv('METRICS_DIR', os.path.join(os.path.dirname(__file__), 'cache', 'metrics')),
+        flush_interval=float(os.getenv('METRICS_FLUSH_INTERVAL', '5'))
+    )
 
-# ログ初期化
-log_info("Flask server started", {"port": 8000, "env": "development"})
+    # ログ初期化
+    log_info("Flask server started", {"port": 8000, "env": "development"})
 
 # リクエストログ
 @app.before_request
 def log_request():
-    log_debug(f"Request: {request.method} {request.path}", {
+    # ヘッダーの辞書化はデバッグログを出力する場合のみ行う
+    log_debug(f"Request: {request.method} {request.path}", lambda: {
         "headers": dict(request.headers),
         "args": dict(request.args)
     })
@@ -83,51 +149,46 @@ def upload_csv():
                 'message': 'ファイルが選択されていません'
             }), 400
         
-        # 一時ファイルに保存
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.csv') as tmp_file:
-            file.save(tmp_file.name)
-            tmp_path = tmp_file.name
+        # セッションストアに保存し、保存したファイルをそのまま解析
+        session_id = upload_store.create(file.stream, file.filename)
+        csv_path = upload_store.get_path(session_id)
         
         try:
             # CSV解析
-            analyzer = CSVAnalyzer()
-            df = analyzer.read_csv(tmp_path)
+            analyzer = CSVAnalyzer(parse_cache=parse_cache, workers=analyzer_workers)
+            chunks = analyzer.read_csv_chunks(csv_path)
             
-            # フィールド自動検出
-            auto_mapping = analyzer.auto_detect_fields(df)
+            # フィールド自動検出・プレビューデータ取得（チャンク単位で1回走査）
+            analysis = analyzer.analyze_chunks(chunks)
+            headers = analysis['headers']
+            preview = analysis['preview']
+            auto_mapping = analysis['auto_mapping']
+            total_rows = analysis['total_rows']
             
-            # プレビューデータ取得
-            headers, preview = analyzer.get_preview_data(df)
-            
-            # CSVデータを保存（後の処理で使用）
-            with open(tmp_path, 'rb') as f:
-                file_content = base64.b64encode(f.read()).decode('utf-8')
-            
-            session_id = str(hash(file.filename))
-            uploaded_csv_data[session_id] = {
-                'file_content': file_content,
+            # 解析結果を保存（後の処理で使用）
+            upload_store.save_metadata(session_id, {
                 'headers': headers,
                 'preview': preview
-            }
-            
-            log_info("CSV upload successful", {
-                'filename': file.filename,
-                'rows': len(df),
-                'session_id': session_id
-            })
-            
-            return jsonify({
-                'success': True,
-                'headers': headers,
-                'preview': preview,
-                'auto_mapping': auto_mapping,
-                'total_rows': len(df),
-                'session_id': session_id
             })
             
-        finally:
-            if os.path.exists(tmp_path):
-                os.remove(tmp_path)
+        except Exception:
+            upload_store.delete(session_id)
+            raise
+        
+        log_info("CSV upload successful", {
+            'filename': file.filename,
+            'rows': total_rows,
+            'session_id': session_id
+        })
+        
+        return jsonify({
+            'success': True,
+            'headers': headers,
+            'preview': preview,
+            'auto_mapping': auto_mapping,
+            'total_rows': total_rows,
+            'session_id': session_id
+        })
     
     except Exception as e:
         log_error("CSV upload failed", e, {"filename": request.files.get('file', {}).get('filename')})
@@ -144,53 +205,39 @@ def sync_preview():
         data = request.json
         csv_data = data.get('csvData', {})
         mapping = data.get('mapping', {})
+        full_resync = data.get('fullResync', False)
         
         session_id = csv_data.get('session_id')
-        if not session_id or session_id not in uploaded_csv_data:
+        csv_path = upload_store.get_path(session_id)
+        if not csv_path:
             return jsonify({
                 'success': False,
                 'message': 'CSVデータが見つかりません'
             }), 400
         
-        # CSVデータを復元
-        file_content = uploaded_csv_data[session_id]['file_content']
-        file_data = base64.b64decode(file_content)
-        
-        with tempfile.NamedTemporaryFile(mode='wb', suffix='.csv', delete=False) as tmp_file:
-            tmp_file.write(file_data)
-            tmp_path = tmp_file.name
+        # 同期計画を作成（同じ入力の計画が保存済みであれば比較をやり直さない）
+        plan, current_plan_id, _ = prepare_sync_plan(session_id, csv_path, mapping, full_resync)
+        upload_store.save_metadata(session_id, {'planId': current_plan_id})
         
+        # 操作ごとに最初の10件と、続きを取得するためのカーソル（11件目以降は差分の一覧APIで参照する）
         try:
-            # CSV読み込み
-            analyzer = CSVAnalyzer()
-            df = analyzer.read_csv(tmp_path)
-            
-            # 既存ユーザーを読み込み
-            sync_manager = UserSyncManager()
-            existing_users = sync_manager.load_existing_users(
-                os.path.join(os.path.dirname(__file__), '../sample-data/existing-saas-users.json')
-            )
-            
-            # ユーザー比較
-            new_users, update_users, delete_users = sync_manager.compare_users(
-                df, mapping, existing_users
-            )
-            
-            return jsonify({
-                'success': True,
-                'summary': {
-                    'toAdd': len(new_users),
-                    'toUpdate': len(update_users),
-                    'toDelete': len(delete_users)
-                },
-                'newUsers': new_users[:10],
-                'updateUsers': update_users[:10],
-                'deleteUsers': delete_users[:10]
-            })
-            
+            summary = plan.summary()
+            pages = {operation: plan.page(operation=operation, limit=10) for operation in OPERATIONS}
         finally:
-            if os.path.exists(tmp_path):
-                os.remove(tmp_path)
+            plan.close()
+        first_users = {
+            operation: [_without_operation(user) for user in page['items']] for operation, page in pages.items()
+        }
+        
+        return jsonify({
+            'success': True,
+            'summary': summary,
+            'newUsers': first_users['add'],
+            'updateUsers': first_users['update'],
+            'deleteUsers': first_users['delete'],
+            'diffCursors': {operation: page['nextCursor'] for operation, page in pages.items()},
+            'planId': current_plan_id
+        })
     
     except Exception as e:
         return jsonify({
@@ -199,60 +246,217 @@ def sync_preview():
         }), 500
 
 
+@app.route('/api/sync/diff/<session_id>', methods=['GET'])
+def get_sync_diff(session_id):
+    """
+    プレビューで保存した差分をページ単位で取得
+    クエリ: operation（add/update/delete）, field（name/position/department）, email（前方一致）,
+           cursor（前のページの nextCursor）, limit（1ページの件数）
+    """
+    metadata = upload_store.get_metadata(session_id) if upload_store.get_path(session_id) else None
+    diff = None
+    if metadata and metadata.get('planId'):
+        diff = SyncDiff.open(upload_store.artifact_path(session_id, plan_artifact(metadata['planId'])))
+    if diff is None:
+        return jsonify({
+            'success': False,
+            'message': '差分が見つかりません。プレビューを実行してください'
+        }), 404
+    
+    try:
+        page = diff.page(
+            operation=request.args.get('operation'),
+            field=request.args.get('field'),
+            email=request.args.get('email'),
+            cursor=request.args.get('cursor'),
+            limit=request.args.get('limit', 50, type=int)
+        )
+        return jsonify({
+            'success': True,
+            'summary': diff.summary(),
+            'items': page['items'],
+            'nextCursor': page['nextCursor']
+        })
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
+    finally:
+        diff.close()
+
+
+# プレビュー後に入力が変わり、確認した計画を実行できない場合のメッセージ
+PLAN_CHANGED_MESSAGE = 'プレビュー後にCSV・マッピング・既存ユーザーが変更されました。プレビューを再表示して差分を確認してください'
+
+
+class PlanChangedError(Exception):
+    """プレビューで確認した計画と、現在の入力から作成される計画が異なる"""
+
+
+def current_sync_plan(csv_path, mapping, full_resync=False, refresh=False):
+    """
+    現在の入力（CSV・マッピング・既存ユーザーのスナップショット・フィンガープリント）に対応する計画の識別情報
+    戻り値: (既存ユーザー, 計画のスタンプ, 計画ID)
+    """
+    # 既存ユーザーを読み込み（スナップショットが有効な間は再取得しない）
+    existing_users = user_directory.load(refresh=refresh)
+    stamp = plan_stamp(
+        csv_path, mapping, user_directory.snapshot_id, fingerprint_store.generation(), full_resync
+    )
+    return existing_users, stamp, plan_id(stamp)
+
+
+def prepare_sync_plan(session_id, csv_path, mapping, full_resync=False, refresh=False):
+    """
+    同期計画を取得（CSV・マッピング・既存ユーザーのスナップショットが同じ計画が保存済みであれば比較をやり直さない）
+    戻り値: (計画, 計画ID, 保存済みの計画を再利用したかどうか)
+    """
+    existing_users, stamp, current_plan_id = current_sync_plan(csv_path, mapping, full_resync, refresh)
+    plan_path = upload_store.artifact_path(session_id, plan_artifact(current_plan_id))
+    
+    plan = SyncDiff.open(plan_path)
+    if plan is not None:
+        return plan, current_plan_id, True
+    
+    # 保存済みのCSVをそのまま読み込み（チャンク単位）
+    analyzer = CSVAnalyzer(parse_cache=parse_cache)
+    chunks = analyzer.read_csv_chunks(csv_path)
+    
+    # ユーザー比較（fullResync の場合はフィンガープリントを使わず全件を比較）
+    sync_manager = UserSyncManager(fingerprint_store=fingerprint_store)
+    new_users, update_users, delete_users = sync_manager.compare_users(
+        chunks, mapping, existing_users, full_resync=full_resync
+    )
+    
+    # 計画全体を保存（既存ユーザーと一致していた行のフィンガープリントも実行時の保存用に含める）
+    write_diff(
+        plan_path, new_users, update_users, delete_users,
+        metadata={'stamp': stamp}, fingerprints=sync_manager.in_sync_fingerprints
+    )
+    return SyncDiff(plan_path), current_plan_id, False
+
+
+def _without_operation(user):
+    # 差分の一覧の項目から操作の種類を除く（プレビューの一覧は操作ごとに分かれているため）
+    return {key: value for key, value in user.items() if key != 'operation'}
+
+
+def run_sync_job(payload, job):
+    """同期ジョブの実行（ジョブキューのワーカースレッドから呼び出される）"""
+    session_id = payload['sessionId']
+    csv_path = upload_store.get_path(session_id)
+    if not csv_path:
+        raise ValueError('CSVデータが見つかりません')
+    
+    # プレビューで確定した計画のみを実行する（Cognitoへの操作の前に、計画が変わっていないことを確認する）
+    # 再実行（job.attempt > 1）の場合は、前回の途中までの反映を含めるため既存ユーザーを取得し直して計画を作り直す
+    # （このときのみ確認した計画と異なる計画を実行し、結果の planChanged で知らせる）
+    refresh = job.attempt > 1
+    reviewed_plan_id = payload.get('planId')
+    if reviewed_plan_id and not refresh:
+        _, _, current_plan_id = current_sync_plan(csv_path, payload['mapping'], payload['fullResync'])
+        if current_plan_id != reviewed_plan_id:
+            raise PlanChangedError(PLAN_CHANGED_MESSAGE)
+    
+    plan, current_plan_id, reused = prepare_sync_plan(
+        session_id, csv_path, payload['mapping'], payload['fullResync'], refresh=refresh
+    )
+    try:
+        new_users, update_users, delete_users = load_plan(plan)
+        sync_manager = UserSyncManager(fingerprint_store=fingerprint_store)
+        sync_manager.in_sync_fingerprints = plan.fingerprints()
+        sync_manager.full_resync = bool(payload['fullResync'])
+    finally:
+        plan.close()
+    
+    plan_info = {
+        'planId': current_plan_id,
+        'planReused': reused,
+        # プレビューで確認した計画と実行する計画が異なる場合
+        'planChanged': bool(reviewed_plan_id) and reviewed_plan_id != current_plan_id
+    }
+    job.report(dict(
+        plan_info,
+        total={'added': len(new_users), 'updated': len(update_users), 'deleted': len(delete_users)},
+        added=0, updated=0, deleted=0, errors=0, recentErrors=[],
+        syncStartedAt=time.time()
+    ))
+    
+    # 同期実行（開発環境なのでdry_run=True）
+    # 操作ごとの結果はジョブごとの処理ログに追記する（再実行の場合は前回のログに続けて書き込む）
+    with SyncLogWriter(upload_store.artifact_path(session_id, log_artifact(job.job_id))) as sync_log:
+        results = sync_manager.execute_sync(
+            new_users, update_users, delete_users, dry_run=True,
+            progress=lambda current: job.report(progress_counts(current)),
+            cancel_event=job.cancel_event,
+            sync_log=sync_log
+        )
+    job.report(progress_counts(results))
+    
+    results['id'] = session_id
+    results['logId'] = job.job_id
+    results.update(plan_info)
+    return results
+
+
+# 同期実行のジョブキュー（再起動後も未完了のジョブを引き継いで実行）
+sync_jobs = JobQueue(
+    os.getenv('SYNC_JOB_DB', os.path.join(os.path.dirname(__file__), 'cache', 'jobs.sqlite')),
+    handler=run_sync_job,
+    workers=int(os.getenv('SYNC_JOB_WORKERS', '1')),
+    lease_seconds=float(os.getenv('SYNC_JOB_LEASE_SECONDS', '60'))
+)
+if not worker_process_import:
+    sync_jobs.start()
+
+
 @app.route('/api/sync/execute', methods=['POST'])
 def sync_execute():
-    """同期実行"""
+    """同期実行（ジョブを登録してすぐにジョブIDを返す）"""
     try:
         data = request.json
         csv_data = data.get('csvData', {})
         mapping = data.get('mapping', {})
         
         session_id = csv_data.get('session_id')
-        if not session_id or session_id not in uploaded_csv_data:
+        if not upload_store.get_path(session_id):
             return jsonify({
                 'success': False,
                 'message': 'CSVデータが見つかりません'
             }), 400
         
-        # CSVデータを復元
-        file_content = uploaded_csv_data[session_id]['file_content']
-        file_data = base64.b64decode(file_content)
-        
-        with tempfile.NamedTemporaryFile(mode='wb', suffix='.csv', delete=False) as tmp_file:
-            tmp_file.write(file_data)
-            tmp_path = tmp_file.name
+        if mapping.get('email') is None:
+            return jsonify({
+                'success': False,
+                'message': 'メールアドレスフィールドが指定されていません'
+            }), 400
         
-        try:
-            # CSV読み込み
-            analyzer = CSVAnalyzer()
-            df = analyzer.read_csv(tmp_path)
-            
-            # 既存ユーザーを読み込み
-            sync_manager = UserSyncManager()
-            existing_users = sync_manager.load_existing_users(
-                os.path.join(os.path.dirname(__file__), '../sample-data/existing-saas-users.json')
-            )
-            
-            # ユーザー比較
-            new_users, update_users, delete_users = sync_manager.compare_users(
-                df, mapping, existing_users
+        # プレビュー後に入力が変わった場合は実行せず、プレビューの再表示を求める
+        reviewed_plan_id = data.get('planId')
+        if reviewed_plan_id:
+            _, _, current_plan_id = current_sync_plan(
+                upload_store.get_path(session_id), mapping, data.get('fullResync', False)
             )
-            
-            # 同期実行（開発環境なのでdry_run=True）
-            results = sync_manager.execute_sync(
-                new_users, update_users, delete_users, dry_run=True
-            )
-            
-            results['id'] = session_id
-            
-            return jsonify({
-                'success': True,
-                'results': results
-            })
-            
-        finally:
-            if os.path.exists(tmp_path):
-                os.remove(tmp_path)
+            if current_plan_id != reviewed_plan_id:
+                return jsonify({
+                    'success': False,
+                    'planChanged': True,
+                    'message': PLAN_CHANGED_MESSAGE
+                }), 409
+        
+        job_id = sync_jobs.submit({
+            'sessionId': session_id,
+            'mapping': mapping,
+            'fullResync': data.get('fullResync', False),
+            'planId': reviewed_plan_id
+        })
+        
+        return jsonify({
+            'success': True,
+            'jobId': job_id,
+            'status': 'queued'
+        }), 202
     
     except Exception as e:
         return jsonify({
@@ -261,24 +465,135 @@ def sync_execute():
         }), 500
 
 
+@app.route('/api/sync/jobs/<job_id>', methods=['GET'])
+def get_sync_job(job_id):
+    """同期ジョブの状態・途中経過を取得（終了後は result に同期結果を含む）"""
+    job = sync_jobs.get(job_id)
+    if job is None:
+        return jsonify({
+            'success': False,
+            'message': 'ジョブが見つかりません'
+        }), 404
+    
+    return jsonify({
+        'success': True,
+        'job': job
+    })
+
+
+# 途中経過の配信間隔（秒）と、変化がない場合に接続維持のコメントを送る間隔（秒）
+SYNC_EVENTS_INTERVAL = 0.5
+SYNC_EVENTS_KEEPALIVE = 15
+
+# 1回の接続で配信する時間の上限（秒）と、切断後にブラウザが再接続するまでの時間（ミリ秒）
+# 配信中はリクエストのスレッドを占有するため、一定時間ごとに切断して他のリクエストにスレッドを空ける
+# （EventSourceは retry の時間後に自動で再接続し、再接続時は最新の途中経過から配信する）
+SYNC_EVENTS_MAX_SECONDS = 30
+SYNC_EVENTS_RETRY_MS = 3000
+
+# ワーカープロセスごとに同時に配信する接続数の上限（gunicornのスレッド数（Dockerfileでは8）より少なくし、
+# 上限を超えた接続は503を返してポーリングに切り替えさせる）
+SYNC_EVENTS_MAX_STREAMS = int(os.getenv('SYNC_EVENTS_MAX_STREAMS', '4'))
+sync_event_streams = threading.BoundedSemaphore(SYNC_EVENTS_MAX_STREAMS)
+
+
+@app.route('/api/sync/jobs/<job_id>/events', methods=['GET'])
+def stream_sync_job(job_id):
+    """
+    同期ジョブの途中経過をServer-Sent Eventsで配信
+    件数が変わるたびに progress イベント（件数・処理速度・残り時間・直近のエラー）を送り、
+    ジョブが終了したら end イベントを送って接続を閉じる
+    SYNC_EVENTS_MAX_SECONDS を過ぎたら接続を閉じ、ブラウザに再接続させる
+    """
+    if sync_jobs.get(job_id) is None:
+        return jsonify({
+            'success': False,
+            'message': 'ジョブが見つかりません'
+        }), 404
+    
+    if not sync_event_streams.acquire(blocking=False):
+        return jsonify({
+            'success': False,
+            'message': '途中経過の配信が混み合っています'
+        }), 503
+    
+    def generate():
+        started_at = time.time()
+        last_progress = None
+        last_sent_at = started_at
+        yield f'retry: {SYNC_EVENTS_RETRY_MS}\n\n'
+        while time.time() - started_at < SYNC_EVENTS_MAX_SECONDS:
+            job = sync_jobs.get(job_id)
+            if job is None:
+                return
+            
+            if job['status'] in TERMINAL_STATUSES:
+                yield _sse('end', dict(progress_event(job['progress']), status=job['status'], error=job['error']))
+                return
+            
+            if job['progress'] != last_progress:
+                last_progress = job['progress']
+                last_sent_at = time.time()
+                yield _sse('progress', dict(progress_event(job['progress']), status=job['status']))
+            elif time.time() - last_sent_at >= SYNC_EVENTS_KEEPALIVE:
+                last_sent_at = time.time()
+                yield ': keep-alive\n\n'
+            
+            time.sleep(SYNC_EVENTS_INTERVAL)
+    
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        # nginxなどのプロキシでバッファリングさせない
+        'X-Accel-Buffering': 'no'
+    })
+    # 配信の終了時・クライアントの切断時に枠を返す（配信を開始する前に切断された場合も呼び出される）
+    response.call_on_close(sync_event_streams.release)
+    return response
+
+
+def _sse(event, data):
+    return f'event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n'
+
+
+@app.route('/api/sync/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_sync_job(job_id):
+    """同期ジョブの中止（実行中の場合は未実行の操作を中止する）"""
+    job = sync_jobs.cancel(job_id)
+    if job is None:
+        return jsonify({
+            'success': False,
+            'message': 'ジョブが見つかりません'
+        }), 404
+    
+    return jsonify({
+        'success': True,
+        'job': job
+    })
+
+
 @app.route('/api/sync/download-log', methods=['POST'])
 def download_log():
-    """処理ログのダウンロード"""
+    """処理ログのダウンロード（ファイルを少しずつ読み込んで返す）"""
     try:
-        # ダミーのログデータを生成
-        log_data = """処理日時,操作,メールアドレス,結果,エラー内容
-2024-01-20 10:30:00,追加,tanaka.jiro@example.com,成功,
-2024-01-20 10:30:01,追加,yamada.hanako@example.com,成功,
-2024-01-20 10:30:02,追加,sasaki.taro@example.com,成功,
-2024-01-20 10:30:03,更新,suzuki.hanako@example.com,成功,
-2024-01-20 10:30:04,更新,kobayashi.takeshi@example.com,成功,
-2024-01-20 10:30:05,削除,sato.yuki@example.com,成功,
-2024-01-20 10:30:06,削除,ito.hiroshi@example.com,成功,"""
+        data = request.json or {}
+        try:
+            log_path = upload_store.artifact_path(data.get('resultId'), log_artifact(data.get('logId')))
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'message': str(e)
+            }), 400
+        
+        if not log_path or not os.path.exists(log_path):
+            return jsonify({
+                'success': False,
+                'message': '処理ログが見つかりません'
+            }), 404
         
-        return log_data, 200, {
+        return Response(stream_with_context(iter_log(log_path)), headers={
             'Content-Type': 'text/csv; charset=utf-8',
             'Content-Disposition': 'attachment; filename=sync-log.csv'
-        }
+        })
     
     except Exception as e:
         return jsonify({
@@ -287,6 +602,12 @@ def download_log():
         }), 500
 
 
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """処理段階ごとのメトリクス（Prometheus のテキスト形式、全ワーカープロセスの合計）"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
 @app.route('/api/mappings', methods=['GET'])
 def get_mappings():
     """保存済みマッピング設定を取得"""
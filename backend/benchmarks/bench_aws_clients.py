@@ -0,0 +1,59 @@
+"""
+AWSクライアント作成のコールド/ウォーム比較ベンチマーク
+Lambdaの呼び出しごとにクライアントを作成していた場合と、共有レジストリから取得する場合の時間を比較する
+（ネットワークには接続しないため、TLSハンドシェイクの削減分は含まない）
+
+使い方:
+    cd backend
+    python benchmarks/bench_aws_clients.py --invocations 20
+"""
+import argparse
+import os
+import sys
+import time
+
+import boto3
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault('AWS_REGION', 'ap-northeast-1')
+
+from utils.aws_clients import get_client, get_resource, get_stats
+from utils.user_sync import UserSyncManager
+
+
+def measure(func, invocations: int) -> float:
+    """1回あたりの平均時間（ミリ秒）"""
+    start = time.perf_counter()
+    for _ in range(invocations):
+        func()
+    return (time.perf_counter() - start) * 1000 / invocations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--invocations', type=int, default=20)
+    args = parser.parse_args()
+    region = os.environ['AWS_REGION']
+
+    cold_client = measure(lambda: boto3.client('cognito-idp', region_name=region), args.invocations)
+    cold_resource = measure(lambda: boto3.resource('dynamodb', region_name=region), args.invocations)
+
+    # 初回作成分はレジストリの統計に記録される
+    get_client('cognito-idp')
+    get_resource('dynamodb')
+    warm_client = measure(lambda: UserSyncManager('benchmark-pool'), args.invocations)
+    warm_resource = measure(lambda: get_resource('dynamodb'), args.invocations)
+
+    print(f'{"":<28} {"per invocation(ms)":>20}')
+    print(f'{"cognito-idp client (new)":<28} {cold_client:>20.2f}')
+    print(f'{"cognito-idp client (shared)":<28} {warm_client:>20.2f}')
+    print(f'{"dynamodb resource (new)":<28} {cold_resource:>20.2f}')
+    print(f'{"dynamodb resource (shared)":<28} {warm_resource:>20.2f}')
+    print()
+    for name, stats in get_stats().items():
+        print(f'{name}: created={stats["created"]} init_ms={stats["init_ms"]:.1f} hits={stats["hits"]}')
+
+
+if __name__ == '__main__':
+    main()
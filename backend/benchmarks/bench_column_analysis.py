@@ -0,0 +1,83 @@
+"""
+カラム分析の直列/並列ベンチマーク
+カラム数を変えながら auto_detect_fields の処理時間を比較し、並列化が有利になるカラム数（損益分岐点）を表示する
+
+使い方:
+    cd backend
+    python benchmarks/bench_column_analysis.py --workers 4 --rows 1000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.csv_analyzer import CSVAnalyzer
+
+COLUMN_COUNTS = [25, 50, 100, 150, 200, 300, 400, 600, 800]
+
+VALUE_POOL = [
+    '田中太郎', '鈴木花子', 'タナカタロウ', 'tanaka.taro@example.com', '営業部', '技術部',
+    '部長', '課長', 'Manager', 'Staff', 'E001', '2015-04-01', 'Active', ''
+]
+
+
+def make_wide_frame(columns: int, rows: int, seed: int = 0) -> pd.DataFrame:
+    """HRシステムの出力を模した横長のDataFrameを生成"""
+    rng = random.Random(seed)
+    return pd.DataFrame({
+        f'項目{i}': [rng.choice(VALUE_POOL) for _ in range(rows)]
+        for i in range(columns)
+    })
+
+
+def best_of(func, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    serial = CSVAnalyzer()
+    parallel = CSVAnalyzer(workers=args.workers, parallel_threshold=0)
+
+    # プロセスプールの起動時間は計測に含めない
+    parallel.auto_detect_fields(make_wide_frame(args.workers, 10))
+
+    print(f'workers={args.workers} rows={args.rows}')
+    print(f'{"columns":>8} {"serial(ms)":>12} {"parallel(ms)":>13} {"speedup":>8}')
+
+    crossover = None
+    for columns in COLUMN_COUNTS:
+        df = make_wide_frame(columns, args.rows)
+        if serial.auto_detect_fields(df) != parallel.auto_detect_fields(df):
+            raise AssertionError(f'serial and parallel results differ at {columns} columns')
+
+        serial_time = best_of(lambda: serial.auto_detect_fields(df), args.repeat)
+        parallel_time = best_of(lambda: parallel.auto_detect_fields(df), args.repeat)
+        speedup = serial_time / parallel_time
+        if crossover is None and speedup > 1.0:
+            crossover = columns
+        print(f'{columns:>8} {serial_time * 1000:>12.1f} {parallel_time * 1000:>13.1f} {speedup:>7.2f}x')
+
+    if crossover is None:
+        print('parallel mode was not faster for any column count')
+    else:
+        print(f'crossover: parallel is faster from about {crossover} columns')
+
+
+if __name__ == '__main__':
+    main()
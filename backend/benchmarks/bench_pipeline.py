@@ -0,0 +1,186 @@
+"""
+CSV解析・同期処理のベンチマーク
+生成した人事システムのエクスポートで、処理ごと（エンコーディング判定・CSV読み込み・フィールド自動検出・
+プレビュー・ユーザー比較・同期実行）の処理時間を計測し、結果をJSONで出力する
+コミット間で結果のJSONを比較して性能の劣化を確認する
+
+使い方:
+    cd backend
+    python benchmarks/bench_pipeline.py --rows 1000,10000,100000 --output bench-results.json
+    python benchmarks/bench_pipeline.py --rows 1000000 --layouts split_name --encodings cp932 --skip execute_sync
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from generate_hr_data import ENCODINGS, LAYOUTS, generate_people, write_existing_users, write_hr_export
+from utils import encoding_detector, file_hash
+from utils.csv_analyzer import CSVAnalyzer
+from utils.user_directory import UserDirectory
+from utils.user_sync import UserSyncManager
+
+# 計測する処理
+BENCHMARKS = ('detect_encoding', 'read_csv', 'auto_detect_fields', 'get_preview_data', 'compare_users', 'execute_sync')
+
+# 同期実行の計測ではレート制限で待たないよう十分に大きな値にする
+UNLIMITED_RATES = {'create': 1e9, 'update': 1e9, 'delete': 1e9}
+
+
+class NullCognitoClient:
+    """何もしないCognitoクライアント（同期実行の並列化・集計の処理時間のみを計測する）"""
+
+    def admin_create_user(self, **kwargs):
+        return {'User': {'Username': kwargs['Username'], 'Attributes': kwargs.get('UserAttributes', [])}}
+
+    def admin_update_user_attributes(self, **kwargs):
+        return {}
+
+    def admin_delete_user(self, **kwargs):
+        return {}
+
+
+def measure(func, repeat: int, setup=None) -> dict:
+    """repeat 回実行した処理時間（秒）の最小値・平均値と各回の値"""
+    runs = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        runs.append(time.perf_counter() - start)
+    return {'seconds': min(runs), 'mean': statistics.mean(runs), 'runs': runs}
+
+
+def clear_caches():
+    # エンコーディング判定とファイルハッシュのキャッシュを消して、毎回判定し直させる
+    with encoding_detector._cache_lock:
+        encoding_detector._cache.clear()
+    with file_hash._memo_lock:
+        file_hash._memo.clear()
+
+
+def run_case(workdir: str, layout: str, encoding: str, rows: int, repeat: int, skip: set, workers: int) -> list:
+    """1つのデータ（形式・エンコーディング・行数）で各処理を計測"""
+    case_dir = os.path.join(workdir, f'{layout}-{encoding}-{rows}')
+    os.makedirs(case_dir, exist_ok=True)
+    csv_path = os.path.join(case_dir, 'export.csv')
+    users_path = os.path.join(case_dir, 'users.json')
+
+    people = generate_people(rows)
+    mapping = write_hr_export(csv_path, layout, people, encoding)
+    expected = write_existing_users(users_path, layout, people)
+
+    analyzer = CSVAnalyzer()
+    df = analyzer.read_csv(csv_path)
+    directory = UserDirectory(os.path.join(case_dir, 'directory'), source_path=users_path)
+    existing_users = directory.load()
+
+    results = []
+
+    def record(name, timing, items=rows):
+        results.append(dict(
+            benchmark=name, layout=layout, encoding=encoding, rows=rows,
+            itemsPerSecond=round(items / timing['seconds'], 1) if timing['seconds'] > 0 else None,
+            **timing
+        ))
+
+    if 'detect_encoding' not in skip:
+        record('detect_encoding', measure(lambda: analyzer.detect_encoding(csv_path), repeat, clear_caches))
+    if 'read_csv' not in skip:
+        record('read_csv', measure(lambda: analyzer.read_csv(csv_path), repeat, clear_caches))
+    if 'auto_detect_fields' not in skip:
+        record('auto_detect_fields', measure(lambda: analyzer.auto_detect_fields(df), repeat))
+    if 'get_preview_data' not in skip:
+        record('get_preview_data', measure(lambda: analyzer.get_preview_data(df), repeat))
+
+    sync_manager = UserSyncManager()
+    compared = sync_manager.compare_users(df, mapping, existing_users)
+    summary = {'toAdd': len(compared[0]), 'toUpdate': len(compared[1]), 'toDelete': len(compared[2])}
+    if summary != expected:
+        raise AssertionError(f'{layout}/{encoding}/{rows}: 比較結果が想定と異なります: {summary} != {expected}')
+
+    if 'compare_users' not in skip:
+        record('compare_users', measure(lambda: sync_manager.compare_users(df, mapping, existing_users), repeat))
+    if 'execute_sync' not in skip:
+        executor = UserSyncManager(
+            cognito_user_pool_id='benchmark', cognito_client=NullCognitoClient(),
+            max_workers=workers, rate_limits=UNLIMITED_RATES
+        )
+        operations = sum(len(users) for users in compared)
+        record('execute_sync', measure(lambda: executor.execute_sync(*compared), repeat), items=operations)
+
+    shutil.rmtree(case_dir, ignore_errors=True)
+    return results
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'cpuCount': os.cpu_count(),
+        'timestamp': datetime.now().isoformat()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', default='1000,10000,100000', help='行数（カンマ区切り）')
+    parser.add_argument('--layouts', default=','.join(LAYOUTS), help='CSVの形式（カンマ区切り）')
+    parser.add_argument('--encodings', default=','.join(ENCODINGS), help='エンコーディング（カンマ区切り）')
+    parser.add_argument('--skip', default='', help='計測しない処理（カンマ区切り）')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=8, help='同期実行の並列数')
+    parser.add_argument('--output', help='結果のJSONの出力先（省略時は標準出力）')
+    args = parser.parse_args()
+
+    skip = {name for name in args.skip.split(',') if name}
+    unknown = skip - set(BENCHMARKS)
+    if unknown:
+        parser.error(f'unknown benchmark: {", ".join(sorted(unknown))}')
+
+    workdir = tempfile.mkdtemp(prefix='bench-pipeline-')
+    results = []
+    try:
+        for rows in (int(value) for value in args.rows.split(',')):
+            for layout in args.layouts.split(','):
+                for encoding in args.encodings.split(','):
+                    case = run_case(workdir, layout, encoding, rows, args.repeat, skip, args.workers)
+                    for result in case:
+                        print(f'{result["benchmark"]:>20} {layout:>10} {encoding:>6} {rows:>8} '
+                              f'{result["seconds"] * 1000:>10.1f}ms', file=sys.stderr)
+                    results.extend(case)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = json.dumps({'environment': environment(), 'results': results}, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(report + '\n')
+    else:
+        print(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+"""
+Cognitoとの同期実行のスループットの負荷試験
+ローカルのCognitoの代替（FakeCognitoClient）に遅延・スロットリング・エラーを注入し、
+並列数ごとに同期実行（追加・更新・削除）とユーザー一覧の取得を計測して、結果をJSONで出力する
+実際のユーザープールに接続せずに、並列数・再試行・レート制限の効果を同じ条件で比較する
+
+使い方:
+    cd backend
+    python benchmarks/bench_sync_throughput.py --rows 2000 --workers 1,4,8,16 --latency 0.05
+    python benchmarks/bench_sync_throughput.py --rows 2000 --throttle-rate 0.05 --error-rate 0.01 --quotas cognito
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from bench_pipeline import environment
+from generate_hr_data import generate_people, write_existing_users, write_hr_export
+from utils.cognito_executor import DEFAULT_RATE_LIMITS
+from utils.cognito_fake import DEFAULT_QUOTAS, FakeCognitoClient
+from utils.csv_analyzer import CSVAnalyzer
+from utils.user_directory import UserDirectory
+from utils.user_sync import UserSyncManager
+
+# 負荷試験に使うCSVの形式
+LAYOUT = 'japanese'
+
+
+def load_case(workdir: str, rows: int):
+    """CSVと既存ユーザーを生成し、比較結果（追加・更新・削除の対象）と既存ユーザーを返す"""
+    csv_path = os.path.join(workdir, 'export.csv')
+    users_path = os.path.join(workdir, 'users.json')
+    people = generate_people(rows)
+    mapping = write_hr_export(csv_path, LAYOUT, people)
+    write_existing_users(users_path, LAYOUT, people)
+
+    df = CSVAnalyzer().read_csv(csv_path)
+    existing_users = UserDirectory(os.path.join(workdir, 'directory'), source_path=users_path).load()
+    compared = UserSyncManager().compare_users(df, mapping, existing_users)
+    return compared, [dict(user) for user in existing_users.values()]
+
+
+def expected_state(existing_users: list, compared) -> dict:
+    """同期が全て成功した場合のメールアドレスごとの役職・部署"""
+    new_users, update_users, delete_users = compared
+    state = {user['email']: (user.get('position'), user.get('department')) for user in existing_users}
+    for user in new_users:
+        state[user['email']] = (user['position'], user['department'])
+    for user in update_users:
+        state[user['email']] = (user['new_data']['position'], user['new_data']['department'])
+    for user in delete_users:
+        del state[user['email']]
+    return state
+
+
+def run_sync(compared, existing_users: list, workers: int, fake_options: dict, rate_limits: dict) -> dict:
+    """同期実行を1回計測（ユーザープールは毎回既存ユーザーの状態から始める）"""
+    client = FakeCognitoClient(users=existing_users, **fake_options)
+    manager = UserSyncManager(
+        cognito_user_pool_id='benchmark', cognito_client=client, max_workers=workers, rate_limits=rate_limits
+    )
+    start = time.perf_counter()
+    results = manager.execute_sync(*compared)
+    seconds = time.perf_counter() - start
+
+    operations = sum(len(users) for users in compared)
+    state = {
+        email: (attributes.get('custom:position'), attributes.get('custom:department'))
+        for email, attributes in client.users().items()
+    }
+    return {
+        'benchmark': 'execute_sync',
+        'workers': workers,
+        'operations': operations,
+        'seconds': seconds,
+        'operationsPerSecond': round(operations / seconds, 1) if seconds > 0 else None,
+        'added': results['added'],
+        'updated': results['updated'],
+        'deleted': results['deleted'],
+        'errors': len(results['errors']),
+        'consistent': state == expected_state(existing_users, compared),
+        'calls': client.stats()
+    }
+
+
+def run_list(existing_users: list, workers: int, fake_options: dict, workdir: str) -> dict:
+    """Cognitoからの既存ユーザー一覧の取得を1回計測"""
+    client = FakeCognitoClient(users=existing_users, **fake_options)
+    directory = UserDirectory(
+        os.path.join(workdir, f'list-{workers}'), cognito_user_pool_id='benchmark',
+        cognito_client=client, max_workers=workers
+    )
+    start = time.perf_counter()
+    loaded = directory.load(refresh=True)
+    seconds = time.perf_counter() - start
+    return {
+        'benchmark': 'list_users',
+        'workers': workers,
+        'operations': len(existing_users),
+        'seconds': seconds,
+        'operationsPerSecond': round(len(existing_users) / seconds, 1) if seconds > 0 else None,
+        'consistent': set(loaded.keys()) == {user['email'] for user in existing_users},
+        'calls': client.stats()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=2000, help='CSVの行数')
+    parser.add_argument('--workers', default='1,4,8,16', help='並列数（カンマ区切り）')
+    parser.add_argument('--latency', type=float, default=0.02, help='1回の呼び出しの遅延（秒）')
+    parser.add_argument('--latency-jitter', type=float, default=0.0, help='遅延に加えるばらつきの上限（秒）')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='スロットリングにする呼び出しの割合')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='一時的なエラーにする呼び出しの割合')
+    parser.add_argument('--quotas', choices=('none', 'cognito'), default='none',
+                        help='ユーザープール側のクォータ（cognito: 実際の既定値）')
+    parser.add_argument('--rate-limit-scale', type=float, default=1.0,
+                        help='同期実行側のレート制限の倍率（クォータとの差による再試行の確認用）')
+    parser.add_argument('--skip-list', action='store_true', help='ユーザー一覧の取得を計測しない')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='結果のJSONの出力先（省略時は標準出力）')
+    args = parser.parse_args()
+
+    rate_limits = {operation: rate * args.rate_limit_scale for operation, rate in DEFAULT_RATE_LIMITS.items()}
+    fake_options = {
+        'latency': args.latency,
+        'latency_jitter': args.latency_jitter,
+        'throttle_rate': args.throttle_rate,
+        'error_rate': args.error_rate,
+        'quotas': DEFAULT_QUOTAS if args.quotas == 'cognito' else None,
+        'seed': args.seed
+    }
+
+    workdir = tempfile.mkdtemp(prefix='bench-sync-')
+    results = []
+    try:
+        compared, existing_users = load_case(workdir, args.rows)
+        for workers in (int(value) for value in args.workers.split(',')):
+            case = [run_sync(compared, existing_users, workers, fake_options, rate_limits)]
+            if not args.skip_list:
+                case.append(run_list(existing_users, workers, fake_options, workdir))
+            for result in case:
+                print(f'{result["benchmark"]:>14} workers={workers:<3} {result["operations"]:>7} ops '
+                      f'{result["seconds"]:>8.2f}s {result["operationsPerSecond"] or 0:>9.1f} ops/s '
+                      f'consistent={result["consistent"]}', file=sys.stderr)
+            results.extend(case)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = json.dumps({
+        'environment': environment(),
+        'options': dict(fake_options, rows=args.rows, rateLimits=rate_limits),
+        'results': results
+    }, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(report + '\n')
+    else:
+        print(report)
+
+
+if __name__ == '__main__':
+    main()
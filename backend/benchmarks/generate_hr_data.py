@@ -0,0 +1,192 @@
+"""
+ベンチマーク用の人事システムエクスポート（CSV）と既存ユーザー（JSON）の生成
+sample-data の4種類のCSVと同じ形式（日本語・英語の見出し、氏名の分割、コード体系）で、任意の行数のデータを生成する
+
+使い方:
+    cd backend
+    python benchmarks/generate_hr_data.py --layout split_name --rows 100000 --encoding cp932 --output-dir /tmp/hr
+"""
+import argparse
+import csv
+import json
+import os
+import random
+import sys
+from typing import Dict, List
+
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.field_projection import project_users
+
+# 姓（漢字, カナ, ローマ字）
+SURNAMES = [
+    ('田中', 'タナカ', 'tanaka'), ('鈴木', 'スズキ', 'suzuki'), ('佐藤', 'サトウ', 'sato'),
+    ('高橋', 'タカハシ', 'takahashi'), ('伊藤', 'イトウ', 'ito'), ('渡辺', 'ワタナベ', 'watanabe'),
+    ('山本', 'ヤマモト', 'yamamoto'), ('中村', 'ナカムラ', 'nakamura'), ('小林', 'コバヤシ', 'kobayashi'),
+    ('加藤', 'カトウ', 'kato'), ('吉田', 'ヨシダ', 'yoshida'), ('山田', 'ヤマダ', 'yamada'),
+    ('佐々木', 'ササキ', 'sasaki'), ('山口', 'ヤマグチ', 'yamaguchi'), ('松本', 'マツモト', 'matsumoto'),
+    ('中野', 'ナカノ', 'nakano')
+]
+
+# 名（漢字, カナ, ローマ字）
+GIVEN_NAMES = [
+    ('太郎', 'タロウ', 'taro'), ('花子', 'ハナコ', 'hanako'), ('一郎', 'イチロウ', 'ichiro'),
+    ('次郎', 'ジロウ', 'jiro'), ('雪', 'ユキ', 'yuki'), ('洋', 'ヒロシ', 'hiroshi'), ('武', 'タケシ', 'takeshi'),
+    ('由紀', 'ユキ', 'yuki'), ('健', 'ケン', 'ken'), ('美咲', 'ミサキ', 'misaki'), ('翔太', 'ショウタ', 'shota'),
+    ('陽菜', 'ヒナ', 'hina'), ('大輔', 'ダイスケ', 'daisuke'), ('愛', 'アイ', 'ai')
+]
+
+# 部署（日本語, 英語, コード）
+DEPARTMENTS = [
+    ('営業部', 'Sales', 'S001'), ('経理部', 'Accounting', 'A001'), ('技術部', 'Engineering', 'T001'),
+    ('人事部', 'Human Resources', 'H001'), ('総務部', 'General Affairs', 'G001'),
+    ('マーケティング部', 'Marketing', 'M001'), ('開発部', 'Development', 'D001')
+]
+
+# 役職（日本語, 英語, コード）
+POSITIONS = [
+    ('一般社員', 'Staff', 'P001'), ('主任', 'Supervisor', 'P002'), ('係長', 'Assistant Manager', 'P003'),
+    ('課長', 'Manager', 'P004'), ('部長', 'Director', 'P005')
+]
+
+# CSVの形式（sample-data の hr-system-export-1〜4 と同じ見出しと列の並び）と、対応するフィールドマッピング
+LAYOUTS = {
+    'japanese': {
+        'headers': ['メールアドレス', '氏名', '所属部署', '役職名', '入社日'],
+        'mapping': {'email': 0, 'name': 1, 'department': 2, 'position': 3}
+    },
+    'coded': {
+        'headers': ['社員番号', '社員名（漢字）', '社員名（カナ）', 'Eメール', '部門コード', '部門名', '職位コード', '職位名'],
+        'mapping': {'email': 3, 'name': 1, 'department': 5, 'position': 7}
+    },
+    'english': {
+        'headers': ['Email Address', 'Full Name', 'Department Name', 'Job Title', 'Employee ID', 'Status'],
+        'mapping': {'email': 0, 'name': 1, 'department': 2, 'position': 3}
+    },
+    'split_name': {
+        'headers': ['社員番号', '姓', '名', 'メールアドレス', '部署名', '役職', '入社日'],
+        'mapping': {'email': 3, 'name': [1, 2], 'department': 4, 'position': 5}
+    }
+}
+
+# 対応するエンコーディング
+ENCODINGS = ('utf-8', 'cp932')
+
+
+def generate_people(rows: int, seed: int = 0) -> List[Dict]:
+    """社員の一覧を生成（メールアドレスは重複しない）"""
+    rng = random.Random(seed)
+    people = []
+    for i in range(rows):
+        surname = rng.choice(SURNAMES)
+        given = rng.choice(GIVEN_NAMES)
+        people.append({
+            'number': i + 1,
+            'surname': surname,
+            'given': given,
+            'email': f'{given[2]}.{surname[2]}{i + 1}@example.com',
+            'department': rng.choice(DEPARTMENTS),
+            'position': rng.choice(POSITIONS),
+            'joined': f'{rng.randint(1990, 2024)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}',
+            'active': rng.random() > 0.05
+        })
+    return people
+
+
+def format_row(layout: str, person: Dict) -> List:
+    """社員1名分の行を形式に合わせて作成"""
+    surname, given = person['surname'], person['given']
+    department, position = person['department'], person['position']
+    if layout == 'japanese':
+        return [person['email'], surname[0] + given[0], department[0], position[0], person['joined']]
+    if layout == 'coded':
+        return [
+            f'E{person["number"]:06d}', surname[0] + given[0], surname[1] + given[1], person['email'],
+            department[2], department[0], position[2], position[0]
+        ]
+    if layout == 'english':
+        return [
+            person['email'], f'{given[2].title()} {surname[2].title()}', department[1], position[1],
+            1000 + person['number'], 'Active' if person['active'] else 'Inactive'
+        ]
+    if layout == 'split_name':
+        return [
+            f'E{person["number"]:06d}', surname[0], given[0], person['email'], department[0], position[0],
+            person['joined']
+        ]
+    raise ValueError(f'未対応の形式です: {layout}')
+
+
+def write_hr_export(path: str, layout: str, people: List[Dict], encoding: str = 'utf-8') -> Dict:
+    """人事システムのエクスポートを書き出し、対応するフィールドマッピングを返す"""
+    with open(path, 'w', encoding=encoding, newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(LAYOUTS[layout]['headers'])
+        writer.writerows(format_row(layout, person) for person in people)
+    return LAYOUTS[layout]['mapping']
+
+
+def write_existing_users(path: str, layout: str, people: List[Dict], keep_ratio: float = 0.9,
+                         change_ratio: float = 0.1, extra_ratio: float = 0.05, seed: int = 0) -> Dict[str, int]:
+    """
+    既存ユーザー（existing-saas-users.json と同じ形式）を書き出す
+    CSVの社員のうち keep_ratio を登録済みとし、そのうち change_ratio は役職・部署を変えておく
+    CSVに含まれないユーザーを extra_ratio だけ加える（削除対象）
+    戻り値: 想定される追加・更新・削除の件数
+    """
+    rng = random.Random(seed + 1)
+    frame = pd.DataFrame([format_row(layout, person) for person in people], columns=LAYOUTS[layout]['headers'])
+    projected = project_users(frame, LAYOUTS[layout]['mapping']).to_dict('records')
+
+    users = []
+    changed = 0
+    for i, user in enumerate(projected):
+        if rng.random() >= keep_ratio:
+            continue
+        record = {'id': f'cognito-{i + 1:07d}', **user}
+        if rng.random() < change_ratio:
+            record['position'] = record['position'] + '（旧）'
+            changed += 1
+        users.append(record)
+
+    extra = int(len(people) * extra_ratio)
+    for i in range(extra):
+        users.append({
+            'id': f'cognito-retired-{i + 1:07d}',
+            'email': f'retired{i + 1}@example.com',
+            'name': '退職者',
+            'position': '一般社員',
+            'department': '総務部'
+        })
+
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'users': users}, f, ensure_ascii=False)
+    return {'toAdd': len(people) - (len(users) - extra), 'toUpdate': changed, 'toDelete': extra}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--layout', choices=sorted(LAYOUTS), default='japanese')
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--encoding', choices=ENCODINGS, default='utf-8')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output-dir', default='.')
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    base = os.path.join(args.output_dir, f'hr-{args.layout}-{args.encoding}-{args.rows}')
+    people = generate_people(args.rows, args.seed)
+    mapping = write_hr_export(base + '.csv', args.layout, people, args.encoding)
+    expected = write_existing_users(base + '.users.json', args.layout, people, seed=args.seed)
+    print(json.dumps({
+        'csv': base + '.csv',
+        'existingUsers': base + '.users.json',
+        'mapping': mapping,
+        'expected': expected
+    }, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -3,6 +3,16 @@ import base64
 import os
 import tempfile
 from utils.csv_analyzer import CSVAnalyzer
+from utils.parse_cache import ParsedCSVCache
+
+# ウォームスタート時は同じ内容のCSVの解析を省略（/tmpはコンテナ内で保持される）
+parse_cache = ParsedCSVCache(
+    os.path.join(tempfile.gettempdir(), 'csv-loader-parsed'),
+    max_bytes=256 * 1024 * 1024
+)
+
+# アナライザーはキーワード表の構築済みのものを呼び出しをまたいで再利用
+analyzer = CSVAnalyzer(parse_cache=parse_cache)
 
 
 def lambda_handler(event, context):
@@ -31,22 +41,18 @@ def lambda_handler(event, context):
         
         try:
             # CSV解析
-            analyzer = CSVAnalyzer()
-            df = analyzer.read_csv(tmp_file_path)
-            
-            # フィールド自動検出
-            auto_mapping = analyzer.auto_detect_fields(df)
+            chunks = analyzer.read_csv_chunks(tmp_file_path)
             
-            # プレビューデータ取得
-            headers, preview = analyzer.get_preview_data(df)
+            # フィールド自動検出・プレビューデータ取得（チャンク単位で1回走査）
+            analysis = analyzer.analyze_chunks(chunks)
             
             # レスポンス作成
             response = {
                 'success': True,
-                'headers': headers,
-                'preview': preview,
-                'auto_mapping': auto_mapping,
-                'total_rows': len(df)
+                'headers': analysis['headers'],
+                'preview': analysis['preview'],
+                'auto_mapping': analysis['auto_mapping'],
+                'total_rows': analysis['total_rows']
             }
             
             return {
@@ -1,8 +1,8 @@
 import json
 import os
-import boto3
 from datetime import datetime
 from boto3.dynamodb.conditions import Key
+from utils.aws_clients import get_resource
 
 
 def lambda_handler(event, context):
@@ -79,7 +79,7 @@ def get_mappings(event, context):
         }
     
     # 本番環境ではDynamoDBから取得
-    dynamodb = boto3.resource('dynamodb')
+    dynamodb = get_resource('dynamodb')
     table_name = os.environ.get('DYNAMODB_TABLE_NAME', 'csv-loader-mappings')
     table = dynamodb.Table(table_name)
     
@@ -136,7 +136,7 @@ def save_mapping(event, context):
         }
     
     # 本番環境ではDynamoDBに保存
-    dynamodb = boto3.resource('dynamodb')
+    dynamodb = get_resource('dynamodb')
     table_name = os.environ.get('DYNAMODB_TABLE_NAME', 'csv-loader-mappings')
     table = dynamodb.Table(table_name)
     
@@ -5,17 +5,108 @@ import tempfile
 import pandas as pd
 from utils.user_sync import UserSyncManager
 from utils.csv_analyzer import CSVAnalyzer
+from utils.parse_cache import ParsedCSVCache
+from utils.user_directory import UserDirectory
+from utils.sharded_sync import (
+    LambdaShardBackend, LocalShardStorage, ProcessPoolShardBackend, S3ShardStorage, ShardedSync, run_status, sync_shard
+)
+
+# ウォームスタート時は同じ内容のCSVの解析を省略（/tmpはコンテナ内で保持される）
+parse_cache = ParsedCSVCache(
+    os.path.join(tempfile.gettempdir(), 'csv-loader-parsed'),
+    max_bytes=256 * 1024 * 1024
+)
+
+# アナライザーはキーワード表の構築済みのものを呼び出しをまたいで再利用
+analyzer = CSVAnalyzer(parse_cache=parse_cache)
+
+
+class ConfigurationError(Exception):
+    """Lambdaの環境変数の設定不備"""
+
+
+def _create_user_directory():
+    """
+    既存ユーザー一覧（開発環境では固定ファイル、本番環境ではCognitoから取得して/tmpにスナップショットを保存）
+    本番環境でユーザープールが未設定の場合は、サンプルのファイルを既存ユーザーとして扱わないよう ConfigurationError とする
+    """
+    store_dir = os.path.join(tempfile.gettempdir(), 'csv-loader-directory')
+    ttl_seconds = int(os.environ.get('USER_DIRECTORY_TTL', '300'))
+    if os.environ.get('ENV') == 'development':
+        return UserDirectory(
+            store_dir=store_dir, source_path='/var/task/sample-data/existing-saas-users.json', ttl_seconds=ttl_seconds
+        )
+    
+    cognito_pool_id = os.environ.get('COGNITO_USER_POOL_ID')
+    if not cognito_pool_id:
+        raise ConfigurationError('COGNITO_USER_POOL_ID が設定されていません（ENV=development 以外では必須です）')
+    return UserDirectory(store_dir=store_dir, cognito_user_pool_id=cognito_pool_id, ttl_seconds=ttl_seconds)
+
+
+# 既存ユーザー一覧（初回の使用時に作成し、ウォームスタート時は再利用する。設定不備の場合も初期化の失敗にせず、
+# 既存ユーザーを使わない呼び出し（シャード実行・実行状態の取得）は処理でき、それ以外はエラーの応答を返す）
+_user_directory = None
+
+
+def _get_user_directory():
+    global _user_directory
+    if _user_directory is None:
+        _user_directory = _create_user_directory()
+    return _user_directory
+
+# シャードの同時実行数（シャード実行用のLambdaの同時呼び出し数、またはローカルのワーカープロセス数）
+SHARD_CONCURRENCY = int(os.environ.get('SHARD_CONCURRENCY', '10'))
+
+
+def _shard_storage():
+    """
+    シャードの実行単位の保存先（SHARD_BACKEND=local の場合は/tmp、それ以外はシャードから参照できるS3のバケット）
+    """
+    if os.environ.get('SHARD_BACKEND') == 'local':
+        return LocalShardStorage(os.path.join(tempfile.gettempdir(), 'csv-loader-shards'))
+    bucket = os.environ.get('SHARD_BUCKET')
+    if not bucket:
+        raise ConfigurationError('SHARD_BUCKET が設定されていません（シャードに分割する場合は必須です）')
+    return S3ShardStorage(bucket)
+
+
+def _sharded_sync(context, shards, cognito_pool_id):
+    """
+    シャードの実行方法（SHARD_BACKEND=local の場合はローカルのプロセスプールで終了まで待ち、
+    それ以外は SHARD_FUNCTION_NAME（省略時はこの関数自身）をシャードごとに非同期呼び出しする）
+    """
+    if os.environ.get('SHARD_BACKEND') == 'local':
+        return ShardedSync(
+            shards, ProcessPoolShardBackend(max_workers=SHARD_CONCURRENCY), _shard_storage(),
+            cognito_user_pool_id=cognito_pool_id
+        )
+    function_name = os.environ.get('SHARD_FUNCTION_NAME') or context.function_name
+    return ShardedSync(
+        shards, LambdaShardBackend(function_name, max_concurrency=SHARD_CONCURRENCY), _shard_storage(),
+        cognito_user_pool_id=cognito_pool_id
+    )
 
 
 def lambda_handler(event, context):
     """
     ユーザー同期を実行するLambda関数
+    shards に2以上を指定した場合は、メールアドレスのハッシュで分割したシャードごとに比較・同期する
+    （Lambdaのシャードは非同期に起動して runId を返すため、shardRunId を指定した呼び出しで状態と合算した結果を取得する）
+    シャード実行モード（event に shardTask を含む呼び出し）では1つのシャードのみを処理して結果を保存する
     """
+    if 'shardTask' in event:
+        return sync_shard(event['shardTask'])
+    
     try:
         body = json.loads(event.get('body', '{}'))
+        if body.get('shardRunId'):
+            return _sharded_status(body['shardRunId'])
+        
         csv_data = body.get('csvData', {})
         mapping = body.get('mapping', {})
         dry_run = body.get('dryRun', True)
+        full_resync = body.get('fullResync', False)
+        shards = int(body.get('shards', 1))
         
         # CSV データを復元
         file_content = csv_data.get('file_content')
@@ -37,26 +128,26 @@ def lambda_handler(event, context):
             tmp_file_path = tmp_file.name
         
         try:
-            # CSV読み込み
-            analyzer = CSVAnalyzer()
-            df = analyzer.read_csv(tmp_file_path)
+            # CSV読み込み（チャンク単位）
+            chunks = analyzer.read_csv_chunks(tmp_file_path)
             
             # UserSyncManager初期化
             cognito_pool_id = os.environ.get('COGNITO_USER_POOL_ID')
+            # フィンガープリントは使わずに全件を比較する（/tmp の保存内容はコンテナごとに異なり、他のコンテナ・
+            # アプリ・コンソールからの変更を反映しないため、変わっていない行として比較を省略すると差分を見落とす）
             sync_manager = UserSyncManager(cognito_pool_id)
             
-            # 既存ユーザーを読み込み（開発環境では固定ファイルから）
-            if os.environ.get('ENV') == 'development':
-                existing_users = sync_manager.load_existing_users(
-                    '/var/task/sample-data/existing-saas-users.json'
+            # 既存ユーザーを読み込み（スナップショットが有効な間は再取得しない）
+            existing_users = _get_user_directory().load()
+            
+            if shards > 1:
+                return _run_sharded(
+                    context, tmp_file_path, mapping, existing_users, cognito_pool_id, shards, dry_run, full_resync
                 )
-            else:
-                # 本番環境では実際のデータソースから読み込み
-                existing_users = load_existing_users_from_db()
             
             # ユーザー比較
             new_users, update_users, delete_users = sync_manager.compare_users(
-                df, mapping, existing_users
+                chunks, mapping, existing_users, full_resync=full_resync
             )
             
             if dry_run:
@@ -85,6 +176,9 @@ def lambda_handler(event, context):
                     new_users, update_users, delete_users, dry_run=False
                 )
                 
+                # 同期によりCognitoのユーザーが変わったため、次回は一覧を再取得
+                _get_user_directory().invalidate()
+                
                 return {
                     'statusCode': 200,
                     'headers': {
@@ -102,6 +196,18 @@ def lambda_handler(event, context):
             if os.path.exists(tmp_file_path):
                 os.remove(tmp_file_path)
     
+    except ConfigurationError as e:
+        return {
+            'statusCode': 500,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({
+                'success': False,
+                'message': f'Lambdaの設定に不備があります: {str(e)}'
+            }, ensure_ascii=False)
+        }
     except Exception as e:
         return {
             'statusCode': 500,
@@ -116,7 +222,79 @@ def lambda_handler(event, context):
         }
 
 
-def load_existing_users_from_db():
-    """本番環境で既存ユーザーをDBから読み込む（実装が必要）"""
-    # TODO: DynamoDBなどから既存ユーザーを読み込む
-    return {}
\ No newline at end of file
+def _run_sharded(context, csv_path, mapping, existing_users, cognito_pool_id, shards, dry_run, full_resync):
+    """
+    シャードに分割して比較・同期する
+    ローカルのプロセスプールの場合は終了を待ち、分割しない場合と同じ形式で応答する（シャードごとの件数を加える）
+    Lambdaの場合はシャードを起動した時点で runId を返す（202）
+    """
+    sharded = _sharded_sync(context, shards, cognito_pool_id)
+    if os.environ.get('SHARD_BACKEND') == 'local':
+        merged = sharded.run(csv_path, mapping, existing_users, dry_run=dry_run, full_resync=full_resync)
+        return _sharded_response(merged)
+    
+    run_id = sharded.start(csv_path, mapping, existing_users, dry_run=dry_run, full_resync=full_resync)
+    return {
+        'statusCode': 202,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*'
+        },
+        'body': json.dumps({
+            'success': True,
+            'runId': run_id,
+            'shardCount': shards,
+            'completed': False
+        }, ensure_ascii=False)
+    }
+
+
+def _sharded_status(run_id):
+    """シャードの実行単位の状態（全シャードが終了していれば合算した結果）"""
+    try:
+        status = run_status(_shard_storage(), run_id)
+    except (ValueError, KeyError):
+        return {
+            'statusCode': 404,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({
+                'success': False,
+                'message': '指定された同期の実行が見つかりません'
+            }, ensure_ascii=False)
+        }
+    
+    if not status['completed']:
+        return {
+            'statusCode': 202,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps(dict(success=True, **status), ensure_ascii=False)
+        }
+    return _sharded_response(status)
+
+
+def _sharded_response(merged):
+    """合算したシャードの結果を、分割しない場合と同じ形式で応答する（シャードごとの件数を加える）"""
+    if 'results' not in merged:
+        body = {key: merged[key] for key in ('summary', 'newUsers', 'updateUsers', 'deleteUsers')}
+    else:
+        # 同期によりCognitoのユーザーが変わったため、次回は一覧を再取得
+        _get_user_directory().invalidate()
+        body = {'results': merged['results']}
+    
+    # 失敗したシャードがある場合は、成功したシャードの結果とあわせて返す（再実行した場合、反映済みのユーザーは差分なしとなる）
+    return {
+        'statusCode': 200 if not merged['failedShards'] else 500,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*'
+        },
+        'body': json.dumps(dict(
+            success=not merged['failedShards'], shards=merged['shards'], failedShards=merged['failedShards'], **body
+        ), ensure_ascii=False)
+    }
@@ -0,0 +1,107 @@
+"""
+AWSクライアント・リソースの共有レジストリ
+コンテナ（プロセス）内で初回利用時に1回だけ作成し、Lambdaのウォームスタート時や
+リクエストごとのインスタンス生成ではクライアントの構築とTLSハンドシェイクを省略する
+"""
+import os
+import threading
+import time
+from typing import Dict
+
+import boto3
+from botocore.config import Config
+
+# 接続プールのサイズは同期処理の並列数より大きくする
+CLIENT_CONFIG = Config(
+    max_pool_connections=int(os.getenv('AWS_MAX_POOL_CONNECTIONS', '32')),
+    tcp_keepalive=True,
+    connect_timeout=5,
+    read_timeout=30,
+    retries={'mode': 'standard', 'max_attempts': 3}
+)
+
+# botocoreでは再試行しないサービス（cognito-idpは CognitoSyncExecutor / call_with_retry のみで再試行し、
+# スロットリングをすぐにトークンバケットへ伝えて送信レートを下げる。二重に再試行すると1件の操作のリクエスト数が膨らむ）
+SINGLE_ATTEMPT_SERVICES = {'cognito-idp'}
+
+# 1回のみ送信する設定（呼び出し側で再試行する場合・再試行すると重複して実行される場合）
+SINGLE_ATTEMPT = Config(retries={'mode': 'standard', 'total_max_attempts': 1})
+
+_session = None
+_clients = {}
+_stats = {}
+_lock = threading.Lock()
+
+# boto3のリソースはスレッドセーフではないため、スレッドごとに保持する
+_local = threading.local()
+
+
+def get_client(service_name: str, region_name: str = None):
+    """サービスのクライアントを取得（初回のみ作成）"""
+    region_name = region_name or os.getenv('AWS_REGION')
+    key = ('client', service_name, region_name)
+    config = CLIENT_CONFIG.merge(SINGLE_ATTEMPT) if service_name in SINGLE_ATTEMPT_SERVICES else CLIENT_CONFIG
+
+    with _lock:
+        if key not in _clients:
+            _clients[key] = _timed(key, lambda: _get_session().client(
+                service_name, region_name=region_name, config=config
+            ))
+        else:
+            _stats[key]['hits'] += 1
+        return _clients[key]
+
+
+def get_resource(service_name: str, region_name: str = None):
+    """サービスのリソースを取得（スレッドごとに初回のみ作成）"""
+    region_name = region_name or os.getenv('AWS_REGION')
+    key = ('resource', service_name, region_name)
+    resources = _local.__dict__.setdefault('resources', {})
+
+    if key not in resources:
+        with _lock:
+            session = _get_session()
+            resources[key] = _timed(key, lambda: session.resource(
+                service_name, region_name=region_name, config=CLIENT_CONFIG
+            ))
+    else:
+        with _lock:
+            _stats[key]['hits'] += 1
+    return resources[key]
+
+
+def get_stats() -> Dict[str, Dict]:
+    """作成に要した時間と再利用回数を取得（ウォームスタートで削減できた時間の計測用）"""
+    with _lock:
+        return {':'.join(filter(None, key)): dict(value) for key, value in _stats.items()}
+
+
+def _after_fork():
+    # 接続プールのソケットを親プロセスと共有しないよう、子プロセスではクライアントを作り直す
+    global _session, _lock, _local
+    _session = None
+    _clients.clear()
+    _stats.clear()
+    _lock = threading.Lock()
+    _local = threading.local()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+def _get_session():
+    # boto3のデフォルトセッションはスレッドセーフではないため、専用のセッションを使用する
+    global _session
+    if _session is None:
+        _session = boto3.session.Session()
+    return _session
+
+
+def _timed(key, factory):
+    start = time.perf_counter()
+    instance = factory()
+    stats = _stats.setdefault(key, {'init_ms': 0.0, 'created': 0, 'hits': 0})
+    stats['init_ms'] += (time.perf_counter() - start) * 1000
+    stats['created'] += 1
+    return instance
@@ -0,0 +1,209 @@
+"""
+Cognitoへの同期処理の並列実行
+ワーカースレッドで並列にAPIを呼び出し、トークンバケットでCognitoのクォータ内に呼び出し頻度を抑える
+スロットリングされた場合は送信レートを下げ、一時的なエラーはジッター付きの指数バックオフで再試行する
+"""
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from botocore.exceptions import ConnectionError as BotocoreConnectionError
+from botocore.exceptions import HTTPClientError
+
+from utils.metrics import COGNITO_REQUEST_DURATION, COGNITO_REQUESTS, metrics
+
+# スロットリングを示すエラーコード
+THROTTLING_ERROR_CODES = {
+    'TooManyRequestsException',
+    'ThrottlingException',
+    'Throttling',
+    'RequestLimitExceeded',
+}
+
+# 再試行すれば成功する可能性のあるエラーコード
+TRANSIENT_ERROR_CODES = {
+    'InternalErrorException',
+    'InternalFailure',
+    'ServiceUnavailable',
+    'RequestTimeout',
+    'RequestTimeoutException',
+}
+
+# Cognitoのクォータ（1秒あたりのリクエスト数）
+# AdminCreateUserは「UserCreation」、更新・削除は「UserUpdate」カテゴリに属する
+DEFAULT_RATE_LIMITS = {
+    'create': 50.0,
+    'update': 25.0,
+    'delete': 25.0,
+}
+
+# 同じクォータを共有する操作
+RATE_LIMIT_GROUPS = {
+    'create': 'create',
+    'update': 'user_update',
+    'delete': 'user_update',
+}
+
+# 同時に投入する操作の数の上限（ワーカー数に対する倍率。全件を一度に投入すると、大量のユーザーの場合に
+# 実行待ちの操作がメモリに溜まるため、完了した分だけ追加で投入する）
+SUBMIT_WINDOW_PER_WORKER = 2
+
+
+class OperationCancelled(Exception):
+    """同期が中断されたため実行しなかった操作"""
+
+
+class TokenBucket:
+    """
+    スレッドセーフなトークンバケット
+    スロットリング時はレートを半分に下げ、成功するたびに上限まで少しずつ戻す（AIMD）
+    """
+
+    def __init__(self, rate: float, capacity: float = None, min_rate: float = 1.0):
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.capacity = capacity or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """トークンを1つ取得（不足している場合は補充されるまで待機）"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+                wait = (1.0 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def on_throttled(self):
+        """スロットリングされた場合はレートを半分に下げ、溜まっているトークンも破棄する"""
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._tokens = min(self._tokens, 0.0)
+
+    def on_success(self):
+        """成功した場合はレートを上限に向けて少しずつ戻す"""
+        with self._lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 50)
+
+
+class CognitoSyncExecutor:
+    """同期操作を並列・レート制限付きで実行するクラス"""
+
+    def __init__(self, max_workers: int = 8, rate_limits: Dict[str, float] = None,
+                 max_retries: int = 5, base_delay: float = 0.2, max_delay: float = 10.0):
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        limits = dict(DEFAULT_RATE_LIMITS, **(rate_limits or {}))
+        self._buckets = {}
+        for operation, group in RATE_LIMIT_GROUPS.items():
+            if group not in self._buckets:
+                self._buckets[group] = TokenBucket(limits[operation])
+
+    def run(self, operation: str, users: List[Dict], func: Callable[[Dict], None],
+            on_done: Callable[[Dict, Optional[Exception]], None] = None,
+            cancel_event: threading.Event = None) -> Tuple[int, List[Tuple[int, Dict, Exception]]]:
+        """
+        ユーザーごとに操作を並列実行し、成功件数と失敗した操作の一覧を返す
+        func はCognitoのAPIを呼び出すたびに call でレート制限・再試行を行う
+        失敗した操作は (入力の位置, ユーザー, 例外) の形式で、入力の順序に並べて返す
+        on_done は操作が終わるたびにワーカースレッドから (ユーザー, 例外またはNone) で呼び出す
+        cancel_event が設定された後の操作は実行せず、OperationCancelled の失敗として返す
+        """
+        if not users:
+            return 0, []
+
+        window = self.max_workers * SUBMIT_WINDOW_PER_WORKER
+        succeeded = 0
+        failures = []
+        pending = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            for index, user in enumerate(users):
+                if len(pending) >= window:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    succeeded += self._collect(done, pending, failures)
+                future = pool.submit(self._run_one, operation, func, user, on_done, cancel_event)
+                pending[future] = (index, user)
+            succeeded += self._collect(wait(pending).done, pending, failures)
+
+        failures.sort(key=lambda failure: failure[0])
+        return succeeded, failures
+
+    def call(self, operation: str, func: Callable[[], Any]) -> Any:
+        """CognitoのAPIを1回呼び出す（呼び出しごとに操作のクォータのトークンを取得し、一時的なエラーは再試行する）"""
+        bucket = self._buckets[RATE_LIMIT_GROUPS[operation]]
+        return call_with_retry(func, bucket, self.max_retries, self.base_delay, self.max_delay)
+
+    @staticmethod
+    def _collect(done, pending: Dict, failures: List) -> int:
+        """完了した操作を集計から外し、成功件数を返す（失敗した操作は failures に追加する）"""
+        succeeded = 0
+        for future in done:
+            index, user = pending.pop(future)
+            error = future.exception()
+            if error is None:
+                succeeded += 1
+            else:
+                failures.append((index, user, error))
+        return succeeded
+
+    def _run_one(self, operation: str, func: Callable[[Dict], None], user: Dict,
+                 on_done: Optional[Callable], cancel_event: Optional[threading.Event]):
+        if cancel_event is not None and cancel_event.is_set():
+            raise OperationCancelled()
+        start = time.perf_counter()
+        try:
+            func(user)
+        except Exception as e:
+            metrics.observe(COGNITO_REQUEST_DURATION, time.perf_counter() - start, operation=operation)
+            metrics.inc(COGNITO_REQUESTS, operation=operation, result='error')
+            if on_done is not None:
+                on_done(user, e)
+            raise
+        metrics.observe(COGNITO_REQUEST_DURATION, time.perf_counter() - start, operation=operation)
+        metrics.inc(COGNITO_REQUESTS, operation=operation, result='success')
+        if on_done is not None:
+            on_done(user, None)
+
+
+def call_with_retry(func: Callable[[], Any], bucket: TokenBucket, max_retries: int = 5,
+                    base_delay: float = 0.2, max_delay: float = 10.0) -> Any:
+    """スロットリング・一時的なエラーの場合はジッター付きの指数バックオフで再試行"""
+    for attempt in range(max_retries + 1):
+        bucket.acquire()
+        try:
+            result = func()
+            bucket.on_success()
+            return result
+        except Exception as e:
+            code = error_code(e)
+            if code in THROTTLING_ERROR_CODES:
+                bucket.on_throttled()
+            elif code not in TRANSIENT_ERROR_CODES and not isinstance(
+                    e, (BotocoreConnectionError, HTTPClientError)):
+                raise
+            if attempt == max_retries:
+                raise
+        # Full Jitter: 0〜上限の範囲でランダムに待機し、再試行のタイミングを分散させる
+        time.sleep(random.uniform(0, min(max_delay, base_delay * (2 ** attempt))))
+
+
+def error_code(error: Exception) -> Optional[str]:
+    """boto3のClientError形式の例外からエラーコードを取得"""
+    response = getattr(error, 'response', None)
+    if isinstance(response, dict):
+        return response.get('Error', {}).get('Code')
+    return None
@@ -0,0 +1,257 @@
+"""
+Cognito（cognito-idp）のローカル代替
+UserSyncManager・UserDirectory が使う操作（AdminCreateUser / AdminUpdateUserAttributes / AdminDeleteUserAttributes /
+AdminDeleteUser / ListUsers / DescribeUserPool）を
+メモリ上のユーザープールで再現し、呼び出しごとの遅延・スロットリング・エラーを注入できる
+実際のユーザープールに接続せずに、同期実行の並列数・再試行・レート制限の動作を再現可能な条件で負荷試験する
+"""
+import base64
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from botocore.exceptions import ClientError
+
+# 操作ごとのクォータの区分（同じ区分の操作はクォータを共有する）
+QUOTA_CATEGORIES = {
+    'AdminCreateUser': 'UserCreation',
+    'AdminUpdateUserAttributes': 'UserAccountUpdate',
+    'AdminDeleteUserAttributes': 'UserAccountUpdate',
+    'AdminDeleteUser': 'UserAccountUpdate',
+    'ListUsers': 'UserList',
+    'DescribeUserPool': 'UserPoolRead',
+}
+
+# 実際のユーザープールの既定のクォータ（1秒あたりのリクエスト数）
+DEFAULT_QUOTAS = {
+    'UserCreation': 50.0,
+    'UserAccountUpdate': 25.0,
+    'UserList': 30.0,
+    'UserPoolRead': 15.0,
+}
+
+# ListUsersの1ページあたりの最大件数
+MAX_LIST_LIMIT = 60
+
+# 注入するエラーのコード（再試行の対象になる一時的なエラー）
+INJECTED_ERROR_CODE = 'InternalErrorException'
+
+# ListUsersのフィルター（属性名 = "値" / 属性名 ^= "値"）
+_FILTER_PATTERN = re.compile(r'^\s*([\w:]+)\s*(\^?=)\s*"((?:[^"\\]|\\.)*)"\s*$')
+
+
+class _QuotaBucket:
+    """1秒あたりのリクエスト数のクォータ（超えた分は待たせずにスロットリングのエラーにする）"""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+
+    def take(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class FakeCognitoClient:
+    """
+    boto3 の cognito-idp クライアントと同じ呼び出し方・応答・例外（ClientError）を返すメモリ上のユーザープール
+    latency: 1回の呼び出しの遅延（秒）、latency_jitter: 遅延に加える0〜指定秒のばらつき
+    throttle_rate / error_rate: 呼び出しのうちスロットリング・一時的なエラーにする割合
+    quotas: クォータの区分ごとの1秒あたりのリクエスト数（超えた分はスロットリングのエラー、省略時は無制限。
+            実際のユーザープールと同じ制限にする場合は DEFAULT_QUOTAS）
+    seed: 乱数のシード（同じシードであれば遅延とエラーの乱数の系列を再現する。並列実行時はどの呼び出しに当たるかは実行順による）
+    """
+
+    def __init__(self, users: Iterable[Dict] = None, latency: float = 0.0, latency_jitter: float = 0.0,
+                 throttle_rate: float = 0.0, error_rate: float = 0.0, quotas: Dict[str, float] = None,
+                 seed: Optional[int] = None):
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self._quotas = {category: _QuotaBucket(rate) for category, rate in (quotas or {}).items()}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._users = {}
+        self._stats = {}
+        for user in users or ():
+            self._users[user['email']] = _pool_user(user['email'], _directory_attributes(user))
+
+    # boto3 互換の操作
+
+    def admin_create_user(self, UserPoolId: str, Username: str, UserAttributes: List[Dict] = None, **kwargs) -> Dict:
+        self._call('AdminCreateUser')
+        with self._lock:
+            if Username in self._users:
+                raise _client_error('UsernameExistsException', 'User account already exists.', 'AdminCreateUser')
+            attributes = {attr['Name']: attr['Value'] for attr in UserAttributes or ()}
+            user = self._users[Username] = _pool_user(Username, attributes)
+            return {'User': _describe(user)}
+
+    def admin_update_user_attributes(self, UserPoolId: str, Username: str, UserAttributes: List[Dict],
+                                     **kwargs) -> Dict:
+        self._call('AdminUpdateUserAttributes')
+        with self._lock:
+            user = self._get_user(Username, 'AdminUpdateUserAttributes')
+            user['Attributes'].update((attr['Name'], attr['Value']) for attr in UserAttributes)
+            user['UserLastModifiedDate'] = datetime.now()
+            return {}
+
+    def admin_delete_user_attributes(self, UserPoolId: str, Username: str, UserAttributeNames: List[str],
+                                     **kwargs) -> Dict:
+        self._call('AdminDeleteUserAttributes')
+        with self._lock:
+            user = self._get_user(Username, 'AdminDeleteUserAttributes')
+            for name in UserAttributeNames:
+                user['Attributes'].pop(name, None)
+            user['UserLastModifiedDate'] = datetime.now()
+            return {}
+
+    def admin_delete_user(self, UserPoolId: str, Username: str, **kwargs) -> Dict:
+        self._call('AdminDeleteUser')
+        with self._lock:
+            self._get_user(Username, 'AdminDeleteUser')
+            del self._users[Username]
+            return {}
+
+    def list_users(self, UserPoolId: str, AttributesToGet: List[str] = None, Limit: int = MAX_LIST_LIMIT,
+                   PaginationToken: str = None, Filter: str = None, **kwargs) -> Dict:
+        self._call('ListUsers')
+        if not 0 < Limit <= MAX_LIST_LIMIT:
+            raise _client_error('InvalidParameterException', f'Limit must be 1-{MAX_LIST_LIMIT}.', 'ListUsers')
+        matches = _compile_filter(Filter)
+        after = _decode_token(PaginationToken)
+
+        with self._lock:
+            # ユーザー名の順に並べ、前のページの最後のユーザーの続きから返す
+            names = sorted(name for name in self._users if after is None or name > after)
+            page = []
+            for name in names:
+                user = self._users[name]
+                if matches(user):
+                    page.append(_describe(user, AttributesToGet))
+                    if len(page) > Limit:
+                        break
+
+        response = {'Users': page[:Limit]}
+        if len(page) > Limit:
+            response['PaginationToken'] = _encode_token(page[Limit - 1]['Username'])
+        return response
+
+    def describe_user_pool(self, UserPoolId: str, **kwargs) -> Dict:
+        self._call('DescribeUserPool')
+        with self._lock:
+            return {'UserPool': {'Id': UserPoolId, 'EstimatedNumberOfUsers': len(self._users)}}
+
+    # 試験用の参照
+
+    def users(self) -> Dict[str, Dict[str, str]]:
+        """ユーザー名ごとの属性（現在の状態のコピー）"""
+        with self._lock:
+            return {name: dict(user['Attributes']) for name, user in self._users.items()}
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """操作ごとの呼び出し回数と、注入したスロットリング・エラーの回数"""
+        with self._lock:
+            return {operation: dict(counts) for operation, counts in self._stats.items()}
+
+    def _call(self, operation: str):
+        """呼び出しの遅延と、スロットリング・エラーの注入"""
+        with self._lock:
+            counts = self._stats.setdefault(operation, {'calls': 0, 'throttled': 0, 'errors': 0})
+            counts['calls'] += 1
+            delay = self.latency + (self._rng.uniform(0, self.latency_jitter) if self.latency_jitter else 0)
+            draw = self._rng.random()
+            bucket = self._quotas.get(QUOTA_CATEGORIES[operation])
+            throttled = draw < self.throttle_rate or (bucket is not None and not bucket.take())
+            failed = not throttled and draw < self.throttle_rate + self.error_rate
+            if throttled:
+                counts['throttled'] += 1
+            elif failed:
+                counts['errors'] += 1
+
+        if delay > 0:
+            time.sleep(delay)
+        if throttled:
+            raise _client_error('TooManyRequestsException', 'Too many requests.', operation)
+        if failed:
+            raise _client_error(INJECTED_ERROR_CODE, 'Injected internal error.', operation)
+
+    def _get_user(self, username: str, operation: str) -> Dict:
+        user = self._users.get(username)
+        if user is None:
+            raise _client_error('UserNotFoundException', 'User does not exist.', operation)
+        return user
+
+
+def _pool_user(username: str, attributes: Dict[str, str]) -> Dict:
+    now = datetime.now()
+    return {
+        'Username': username,
+        'Attributes': dict({'sub': str(uuid.uuid4())}, **attributes),
+        'UserCreateDate': now,
+        'UserLastModifiedDate': now,
+        'Enabled': True,
+        'UserStatus': 'FORCE_CHANGE_PASSWORD'
+    }
+
+
+def _directory_attributes(user: Dict) -> Dict[str, str]:
+    """既存ユーザー（JSONファイルと同じ形式）をCognitoの属性に変換"""
+    attributes = {'email': user['email']}
+    for field, name in (('name', 'name'), ('position', 'custom:position'), ('department', 'custom:department')):
+        if user.get(field) is not None:
+            attributes[name] = str(user[field])
+    return attributes
+
+
+def _describe(user: Dict, attributes_to_get: List[str] = None) -> Dict:
+    attributes = user['Attributes']
+    names = attributes_to_get if attributes_to_get is not None else list(attributes)
+    return {
+        'Username': user['Username'],
+        'Attributes': [{'Name': name, 'Value': attributes[name]} for name in names if name in attributes],
+        'UserCreateDate': user['UserCreateDate'],
+        'UserLastModifiedDate': user['UserLastModifiedDate'],
+        'Enabled': user['Enabled'],
+        'UserStatus': user['UserStatus']
+    }
+
+
+def _compile_filter(filter_text: Optional[str]):
+    if not filter_text:
+        return lambda user: True
+    match = _FILTER_PATTERN.match(filter_text)
+    if match is None:
+        raise _client_error('InvalidParameterException', f'Invalid filter: {filter_text}', 'ListUsers')
+    name, operator, value = match.group(1), match.group(2), re.sub(r'\\(.)', r'\1', match.group(3))
+    if operator == '^=':
+        return lambda user: user['Attributes'].get(name, '').startswith(value)
+    return lambda user: user['Attributes'].get(name) == value
+
+
+def _encode_token(username: str) -> str:
+    return base64.urlsafe_b64encode(username.encode('utf-8')).decode('ascii')
+
+
+def _decode_token(token: Optional[str]) -> Optional[str]:
+    if not token:
+        return None
+    try:
+        return base64.urlsafe_b64decode(token.encode('ascii')).decode('utf-8')
+    except (ValueError, UnicodeError):
+        raise _client_error('InvalidParameterException', 'Invalid pagination token.', 'ListUsers')
+
+
+def _client_error(code: str, message: str, operation: str) -> ClientError:
+    return ClientError({'Error': {'Code': code, 'Message': message}}, operation)
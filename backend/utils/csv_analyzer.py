@@ -1,13 +1,45 @@
-import pandas as pd
-import chardet
+import atexit
+import multiprocessing
 import re
-from typing import Dict, List, Tuple, Optional
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from typing import Dict, Iterable, Iterator, List, Tuple, Optional, Union
+
+from utils.encoding_detector import detect_encoding
+from utils.file_hash import content_hash
+from utils.metrics import metrics
+from utils.keyword_matcher import get_matcher, load_keyword_config
+from utils.parse_cache import ParsedCSVCache
+
+# ストリーミング読み込み時の1チャンクあたりの行数
+DEFAULT_CHUNK_SIZE = 10000
+
+# フィールド判定に使用するカラムごとのサンプル数
+SAMPLE_ROWS = 100
+
+# カラム分析をプロセスプールで並列化するカラム数の閾値
+# （これより少ない場合はプロセス間通信のコストが上回るため直列で分析する）
+PARALLEL_COLUMN_THRESHOLD = 200
+
+# 名前の判定に使用する文字種
+KATAKANA_REGEX = re.compile('[ア-ヴ]')
+KANJI_REGEX = re.compile('[一-鿿]')
 
 
 class CSVAnalyzer:
     """CSVファイルを解析し、フィールドの自動認識を行うクラス"""
     
-    def __init__(self):
+    def __init__(self, chunk_size: int = DEFAULT_CHUNK_SIZE, parse_cache: ParsedCSVCache = None,
+                 keyword_config: Dict[str, Dict[str, List[str]]] = None, workers: int = 1,
+                 parallel_threshold: int = PARALLEL_COLUMN_THRESHOLD):
+        self.chunk_size = chunk_size
+        self.parse_cache = parse_cache
+        # カラム分析を並列化するワーカー数と、並列化するカラム数の閾値
+        self.workers = workers
+        self.parallel_threshold = parallel_threshold
         self.email_patterns = [
             r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
         ]
@@ -20,25 +52,260 @@ class CSVAnalyzer:
         self.department_keywords = [
             '部署', '部門', '所属', 'department', 'dept', 'division', '課'
         ]
+        self.position_values = ['部長', '課長', '主任', '係長', 'Manager', 'Director', 'Staff']
+        self.department_values = ['部', '課', 'Department', 'Division', '営業', '技術', '経理', '人事']
+        # 日本人の名前によくある姓や名
+        self.name_indicators = ['田中', '佐藤', '鈴木', '山田', '太郎', '花子', '一郎']
+        self._extend_keywords(keyword_config if keyword_config is not None else load_keyword_config())
+        self._compile_patterns()
+    
+    def _extend_keywords(self, keyword_config: Dict[str, Dict[str, List[str]]]):
+        """設定ファイルのキーワードを追加（HRシステムごとの表記に対応）"""
+        header = keyword_config.get('header', {})
+        self.name_keywords += header.get('name', [])
+        self.position_keywords += header.get('position', [])
+        self.department_keywords += header.get('department', [])
+        
+        value = keyword_config.get('value', {})
+        self.name_indicators += value.get('name', [])
+        self.position_values += value.get('position', [])
+        self.department_values += value.get('department', [])
+    
+    def _compile_patterns(self):
+        """判定用のパターンを事前に構築（同じキーワード表のオートマトンはリクエストをまたいで再利用）"""
+        email_pattern = '|'.join(f'(?:{pattern})' for pattern in self.email_patterns)
+        self._email_regex = re.compile(email_pattern)
+        # カラム名・値ともに小文字化したテキストを1回走査して、一致したフィールドを判定する
+        self._scorer = ColumnScorer(
+            email_pattern,
+            header_keywords={
+                'name': [keyword.lower() for keyword in self.name_keywords],
+                'position': [keyword.lower() for keyword in self.position_keywords],
+                'department': [keyword.lower() for keyword in self.department_keywords]
+            },
+            value_keywords={
+                'name': [value.lower() for value in self.name_indicators],
+                'position': [value.lower() for value in self.position_values],
+                'department': [value.lower() for value in self.department_values]
+            }
+        )
     
     def detect_encoding(self, file_path: str) -> str:
         """ファイルのエンコーディングを検出"""
-        with open(file_path, 'rb') as f:
-            result = chardet.detect(f.read())
-        return result['encoding'] or 'utf-8'
+        return detect_encoding(file_path)
     
     def read_csv(self, file_path: str) -> pd.DataFrame:
         """CSVファイルを読み込み"""
-        encoding = self.detect_encoding(file_path)
-        try:
-            df = pd.read_csv(file_path, encoding=encoding)
-        except:
-            # エンコーディングエラーの場合、UTF-8で再試行
-            df = pd.read_csv(file_path, encoding='utf-8', errors='ignore')
+        with metrics.stage('csv_parse') as stage:
+            encoding = self.detect_encoding(file_path)
+            # 判定できなかったバイト列は置換文字にして1回の読み込みで完了させる
+            # 値は文字列のまま読み込む（社員番号などの先頭の0を残す。空欄は欠損値のまま）
+            df = pd.read_csv(file_path, dtype=str, encoding=encoding, encoding_errors='replace')
+            stage.items += len(df)
         return df
     
+    def read_csv_chunks(self, file_path: str, chunk_size: int = None) -> Iterator[pd.DataFrame]:
+        """CSVファイルをチャンク単位で読み込み（大容量ファイルでもメモリ使用量を一定に保つ）"""
+        # チャンクを取り出す時間を解析の処理時間として計測（チャンクを使う側の処理時間は含めない）
+        yield from metrics.timed_iter('csv_parse', self._load_chunks(file_path, chunk_size))
+    
+    def _load_chunks(self, file_path: str, chunk_size: int = None) -> Iterator[pd.DataFrame]:
+        if self.parse_cache is None:
+            yield from self._parse_chunks(file_path, chunk_size)
+            return
+        
+        # 同じ内容のファイルは解析済みのキャッシュから読み込む
+        # （チャンクの大きさごとに保存し、指定と異なる大きさのチャンクを返さない）
+        key = f'{content_hash(file_path)}-{chunk_size or self.chunk_size}'
+        cached = self.parse_cache.load(key)
+        if cached is not None:
+            yield from cached
+        else:
+            yield from self.parse_cache.store(key, self._parse_chunks(file_path, chunk_size))
+    
+    def _parse_chunks(self, file_path: str, chunk_size: int = None) -> Iterator[pd.DataFrame]:
+        """CSVファイルを解析してチャンク単位で返す"""
+        encoding = self.detect_encoding(file_path)
+        # 型をチャンクごとに推定すると、同じ列でもチャンクによって数値・文字列が変わるため、すべて文字列として読み込む
+        with pd.read_csv(file_path, dtype=str, encoding=encoding, encoding_errors='replace',
+                         chunksize=chunk_size or self.chunk_size) as reader:
+            for chunk in reader:
+                yield chunk
+    
+    def analyze_chunks(self, chunks: Iterable[pd.DataFrame], rows: int = 10) -> Dict:
+        """チャンクを1回走査してフィールド自動検出・プレビュー・総行数をまとめて取得"""
+        headers, samples, head, total_rows = self._scan_chunks(chunks, rows)
+        return {
+            'headers': headers,
+            'preview': self._format_preview(head),
+            'auto_mapping': self._detect_from_columns(samples),
+            'total_rows': total_rows
+        }
+    
     def analyze_column(self, series: pd.Series) -> Dict[str, float]:
         """カラムの内容を分析してフィールドタイプの確率を返す"""
+        return self._score_sample(series.name, self._column_sample(series))
+    
+    def _column_sample(self, series: pd.Series) -> np.ndarray:
+        """判定に使用するサンプル（欠損値を除いた最大100行）を取得"""
+        # pandasの操作はカラムごとのオーバーヘッドが大きいため、numpy配列で欠損値を除外する
+        column = series.to_numpy(dtype=object)
+        return column[~pd.isna(column)][:SAMPLE_ROWS]
+    
+    def _score_sample(self, column_name, sample: np.ndarray) -> Dict[str, float]:
+        """カラム名とサンプルからフィールドタイプの確率を計算"""
+        return self._scorer.score(column_name, sample)
+    
+    def _is_email(self, value: str) -> bool:
+        """メールアドレスかどうかを判定"""
+        return self._email_regex.match(value) is not None
+    
+    def auto_detect_fields(self, data: Union[pd.DataFrame, Iterable[pd.DataFrame]]) -> Dict[str, Optional[int]]:
+        """フィールドを自動検出（DataFrameまたはチャンクのイテレータを受け付ける）"""
+        if isinstance(data, pd.DataFrame):
+            columns = [data[col] for col in data.columns]
+        else:
+            _, columns, _, _ = self._scan_chunks(data, 0, stop_early=True)
+        return self._detect_from_columns(columns)
+    
+    def _detect_from_columns(self, columns: List[pd.Series]) -> Dict[str, Optional[int]]:
+        """カラムのリストからフィールドを自動検出"""
+        with metrics.stage('field_detection'):
+            return self._detect_fields(columns)
+    
+    def _detect_fields(self, columns: List[pd.Series]) -> Dict[str, Optional[int]]:
+        mapping = {
+            'name': None,
+            'email': None,
+            'position': None,
+            'department': None
+        }
+        
+        field_scores = {}
+        for idx, (series, scores) in enumerate(zip(columns, self._analyze_columns(columns))):
+            for field_type, score in scores.items():
+                if score > 0:
+                    if field_type not in field_scores:
+                        field_scores[field_type] = []
+                    field_scores[field_type].append((idx, score, series.name))
+        
+        # 最も高いスコアのカラムを選択
+        for field_type, candidates in field_scores.items():
+            if candidates:
+                best = max(candidates, key=lambda x: x[1])
+                if best[1] >= 0.5:  # 閾値以上のスコアの場合のみ設定
+                    mapping[field_type] = best[0]
+        
+        return mapping
+    
+    def get_preview_data(self, data: Union[pd.DataFrame, Iterable[pd.DataFrame]],
+                         rows: int = 10) -> Tuple[List[str], List[List[str]]]:
+        """プレビューデータを取得（DataFrameまたはチャンクのイテレータを受け付ける）"""
+        if isinstance(data, pd.DataFrame):
+            return data.columns.tolist(), self._format_preview(data.head(rows))
+        headers, _, head, _ = self._scan_chunks(data, rows, stop_early=True, sample=False)
+        return headers, self._format_preview(head)
+    
+    def _analyze_columns(self, columns: List[pd.Series]) -> List[Dict[str, float]]:
+        """
+        全カラムを分析（カラム数が閾値以上ならプロセスプールで並列に分析）
+        結果はカラムの順序どおりに返すため、直列で分析した場合と同一になる
+        """
+        if self.workers <= 1 or len(columns) < self.parallel_threshold:
+            return [self.analyze_column(series) for series in columns]
+        
+        # サンプルの抽出は親プロセスで行い、小さな配列だけをワーカーに渡す
+        items = [(series.name, self._column_sample(series)) for series in columns]
+        batch_size = -(-len(items) // self.workers)
+        batches = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+        
+        pool = _get_process_pool(self.workers)
+        results = pool.map(_score_batch, [self._scorer] * len(batches), batches)
+        return [scores for batch in results for scores in batch]
+    
+    def _format_preview(self, head: pd.DataFrame) -> List[List[str]]:
+        """プレビュー用に文字列のリストへ変換"""
+        return head.fillna('').astype(str).values.tolist()
+    
+    def _scan_chunks(self, chunks: Iterable[pd.DataFrame], rows: int, stop_early: bool = False,
+                     sample: bool = True) -> Tuple[List[str], List[pd.Series], pd.DataFrame, int]:
+        """
+        チャンクを走査し、ヘッダー・カラムごとのサンプル・先頭行・総行数を集計する
+        保持するのは先頭rows行とカラムごとに最大SAMPLE_ROWS件の非NULL値のみ
+        """
+        headers = None
+        pieces = {}
+        counts = {}
+        head_parts = []
+        head_len = 0
+        total_rows = 0
+        
+        for chunk in chunks:
+            if headers is None:
+                headers = chunk.columns.tolist()
+                pieces = {col: [] for col in headers}
+                counts = {col: 0 for col in headers}
+            total_rows += len(chunk)
+            
+            if head_len < rows:
+                part = chunk.head(rows - head_len)
+                head_parts.append(part)
+                head_len += len(part)
+            
+            sampled = True
+            if sample:
+                for col in headers:
+                    need = SAMPLE_ROWS - counts[col]
+                    if need > 0:
+                        values = chunk[col].dropna().head(need)
+                        pieces[col].append(values)
+                        counts[col] += len(values)
+                        sampled = sampled and counts[col] >= SAMPLE_ROWS
+            
+            # 必要なデータが揃ったら残りのチャンクは読まない
+            if stop_early and sampled and head_len >= rows:
+                break
+        
+        headers = headers or []
+        columns = [
+            pd.concat(pieces[col]).rename(col) if pieces[col] else pd.Series(dtype=object, name=col)
+            for col in headers
+        ] if sample else []
+        head = pd.concat(head_parts) if head_parts else pd.DataFrame(columns=headers)
+        return headers, columns, head, total_rows
+
+
+class ColumnScorer:
+    """
+    カラム名とサンプルからフィールドタイプの確率を計算するクラス
+    ワーカープロセスにはキーワード表のみを渡し、オートマトンはワーカー側で構築する（同じ表なら構築済みのものを再利用）
+    """
+    
+    def __init__(self, email_pattern: str, header_keywords: Dict[str, List[str]],
+                 value_keywords: Dict[str, List[str]]):
+        self.email_pattern = email_pattern
+        self.header_keywords = header_keywords
+        self.value_keywords = value_keywords
+        self._compile()
+    
+    def __getstate__(self) -> Dict:
+        return {
+            'email_pattern': self.email_pattern,
+            'header_keywords': self.header_keywords,
+            'value_keywords': self.value_keywords
+        }
+    
+    def __setstate__(self, state: Dict):
+        self.__dict__.update(state)
+        self._compile()
+    
+    def _compile(self):
+        self._email_regex = re.compile(self.email_pattern)
+        self._header_matcher = get_matcher(self.header_keywords)
+        self._value_matcher = get_matcher(self.value_keywords)
+    
+    def score(self, column_name, sample: np.ndarray) -> Dict[str, float]:
+        """カラム名とサンプルからフィールドタイプの確率を計算"""
         scores = {
             'name': 0.0,
             'email': 0.0,
@@ -46,99 +313,84 @@ class CSVAnalyzer:
             'department': 0.0
         }
         
-        # サンプルデータ（最大100行）を取得
-        sample = series.dropna().head(100)
         if len(sample) == 0:
             return scores
         
+        # 値はカラムごとに1回だけ文字列化し、結合した文字列に対して各判定を行う
+        values = [str(val) for val in sample]
+        values_str = '\n'.join(values)
+        values_lower = values_str.lower()
+        
         # メールアドレスの判定
-        email_matches = sum(1 for val in sample if self._is_email(str(val)))
+        email_match = self._email_regex.match
+        email_matches = sum(1 for val in values if email_match(val))
         scores['email'] = email_matches / len(sample)
         
-        # カラム名による判定
-        col_name_lower = series.name.lower() if series.name else ''
+        # カラム名・値のキーワード判定（それぞれ1回の走査）
+        col_name_lower = column_name.lower() if column_name else ''
+        header_matches = self._header_matcher.find(col_name_lower)
+        value_matches = self._value_matcher.find(values_lower)
         
         # 名前の判定
-        if any(keyword in col_name_lower for keyword in self.name_keywords):
+        if 'name' in header_matches:
             scores['name'] += 0.5
-        if self._contains_name_values(sample):
+        if 'name' in value_matches or _contains_kana_and_kanji(values_str):
             scores['name'] += 0.5
         
         # 役職の判定
-        if any(keyword in col_name_lower for keyword in self.position_keywords):
+        if 'position' in header_matches:
             scores['position'] += 0.5
-        if self._contains_position_values(sample):
+        if 'position' in value_matches:
             scores['position'] += 0.5
         
         # 部署の判定
-        if any(keyword in col_name_lower for keyword in self.department_keywords):
+        if 'department' in header_matches:
             scores['department'] += 0.5
-        if self._contains_department_values(sample):
+        if 'department' in value_matches:
             scores['department'] += 0.5
         
         return scores
     
-    def _is_email(self, value: str) -> bool:
-        """メールアドレスかどうかを判定"""
-        for pattern in self.email_patterns:
-            if re.match(pattern, value):
-                return True
-        return False
-    
-    def _contains_position_values(self, series: pd.Series) -> bool:
-        """役職の値が含まれているかを判定"""
-        position_values = ['部長', '課長', '主任', '係長', 'Manager', 'Director', 'Staff']
-        values_str = ' '.join(series.astype(str).tolist()).lower()
-        return any(pos.lower() in values_str for pos in position_values)
-    
-    def _contains_department_values(self, series: pd.Series) -> bool:
-        """部署の値が含まれているかを判定"""
-        dept_values = ['部', '課', 'Department', 'Division', '営業', '技術', '経理', '人事']
-        values_str = ' '.join(series.astype(str).tolist()).lower()
-        return any(dept.lower() in values_str for dept in dept_values)
-    
-    def _contains_name_values(self, series: pd.Series) -> bool:
-        """名前の値が含まれているかを判定"""
-        # 日本人の名前によくある姓や名
-        name_indicators = ['田中', '佐藤', '鈴木', '山田', '太郎', '花子', '一郎']
-        # カタカナやアルファベットのパターン
-        has_katakana = any('ア' <= char <= 'ヴ' for val in series.astype(str) for char in str(val))
-        has_kanji = any('一' <= char <= '鿿' for val in series.astype(str) for char in str(val))
-        
-        values_str = ' '.join(series.astype(str).tolist())
-        has_name_indicator = any(name in values_str for name in name_indicators)
-        
-        return has_name_indicator or (has_katakana and has_kanji)
-    
-    def auto_detect_fields(self, df: pd.DataFrame) -> Dict[str, Optional[int]]:
-        """フィールドを自動検出"""
-        mapping = {
-            'name': None,
-            'email': None,
-            'position': None,
-            'department': None
-        }
-        
-        field_scores = {}
-        for idx, col in enumerate(df.columns):
-            scores = self.analyze_column(df[col])
-            for field_type, score in scores.items():
-                if score > 0:
-                    if field_type not in field_scores:
-                        field_scores[field_type] = []
-                    field_scores[field_type].append((idx, score, col))
-        
-        # 最も高いスコアのカラムを選択
-        for field_type, candidates in field_scores.items():
-            if candidates:
-                best = max(candidates, key=lambda x: x[1])
-                if best[1] >= 0.5:  # 閾値以上のスコアの場合のみ設定
-                    mapping[field_type] = best[0]
-        
-        return mapping
-    
-    def get_preview_data(self, df: pd.DataFrame, rows: int = 10) -> Tuple[List[str], List[List[str]]]:
-        """プレビューデータを取得"""
-        headers = df.columns.tolist()
-        preview = df.head(rows).fillna('').astype(str).values.tolist()
-        return headers, preview
\ No newline at end of file
+
+def _contains_kana_and_kanji(values_str: str) -> bool:
+    """カタカナと漢字の両方を含むかを判定（日本人の名前によくある表記）"""
+    return bool(KATAKANA_REGEX.search(values_str) and KANJI_REGEX.search(values_str))
+
+
+# ワーカー数ごとのプロセスプール（起動コストが大きいためプロセス内で使い回す）
+_process_pools = {}
+_process_pools_lock = threading.Lock()
+
+# ワーカープロセスの起動方法（gunicornのスレッドを持つワーカーからforkすると、
+# 他のスレッドが保持していたロックが複製されて停止することがあるため、forkserverから起動する）
+PROCESS_START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+# forkserverのサーバープロセスに読み込んでおくモジュール（既定ではメインモジュールが対象のため、明示的に指定する。
+# ワーカープロセスはメインモジュールを __mp_main__ として読み込み直すため、app.py はその場合の副作用を抑止している）
+PROCESS_PRELOAD_MODULES = ['utils.csv_analyzer']
+
+
+def process_context():
+    """ワーカープロセスの起動に使うコンテキスト"""
+    context = multiprocessing.get_context(PROCESS_START_METHOD)
+    if PROCESS_START_METHOD == 'forkserver':
+        context.set_forkserver_preload(PROCESS_PRELOAD_MODULES)
+    return context
+
+
+def _get_process_pool(workers: int) -> ProcessPoolExecutor:
+    with _process_pools_lock:
+        if workers not in _process_pools:
+            _process_pools[workers] = ProcessPoolExecutor(max_workers=workers, mp_context=process_context())
+        return _process_pools[workers]
+
+
+@atexit.register
+def _shutdown_process_pools():
+    for pool in _process_pools.values():
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _score_batch(scorer: ColumnScorer, items: List[Tuple[str, np.ndarray]]) -> List[Dict[str, float]]:
+    """ワーカープロセスでカラムのサンプルをまとめて分析"""
+    return [scorer.score(name, sample) for name, sample in items]
@@ -0,0 +1,220 @@
+"""
+同期差分（追加・更新・削除の一覧）の保存とページング
+比較結果をSQLiteのファイルに1回だけ書き込み、操作・変更フィールド・メールアドレスで絞り込みながら
+カーソル方式でページ単位に読み込む（各ページは索引をたどってページサイズ分だけ読み込む）
+"""
+import base64
+import binascii
+import json
+import os
+import sqlite3
+import tempfile
+from typing import Dict, Iterator, List, Optional
+from urllib.parse import quote
+
+# 差分の操作（一覧の並び順もこの順）
+OPERATIONS = ('add', 'update', 'delete')
+
+# 更新で絞り込める変更フィールド
+CHANGE_FIELDS = ('name', 'position', 'department')
+
+# 1ページの件数の上限
+MAX_PAGE_SIZE = 500
+
+# 一度に書き込む行数
+WRITE_BATCH_SIZE = 1000
+
+# メールアドレスの前方一致検索で範囲の上端に使う文字
+_MAX_CHAR = '\U0010ffff'
+
+# 差分1件ごとにエンコーダーを作り直さないよう共有する
+_encoder = json.JSONEncoder(ensure_ascii=False)
+
+
+class SyncDiff:
+    """保存済みの同期差分を読み込むクラス"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        uri = 'file:' + quote(os.path.abspath(db_path)) + '?mode=ro'
+        self._connection = sqlite3.connect(uri, uri=True, check_same_thread=False)
+
+    @classmethod
+    def open(cls, db_path: str) -> Optional['SyncDiff']:
+        """保存済みの差分を開く（存在しない場合はNone）"""
+        if not os.path.exists(db_path):
+            return None
+        return cls(db_path)
+
+    def close(self):
+        self._connection.close()
+
+    def summary(self) -> Dict[str, int]:
+        """操作ごとの件数（書き込み時に集計済み）"""
+        row = self._connection.execute("SELECT value FROM meta WHERE key = 'summary'").fetchone()
+        return json.loads(row[0])
+
+    def metadata(self) -> Dict:
+        """書き込み時に指定したメタデータ"""
+        return {
+            key: json.loads(value)
+            for key, value in self._connection.execute("SELECT key, value FROM meta WHERE key != 'summary'")
+        }
+
+    def page(self, operation: str = None, field: str = None, email: str = None,
+             cursor: str = None, limit: int = 50) -> Dict:
+        """
+        差分を1ページ分取得
+        operation: add / update / delete で絞り込み
+        field: 指定したフィールドが変更される更新のみに絞り込み
+        email: メールアドレスの前方一致（大文字・小文字を区別しない）で検索し、メールアドレス順に並べる
+        cursor: 前のページの nextCursor（最初のページはNone）
+        """
+        if operation is not None and operation not in OPERATIONS:
+            raise ValueError(f'不正な操作です: {operation}')
+        if field is not None and field not in CHANGE_FIELDS:
+            raise ValueError(f'不正なフィールドです: {field}')
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        if field is not None and operation not in (None, 'update'):
+            # 変更フィールドがあるのは更新のみ
+            return {'items': [], 'nextCursor': None}
+
+        conditions = []
+        params = []
+        if field is not None:
+            # 変更フィールドの索引から、該当する更新の行番号をたどる
+            source = 'changed_fields c JOIN entries e ON e.seq = c.seq'
+            seq = 'c.seq'
+            conditions.append('c.field = ?')
+            params.append(field)
+        else:
+            source = 'entries e'
+            seq = 'e.seq'
+            if operation is not None:
+                conditions.append('e.operation = ?')
+                params.append(operation)
+
+        if email:
+            # メールアドレスの索引を範囲検索し、メールアドレス・行番号の順に並べる
+            prefix = email.lower()
+            conditions.append('e.email_key >= ? AND e.email_key < ?')
+            params.extend([prefix, prefix + _MAX_CHAR])
+            order = ['e.email_key', seq]
+        else:
+            # 並び順の列は絞り込みに使う索引と同じ表のものにする（並べ替えを省略させる）
+            order = [seq]
+
+        position = _decode_cursor(cursor, len(order))
+        if position is not None:
+            conditions.append(f'({", ".join(order)}) > ({", ".join("?" * len(order))})')
+            params.extend(position)
+
+        where = ' AND '.join(conditions) or '1'
+        rows = self._connection.execute(
+            f'SELECT e.operation, e.data, {", ".join(order)} FROM {source} '
+            f'WHERE {where} ORDER BY {", ".join(order)} LIMIT ?',
+            params + [limit + 1]
+        ).fetchall()
+
+        items = [dict(operation=row[0], **json.loads(row[1])) for row in rows[:limit]]
+        next_cursor = _encode_cursor(list(rows[limit - 1][2:])) if len(rows) > limit else None
+        return {'items': items, 'nextCursor': next_cursor}
+
+    def fingerprints(self) -> Dict[str, bytes]:
+        """書き込み時に指定したフィンガープリント（既存ユーザーと一致していた行）"""
+        return dict(self._connection.execute('SELECT email, fingerprint FROM fingerprints'))
+
+    def iter_operation(self, operation: str) -> Iterator[Dict]:
+        """操作ごとの差分を保存した順に全件読み込む"""
+        cursor = self._connection.execute(
+            'SELECT data FROM entries WHERE operation = ? ORDER BY seq', (operation,)
+        )
+        while True:
+            rows = cursor.fetchmany(WRITE_BATCH_SIZE)
+            if not rows:
+                return
+            for row in rows:
+                yield json.loads(row[0])
+
+
+def write_diff(db_path: str, new_users: List[Dict], update_users: List[Dict],
+               delete_users: List[Dict], metadata: Dict = None, fingerprints: Dict[str, bytes] = None):
+    """
+    比較結果を保存（既存の差分は置き換える）
+    fingerprints には比較の結果、既存ユーザーと一致していた行のフィンガープリントを保存できる
+    書き込み中のファイルは一時ファイルとし、完成してから置き換えるため、読み込み側に途中の状態は見えない
+    """
+    db_dir = os.path.dirname(os.path.abspath(db_path))
+    fd, tmp_path = tempfile.mkstemp(dir=db_dir, suffix='.tmp')
+    os.close(fd)
+    try:
+        connection = sqlite3.connect(tmp_path)
+        try:
+            connection.execute('PRAGMA journal_mode = OFF')
+            connection.execute('PRAGMA synchronous = OFF')
+            connection.execute(
+                'CREATE TABLE entries (seq INTEGER PRIMARY KEY, operation TEXT NOT NULL, '
+                'email_key TEXT NOT NULL, data TEXT NOT NULL)'
+            )
+            connection.execute(
+                'CREATE TABLE changed_fields (field TEXT NOT NULL, seq INTEGER NOT NULL, '
+                'PRIMARY KEY (field, seq)) WITHOUT ROWID'
+            )
+            connection.execute('CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+            connection.execute('CREATE TABLE fingerprints (email TEXT PRIMARY KEY, fingerprint BLOB NOT NULL)')
+
+            seq = 0
+            for operation, users in zip(OPERATIONS, (new_users, update_users, delete_users)):
+                for start in range(0, len(users), WRITE_BATCH_SIZE):
+                    batch = users[start:start + WRITE_BATCH_SIZE]
+                    entries = []
+                    changes = []
+                    for user in batch:
+                        seq += 1
+                        entries.append((seq, operation, str(user['email']).lower(),
+                                        _encoder.encode(user)))
+                        changes.extend((field, seq) for field in user.get('changes', ()))
+                    connection.executemany('INSERT INTO entries VALUES (?, ?, ?, ?)', entries)
+                    connection.executemany('INSERT INTO changed_fields VALUES (?, ?)', changes)
+
+            connection.executemany('INSERT INTO fingerprints VALUES (?, ?)', (fingerprints or {}).items())
+
+            # 索引はまとめて作成する（1行ずつ更新するより速い）
+            connection.execute('CREATE INDEX entries_operation ON entries (operation, seq)')
+            connection.execute('CREATE INDEX entries_email ON entries (email_key, seq)')
+            meta = dict(metadata or {}, summary={
+                'toAdd': len(new_users),
+                'toUpdate': len(update_users),
+                'toDelete': len(delete_users)
+            })
+            connection.executemany(
+                'INSERT INTO meta VALUES (?, ?)',
+                [(key, json.dumps(value, ensure_ascii=False)) for key, value in meta.items()]
+            )
+            connection.commit()
+        finally:
+            connection.close()
+        os.replace(tmp_path, db_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _encode_cursor(position: list) -> str:
+    payload = json.dumps(position, ensure_ascii=False).encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode('ascii').rstrip('=')
+
+
+def _decode_cursor(cursor: Optional[str], size: int) -> Optional[list]:
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        position = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, binascii.Error, UnicodeError):
+        raise ValueError('不正なカーソルです')
+    # 検索条件を変えた後に前のカーソルを使った場合など、並び順と一致しないカーソルは受け付けない
+    if not isinstance(position, list) or len(position) != size:
+        raise ValueError('不正なカーソルです')
+    return position
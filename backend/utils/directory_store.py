@@ -0,0 +1,203 @@
+"""
+既存ユーザー一覧のディスク上の索引付きストア（SQLite）
+メールアドレスを主キーとして保存し、比較対象の属性のハッシュを合わせて持つことで、
+全ユーザーをメモリに読み込まずにメールアドレスでの検索・変更有無の判定・全件の順次走査を行う
+ストアは構築後は変更せず、新しいスナップショットごとに別のファイルとして作り直す
+"""
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+from collections.abc import Mapping
+from typing import Dict, Iterable, Iterator, List, Sequence, Tuple
+from urllib.parse import quote
+
+# 保存形式を変更した場合はバージョンを上げて古いストアを無効化する
+FORMAT_VERSION = 1
+
+# ストアに保存するフィールド（既存ユーザーのJSONと同じ名前）
+STORE_FIELDS = ('id', 'email', 'name', 'position', 'department')
+
+# 属性ハッシュの対象フィールド（UserSyncManagerの比較対象と同じ順）
+HASH_FIELDS = ('name', 'position', 'department')
+
+# 1回のクエリで指定するメールアドレスの件数（SQLiteのパラメータ数の上限より小さくする）
+QUERY_BATCH_SIZE = 500
+
+# 順次走査で一度に取得する行数
+FETCH_SIZE = 1000
+
+# 値を区切る文字（通常の属性値には含まれない制御文字）
+_SEPARATOR = '\x1f'
+
+# ユーザーを復元する際に読み込む列（keys は項目の有無を表すビット列）
+_COLUMNS = ', '.join(STORE_FIELDS + ('keys',))
+
+
+class DirectoryStore(Mapping):
+    """
+    既存ユーザー一覧を読み取り専用で参照するクラス
+    メールアドレスをキーとする辞書と同じように扱え、items() はファイルから順次読み込む
+    """
+
+    def __init__(self, db_path: str, snapshot_id: str = None):
+        self.db_path = db_path
+        self.snapshot_id = snapshot_id
+        # sqlite3の接続はスレッド間で共有できないため、スレッドごとに保持する
+        self._local = threading.local()
+        self._length = None
+
+    def __getitem__(self, email: str) -> Dict:
+        row = self._connection().execute(
+            f'SELECT {_COLUMNS} FROM users WHERE email = ?', (email,)
+        ).fetchone()
+        if row is None:
+            raise KeyError(email)
+        return _row_to_user(row)
+
+    def __contains__(self, email) -> bool:
+        return self._connection().execute(
+            'SELECT 1 FROM users WHERE email = ?', (email,)
+        ).fetchone() is not None
+
+    def __iter__(self) -> Iterator[str]:
+        for email, _ in self.items():
+            yield email
+
+    def __len__(self) -> int:
+        if self._length is None:
+            self._length = self._connection().execute('SELECT COUNT(*) FROM users').fetchone()[0]
+        return self._length
+
+    def items(self) -> Iterator[Tuple[str, Dict]]:
+        """登録順に全ユーザーを順次読み込む"""
+        cursor = self._connection().execute(
+            f'SELECT {_COLUMNS} FROM users ORDER BY rowid'
+        )
+        while True:
+            rows = cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                return
+            for row in rows:
+                user = _row_to_user(row)
+                yield user['email'], user
+
+    def get_hashes(self, emails: Sequence[str]) -> Dict[str, bytes]:
+        """メールアドレスごとの属性ハッシュを取得（存在しないメールアドレスは含めない）"""
+        return dict(self._query_batches('email, attr_hash', emails))
+
+    def get_many(self, emails: Sequence[str]) -> Dict[str, Dict]:
+        """複数のメールアドレスのユーザーをまとめて取得（存在しないメールアドレスは含めない）"""
+        users = (_row_to_user(row) for row in self._query_batches(_COLUMNS, emails))
+        return {user['email']: user for user in users}
+
+    def close(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    def _query_batches(self, columns: str, emails: Sequence[str]) -> Iterator[tuple]:
+        connection = self._connection()
+        unique = list(dict.fromkeys(emails))
+        for start in range(0, len(unique), QUERY_BATCH_SIZE):
+            batch = unique[start:start + QUERY_BATCH_SIZE]
+            placeholders = ', '.join('?' * len(batch))
+            yield from connection.execute(
+                f'SELECT {columns} FROM users WHERE email IN ({placeholders})', batch
+            )
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            uri = 'file:' + quote(os.path.abspath(self.db_path)) + '?mode=ro'
+            connection = sqlite3.connect(uri, uri=True)
+            self._local.connection = connection
+        return connection
+
+
+def build_store(db_path: str, users: Iterable[Dict]) -> str:
+    """
+    ユーザー一覧からストアを作成し、内容から求めたスナップショットIDを返す
+    同じメールアドレスが複数ある場合は位置は最初の出現、値は最後の出現を採用する（辞書に変換した場合と同じ）
+    """
+    db_dir = os.path.dirname(os.path.abspath(db_path))
+    os.makedirs(db_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=db_dir, suffix='.tmp')
+    os.close(fd)
+
+    digest = hashlib.blake2b(digest_size=20)
+    try:
+        connection = sqlite3.connect(tmp_path)
+        try:
+            # 構築中のファイルは他から参照されないため、ジャーナルを省略して書き込みを速くする
+            connection.execute('PRAGMA journal_mode = OFF')
+            connection.execute('PRAGMA synchronous = OFF')
+            # 型を指定しない列にすることで、JSONの値の型（文字列・数値・null）をそのまま保持する
+            connection.execute(
+                'CREATE TABLE users (email PRIMARY KEY, id, name, position, department, keys INTEGER, attr_hash BLOB)'
+            )
+            rows = []
+            for user in users:
+                values = [user.get(field) for field in STORE_FIELDS]
+                keys = sum(1 << i for i, field in enumerate(STORE_FIELDS) if field in user)
+                attr_hash = attribute_hash([user.get(field) for field in HASH_FIELDS])
+                rows.append(values + [keys, attr_hash])
+                digest.update(_encode(values).encode('utf-8'))
+                if len(rows) >= FETCH_SIZE:
+                    _insert(connection, rows)
+                    rows = []
+            _insert(connection, rows)
+            connection.commit()
+        finally:
+            connection.close()
+        os.replace(tmp_path, db_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return digest.hexdigest()
+
+
+def _insert(connection: sqlite3.Connection, rows: List[list]):
+    connection.executemany(
+        f'INSERT INTO users ({_COLUMNS}, attr_hash) VALUES (?, ?, ?, ?, ?, ?, ?) '
+        'ON CONFLICT(email) DO UPDATE SET id = excluded.id, name = excluded.name, '
+        'position = excluded.position, department = excluded.department, '
+        'keys = excluded.keys, attr_hash = excluded.attr_hash',
+        rows
+    )
+
+
+def attribute_hash(values: Sequence) -> bytes:
+    """属性値の並びのハッシュ（値が等しい場合のみ一致し、nullと空文字列・数値と文字列は区別する）"""
+    return _digest(_encode(values))
+
+
+def hash_str_rows(*columns: Sequence[str]) -> List[bytes]:
+    """文字列のみからなる列を行ごとに attribute_hash と同じ方法でハッシュ（CSV側の一括計算用）"""
+    separator = _SEPARATOR + 's'
+    return [_digest('s' + separator.join(values)) for values in zip(*columns)]
+
+
+def _digest(encoded: str) -> bytes:
+    return hashlib.blake2b(encoded.encode('utf-8'), digest_size=16).digest()
+
+
+def _encode(values: Sequence) -> str:
+    return _SEPARATOR.join(_encode_value(value) for value in values)
+
+
+def _encode_value(value) -> str:
+    if value is None:
+        return 'n'
+    if isinstance(value, str):
+        return 's' + value
+    return 'r' + repr(value)
+
+
+def _row_to_user(row: tuple) -> Dict:
+    # JSONで項目がなかったフィールドはキー自体を含めない（項目がnullの場合と区別する）
+    keys = row[-1]
+    return {field: value for i, (field, value) in enumerate(zip(STORE_FIELDS, row)) if keys & (1 << i)}
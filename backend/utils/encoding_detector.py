@@ -0,0 +1,116 @@
+"""
+CSVファイルのエンコーディング検出
+1. BOMがあれば即座に確定
+2. 先頭サンプルを逐次判定器に投入し、確信が得られた時点で打ち切り
+3. 判定結果でサンプルを厳格にデコードできなければサンプルを拡大して再判定
+判定結果はファイル内容のハッシュをキーにキャッシュする
+"""
+import codecs
+import threading
+from collections import OrderedDict
+
+from chardet import UniversalDetector
+
+from utils.file_hash import content_hash
+from utils.metrics import metrics
+
+# BOMと対応するエンコーディング（UTF-32LEのBOMはUTF-16LEのBOMを含むため先に判定）
+BOMS = [
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+]
+
+# 判定器へ一度に投入するバイト数
+FEED_SIZE = 8 * 1024
+
+# 最初に判定に使用するサンプルサイズ
+INITIAL_SAMPLE_BYTES = 64 * 1024
+
+# サンプル拡大時の上限（これを超えても確定できない場合は判定結果をそのまま使用）
+MAX_SAMPLE_BYTES = 4 * 1024 * 1024
+
+# 互換性のある上位エンコーディングへの置き換え
+# asciiと判定されても後半に日本語が含まれる場合があるため、上位互換のものを使用する
+SUPERSET_ENCODINGS = {
+    'ascii': 'utf-8',
+    'shift_jis': 'cp932',
+}
+
+# キャッシュするエンコーディング判定結果の件数
+CACHE_SIZE = 512
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def detect_encoding(file_path: str) -> str:
+    """ファイルのエンコーディングを検出（結果はファイル内容ごとにキャッシュ）"""
+    with metrics.stage('encoding_detection'):
+        return _detect_encoding(file_path)
+
+
+def _detect_encoding(file_path: str) -> str:
+    key = content_hash(file_path)
+
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+
+    encoding = _sniff_encoding(file_path)
+
+    with _cache_lock:
+        _cache[key] = encoding
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return encoding
+
+
+def _sniff_encoding(file_path: str) -> str:
+    """ファイル先頭のサンプルからエンコーディングを判定"""
+    with open(file_path, 'rb') as f:
+        sample = f.read(INITIAL_SAMPLE_BYTES)
+
+        for bom, encoding in BOMS:
+            if sample.startswith(bom):
+                return encoding
+
+        sample_size = INITIAL_SAMPLE_BYTES
+        while True:
+            at_eof = len(sample) < sample_size
+            encoding = _detect_sample(sample)
+
+            if _decodes_strictly(sample, encoding, at_eof):
+                return encoding
+            if at_eof or sample_size >= MAX_SAMPLE_BYTES:
+                return encoding
+
+            # デコードに失敗した場合はサンプルを拡大して再判定
+            sample_size = min(sample_size * 4, MAX_SAMPLE_BYTES)
+            sample += f.read(sample_size - len(sample))
+
+
+def _detect_sample(sample: bytes) -> str:
+    """逐次判定器にサンプルを投入し、確信が得られた時点で打ち切る"""
+    detector = UniversalDetector()
+    for offset in range(0, len(sample), FEED_SIZE):
+        detector.feed(sample[offset:offset + FEED_SIZE])
+        if detector.done:
+            break
+    detector.close()
+
+    encoding = (detector.result.get('encoding') or 'utf-8').lower()
+    return SUPERSET_ENCODINGS.get(encoding, encoding)
+
+
+def _decodes_strictly(sample: bytes, encoding: str, final: bool) -> bool:
+    """サンプルを厳格モードでデコードできるか検証（末尾で途切れたマルチバイト文字は許容）"""
+    try:
+        decoder = codecs.getincrementaldecoder(encoding)('strict')
+        decoder.decode(sample, final=final)
+        return True
+    except (UnicodeDecodeError, LookupError):
+        return False
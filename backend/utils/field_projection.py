@@ -0,0 +1,84 @@
+"""
+マッピング設定に従ったフィールドの射影
+CSVの各カラムを列単位で文字列化・空白除去・連結し、ユーザー情報のテーブルを組み立てる
+差分比較・プレビュー・同期実行はこの結果を共通で使用する
+"""
+from typing import Dict, Union
+
+import pandas as pd
+
+# 射影後のユーザー情報のカラム（出力する辞書のキーもこの順）
+USER_FIELDS = ('name', 'email', 'position', 'department')
+
+
+def project_users(df: pd.DataFrame, mapping: Dict[str, any]) -> pd.DataFrame:
+    """
+    マッピング設定に従ってユーザー情報のテーブルを作成
+    メールアドレスが空の行は除外し、元の行のインデックスを保持する
+    """
+    email_col = mapping.get('email')
+    if email_col is None:
+        raise ValueError("メールアドレスフィールドが指定されていません")
+
+    emails = column_as_str(df.iloc[:, email_col]).str.strip()
+    valid = ((emails != '') & (emails != 'nan')).to_numpy()
+    df = df[valid]
+
+    return pd.DataFrame({
+        field: emails[valid] if field == 'email' else project_field(df, mapping.get(field))
+        for field in USER_FIELDS
+    }, index=df.index)
+
+
+def project_field(df: pd.DataFrame, col_config: Union[int, list, None]) -> pd.Series:
+    """
+    マッピング設定に従ってフィールドの値を列単位で取得
+    配列の場合は空でない値を半角スペースで連結する
+    """
+    if col_config is None:
+        return _empty(df)
+
+    # 配列の場合は複数フィールドを連結
+    if isinstance(col_config, list):
+        parts = [
+            column_values(df.iloc[:, idx])
+            for idx in col_config
+            if idx is not None and 0 <= idx < df.shape[1]
+        ]
+        if not parts:
+            return _empty(df)
+
+        result = parts[0]
+        for part in parts[1:]:
+            # 両方に値がある場合のみ区切りを入れる（片方が空なら単純な連結で空でない方になる）
+            both = (result != '') & (part != '')
+            result = (result + ' ' + part).where(both, result + part)
+        return result
+
+    # 単一の値の場合
+    if isinstance(col_config, int) and 0 <= col_config < df.shape[1]:
+        return column_values(df.iloc[:, col_config])
+
+    return _empty(df)
+
+
+def column_values(series: pd.Series) -> pd.Series:
+    """前後の空白を除去した文字列に変換（欠損値は空文字）"""
+    values = column_as_str(series).str.strip()
+    values[series.isna().to_numpy()] = ''
+    return values
+
+
+def column_as_str(series: pd.Series) -> pd.Series:
+    """カラム全体をstr(value)と同じ文字列に変換（欠損値は'nan'）"""
+    if series.dtype.kind in 'iufb':
+        values = series.to_numpy().astype(str).tolist()
+    elif pd.api.types.infer_dtype(series, skipna=True) in ('string', 'empty'):
+        values = series.to_numpy(dtype=object, na_value='nan')
+    else:
+        values = [str(value) for value in series.to_numpy(dtype=object)]
+    return pd.Series(values, index=series.index, dtype=object)
+
+
+def _empty(df: pd.DataFrame) -> pd.Series:
+    return pd.Series([''] * len(df), index=df.index, dtype=object)
@@ -0,0 +1,40 @@
+"""
+ファイル内容のハッシュ計算
+エンコーディング判定結果や解析済みデータのキャッシュキーとして使用
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+# 一度に読み込むブロックサイズ
+BLOCK_SIZE = 1024 * 1024
+
+# (パス, サイズ, 更新時刻) → ハッシュ のメモ化件数
+MEMO_SIZE = 256
+
+_memo = OrderedDict()
+_memo_lock = threading.Lock()
+
+
+def content_hash(file_path: str) -> str:
+    """ファイル内容のハッシュ値を取得（同じファイルの再計算はメモ化で省略）"""
+    stat = os.stat(file_path)
+    memo_key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+
+    with _memo_lock:
+        if memo_key in _memo:
+            _memo.move_to_end(memo_key)
+            return _memo[memo_key]
+
+    digest = hashlib.blake2b(digest_size=20)
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(BLOCK_SIZE), b''):
+            digest.update(block)
+    value = digest.hexdigest()
+
+    with _memo_lock:
+        _memo[memo_key] = value
+        while len(_memo) > MEMO_SIZE:
+            _memo.popitem(last=False)
+    return value
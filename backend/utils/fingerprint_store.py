@@ -0,0 +1,89 @@
+"""
+ユーザーごとのフィンガープリントの保存（差分同期用）
+同期に成功した時点の name / position / department のハッシュをメールアドレスごとに保存し、
+次回の同期ではハッシュが変わっていない行の比較とCognitoへの反映を省略する
+"""
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterable, Sequence, Tuple
+
+from utils.directory_store import QUERY_BATCH_SIZE, hash_str_rows
+
+# フィンガープリントの対象フィールド（UserSyncManagerの比較対象と同じ順）
+FINGERPRINT_FIELDS = ('name', 'position', 'department')
+
+
+class FingerprintStore:
+    """メールアドレスごとのフィンガープリントをSQLiteに保存するクラス"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+
+        # 複数のワーカースレッドから使用するため、接続は1つにしてロックで排他する
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        # 他のワーカープロセスが同期結果を書き込んでいる間も読み込めるようにする
+        self._connection.execute('PRAGMA journal_mode = WAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS fingerprints (email TEXT PRIMARY KEY, fingerprint BLOB NOT NULL)'
+        )
+        # 更新の世代番号（保存内容が変わるたびに増やし、保存済みの同期計画が古くなったことの判定に使う）
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS generation (id INTEGER PRIMARY KEY CHECK (id = 0), value INTEGER NOT NULL)'
+        )
+        self._connection.execute('INSERT OR IGNORE INTO generation VALUES (0, 0)')
+        self._connection.commit()
+
+    def get_many(self, emails: Sequence[str]) -> Dict[str, bytes]:
+        """保存済みのフィンガープリントを取得（保存されていないメールアドレスは含めない）"""
+        unique = list(dict.fromkeys(emails))
+        found = {}
+        with self._lock:
+            for start in range(0, len(unique), QUERY_BATCH_SIZE):
+                batch = unique[start:start + QUERY_BATCH_SIZE]
+                placeholders = ', '.join('?' * len(batch))
+                found.update(self._connection.execute(
+                    f'SELECT email, fingerprint FROM fingerprints WHERE email IN ({placeholders})', batch
+                ))
+        return found
+
+    def generation(self) -> int:
+        """更新の世代番号（他のワーカープロセスによる更新も含む）"""
+        with self._lock:
+            return self._connection.execute('SELECT value FROM generation').fetchone()[0]
+
+    def update(self, fingerprints: Iterable[Tuple[str, bytes]]):
+        """フィンガープリントを保存（既存のものは上書き）"""
+        with self._lock, self._connection:
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO fingerprints (email, fingerprint) VALUES (?, ?)', fingerprints
+            )
+            self._bump_generation()
+
+    def delete(self, emails: Iterable[str]):
+        with self._lock, self._connection:
+            self._connection.executemany(
+                'DELETE FROM fingerprints WHERE email = ?', ((email,) for email in emails)
+            )
+            self._bump_generation()
+
+    def clear(self):
+        """全てのフィンガープリントを削除（全件の再同期で作り直す場合）"""
+        with self._lock, self._connection:
+            self._connection.execute('DELETE FROM fingerprints')
+            self._bump_generation()
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def _bump_generation(self):
+        # 呼び出し側のトランザクション内で保存内容と一緒に更新する
+        self._connection.execute('UPDATE generation SET value = value + 1')
+
+
+def user_fingerprint(user: Dict) -> bytes:
+    """射影済みのユーザー（フィールドの値は全て文字列）のフィンガープリント"""
+    return hash_str_rows(*([user[field]] for field in FINGERPRINT_FIELDS))[0]
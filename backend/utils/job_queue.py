@@ -0,0 +1,278 @@
+"""
+バックグラウンドジョブの永続キュー
+実行要求をSQLiteのキューに登録してすぐにジョブIDを返し、ワーカースレッドで順に実行する
+実行中のジョブは定期的に生存通知（ハートビート）と途中経過を書き込み、
+ワーカーの再起動などで通知が途絶えたジョブは、いずれかのワーカーが取り出して再実行する
+"""
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+# ジョブの状態
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+# 終了した状態（これ以上変化しない）
+TERMINAL_STATUSES = (SUCCEEDED, FAILED, CANCELLED)
+
+
+class JobContext:
+    """実行中のジョブの情報（ハンドラーに渡す）"""
+
+    def __init__(self, job_id: str, attempt: int):
+        self.job_id = job_id
+        # 1回目の実行は1、再実行の場合は2以上
+        self.attempt = attempt
+        # 中止が要求された場合に設定される（ハンドラーは定期的に確認して処理を打ち切る）
+        self.cancel_event = threading.Event()
+        self.progress = {}
+        self._lock = threading.Lock()
+
+    def report(self, progress: Dict):
+        """途中経過を更新（キューへの書き込みはハートビートでまとめて行う）"""
+        with self._lock:
+            self.progress.update(progress)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return dict(self.progress)
+
+
+class JobQueue:
+    """SQLiteに永続化するジョブキューとワーカースレッド"""
+
+    def __init__(self, db_path: str, handler: Callable[[Dict, JobContext], Dict], workers: int = 1,
+                 lease_seconds: float = 60.0, heartbeat_interval: float = 1.0,
+                 poll_interval: float = 1.0, max_attempts: int = 3,
+                 retention_seconds: int = 7 * 24 * 3600):
+        self.db_path = db_path
+        self.handler = handler
+        self.workers = workers
+        self.lease_seconds = lease_seconds
+        self.heartbeat_interval = heartbeat_interval
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.retention_seconds = retention_seconds
+
+        self._threads = []
+        self._stopping = threading.Event()
+        self._wakeup = threading.Event()
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with self._connect() as connection:
+            # 複数のワーカープロセスから同時に読み書きするためWALモードにする
+            connection.execute('PRAGMA journal_mode = WAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                'id TEXT PRIMARY KEY, status TEXT NOT NULL, payload TEXT NOT NULL, '
+                'progress TEXT, result TEXT, error TEXT, attempts INTEGER NOT NULL DEFAULT 0, '
+                'cancel_requested INTEGER NOT NULL DEFAULT 0, owner TEXT, heartbeat REAL, '
+                'created_at REAL NOT NULL, started_at REAL, finished_at REAL)'
+            )
+            connection.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)')
+
+    def start(self):
+        """ワーカースレッドを起動"""
+        for _ in range(self.workers - len(self._threads)):
+            thread = threading.Thread(target=self._work, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float = None):
+        """ワーカースレッドを停止（実行中のジョブは終わるまで待つ）"""
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def submit(self, payload: Dict) -> str:
+        """ジョブを登録してIDを返す"""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute(
+                'INSERT INTO jobs (id, status, payload, created_at) VALUES (?, ?, ?, ?)',
+                (job_id, QUEUED, json.dumps(payload, ensure_ascii=False), now)
+            )
+            # 保存期間を過ぎた終了済みのジョブを削除
+            connection.execute(
+                f'DELETE FROM jobs WHERE status IN ({_placeholders(TERMINAL_STATUSES)}) AND finished_at < ?',
+                (*TERMINAL_STATUSES, now - self.retention_seconds)
+            )
+        self._wakeup.set()
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        """ジョブの状態を取得（存在しない場合はNone）"""
+        with self._connect() as connection:
+            row = connection.execute(
+                'SELECT id, status, progress, result, error, attempts, cancel_requested, '
+                'created_at, started_at, finished_at FROM jobs WHERE id = ?', (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            'id': row[0],
+            'status': row[1],
+            'progress': json.loads(row[2]) if row[2] else {},
+            'result': json.loads(row[3]) if row[3] else None,
+            'error': row[4],
+            'attempts': row[5],
+            'cancelRequested': bool(row[6]),
+            'createdAt': _isoformat(row[7]),
+            'startedAt': _isoformat(row[8]),
+            'finishedAt': _isoformat(row[9])
+        }
+
+    def cancel(self, job_id: str) -> Optional[Dict]:
+        """
+        ジョブの中止を要求
+        待機中のジョブはすぐに中止し、実行中のジョブは次のハートビートで実行中のワーカーに通知する
+        """
+        with self._connect() as connection:
+            connection.execute(
+                'UPDATE jobs SET status = ?, cancel_requested = 1, finished_at = ? WHERE id = ? AND status = ?',
+                (CANCELLED, time.time(), job_id, QUEUED)
+            )
+            connection.execute(
+                'UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = ?', (job_id, RUNNING)
+            )
+        return self.get(job_id)
+
+    def active_payloads(self) -> List[Dict]:
+        """待機中・実行中のジョブの実行内容"""
+        with self._connect() as connection:
+            rows = connection.execute(
+                'SELECT payload FROM jobs WHERE status IN (?, ?)', (QUEUED, RUNNING)
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def _work(self):
+        owner = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        while not self._stopping.is_set():
+            job = self._claim(owner)
+            if job is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+            self._run(owner, *job)
+
+    def _claim(self, owner: str):
+        """実行するジョブを1件取り出す（他のワーカーと重複しないよう書き込みロックを取ってから行う）"""
+        now = time.time()
+        stale = now - self.lease_seconds
+        with self._connect() as connection:
+            connection.execute('BEGIN IMMEDIATE')
+            # 生存通知が途絶えたジョブは、中止要求があれば中止・試行回数の上限に達していれば失敗・それ以外は再実行
+            connection.execute(
+                'UPDATE jobs SET status = ?, owner = NULL, finished_at = ? '
+                'WHERE status = ? AND heartbeat < ? AND cancel_requested = 1',
+                (CANCELLED, now, RUNNING, stale)
+            )
+            connection.execute(
+                'UPDATE jobs SET status = ?, owner = NULL, finished_at = ?, error = ? '
+                'WHERE status = ? AND heartbeat < ? AND attempts >= ?',
+                (FAILED, now, 'ワーカーが応答しなくなったため中断されました', RUNNING, stale, self.max_attempts)
+            )
+            connection.execute(
+                'UPDATE jobs SET status = ?, owner = NULL WHERE status = ? AND heartbeat < ?',
+                (QUEUED, RUNNING, stale)
+            )
+
+            row = connection.execute(
+                'SELECT id, payload, attempts FROM jobs WHERE status = ? ORDER BY created_at, rowid LIMIT 1',
+                (QUEUED,)
+            ).fetchone()
+            if row is None:
+                return None
+            connection.execute(
+                'UPDATE jobs SET status = ?, owner = ?, heartbeat = ?, attempts = attempts + 1, '
+                'started_at = COALESCE(started_at, ?) WHERE id = ?',
+                (RUNNING, owner, now, now, row[0])
+            )
+        return row[0], json.loads(row[1]), row[2] + 1
+
+    def _run(self, owner: str, job_id: str, payload: Dict, attempt: int):
+        job = JobContext(job_id, attempt)
+        stop_heartbeat = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(owner, job, stop_heartbeat), daemon=True)
+        heartbeat.start()
+
+        status, result, error = SUCCEEDED, None, None
+        try:
+            result = self.handler(payload, job)
+            if job.cancel_event.is_set():
+                status = CANCELLED
+        except Exception as e:
+            status, error = FAILED, str(e)
+        finally:
+            stop_heartbeat.set()
+            heartbeat.join()
+
+        # 実行中に他のワーカーに引き継がれた場合は結果を書き込まない
+        with self._connect() as connection:
+            connection.execute(
+                'UPDATE jobs SET status = ?, progress = ?, result = ?, error = ?, finished_at = ? '
+                'WHERE id = ? AND owner = ?',
+                (status, json.dumps(job.snapshot(), ensure_ascii=False),
+                 json.dumps(result, ensure_ascii=False) if result is not None else None,
+                 error, time.time(), job_id, owner)
+            )
+
+    def _heartbeat(self, owner: str, job: JobContext, stop: threading.Event):
+        """生存通知と途中経過を定期的に書き込み、中止要求を確認する"""
+        while not stop.wait(self.heartbeat_interval):
+            with self._connect() as connection:
+                updated = connection.execute(
+                    'UPDATE jobs SET heartbeat = ?, progress = ? WHERE id = ? AND owner = ?',
+                    (time.time(), json.dumps(job.snapshot(), ensure_ascii=False), job.job_id, owner)
+                ).rowcount
+                cancel_requested = connection.execute(
+                    'SELECT cancel_requested FROM jobs WHERE id = ?', (job.job_id,)
+                ).fetchone()
+            # 中止が要求された場合や、他のワーカーに引き継がれた場合は処理を打ち切らせる
+            if not updated or (cancel_requested and cancel_requested[0]):
+                job.cancel_event.set()
+
+    def _connect(self) -> sqlite3.Connection:
+        # 接続はスレッドごとに短時間だけ使用する（自動コミット、BEGINを明示した場合のみトランザクション）
+        connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        return _ClosingConnection(connection)
+
+
+class _ClosingConnection:
+    """with文の終了時にコミットして接続を閉じるラッパー"""
+
+    def __init__(self, connection: sqlite3.Connection):
+        self._connection = connection
+
+    def __enter__(self) -> sqlite3.Connection:
+        return self._connection
+
+    def __exit__(self, exc_type, exc, traceback):
+        try:
+            if self._connection.in_transaction:
+                if exc_type is None:
+                    self._connection.execute('COMMIT')
+                else:
+                    self._connection.execute('ROLLBACK')
+        finally:
+            self._connection.close()
+
+
+def _placeholders(values) -> str:
+    return ', '.join('?' * len(values))
+
+
+def _isoformat(timestamp: Optional[float]) -> Optional[str]:
+    return datetime.fromtimestamp(timestamp).isoformat() if timestamp else None
@@ -0,0 +1,93 @@
+"""
+複数キーワードの同時検索（Aho-Corasick法）
+ラベルごとのキーワード表から遷移表を1回だけ構築し、テキストを1回走査して一致したラベルを返す
+構築した遷移表はキーワード表ごとにキャッシュし、リクエストをまたいで再利用する
+"""
+import json
+import os
+from collections import deque
+from functools import lru_cache
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+
+class KeywordMatcher:
+    """ラベル付きキーワードを同時に検索するオートマトン"""
+
+    def __init__(self, keywords: Dict[str, Iterable[str]]):
+        # 状態ごとの遷移先と、その状態で一致が確定するラベル
+        goto = [{}]
+        outputs = [set()]
+
+        for label, words in keywords.items():
+            for word in words:
+                if not word:
+                    continue
+                state = 0
+                for char in word:
+                    if char not in goto[state]:
+                        goto.append({})
+                        outputs.append(set())
+                        goto[state][char] = len(goto) - 1
+                    state = goto[state][char]
+                outputs[state].add(label)
+
+        # 幅優先で失敗遷移を求め、全ての遷移を展開した決定性の遷移表にする
+        # （走査時に失敗遷移をたどる必要がなくなり、1文字1回の辞書参照で済む）
+        fail = [0] * len(goto)
+        transitions = [dict(goto[0])] + [None] * (len(goto) - 1)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            outputs[state] |= outputs[fail[state]]
+            transitions[state] = dict(transitions[fail[state]])
+            for char, next_state in goto[state].items():
+                fail[next_state] = transitions[fail[state]].get(char, 0)
+                transitions[state][char] = next_state
+                queue.append(next_state)
+
+        self._transitions = transitions
+        self._outputs = [frozenset(labels) for labels in outputs]
+        self.labels = frozenset(label for labels in outputs for label in labels)
+
+    def find(self, text: str) -> FrozenSet[str]:
+        """テキスト中に出現するキーワードのラベルを返す（全ラベルが見つかった時点で終了）"""
+        transitions = self._transitions
+        outputs = self._outputs
+        found = set()
+        state = 0
+
+        for char in text:
+            state = transitions[state].get(char, 0)
+            if outputs[state]:
+                found |= outputs[state]
+                if len(found) == len(self.labels):
+                    break
+        return frozenset(found)
+
+
+def get_matcher(keywords: Dict[str, Iterable[str]]) -> KeywordMatcher:
+    """キーワード表に対応するオートマトンを取得（同じキーワード表なら構築済みのものを再利用）"""
+    key = tuple(sorted((label, tuple(words)) for label, words in keywords.items()))
+    return _build_matcher(key)
+
+
+@lru_cache(maxsize=32)
+def _build_matcher(key: Tuple[Tuple[str, Tuple[str, ...]], ...]) -> KeywordMatcher:
+    return KeywordMatcher(dict(key))
+
+
+def load_keyword_config(path: Optional[str] = None) -> Dict[str, Dict[str, List[str]]]:
+    """
+    追加キーワードの設定ファイルを読み込み
+    形式: {"header": {"name": [...], ...}, "value": {"position": [...], ...}}
+    """
+    path = path or os.getenv('FIELD_KEYWORDS_FILE')
+    if not path:
+        return {}
+    return _load_keyword_file(path)
+
+
+@lru_cache(maxsize=8)
+def _load_keyword_file(path: str) -> Dict[str, Dict[str, List[str]]]:
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
@@ -0,0 +1,303 @@
+"""
+ログファイルの読み込み
+最近のログは末尾からブロック単位で逆向きに読み込み、期間・レベル・パスでの検索は
+日時とファイル位置の対応（索引）から読み込みを始める位置を決めて、該当する範囲だけを読み込む
+ローテーション済みのファイル（app.log.1 など）も対象とする
+"""
+import json
+import os
+import re
+import sqlite3
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Sequence
+
+# 末尾から読み込む際のブロックサイズ
+TAIL_BLOCK_SIZE = 64 * 1024
+
+# 索引に日時とファイル位置を記録する間隔（バイト）
+INDEX_INTERVAL = 64 * 1024
+
+# 検索時に一度に読み込むサイズ
+SCAN_BLOCK_SIZE = 256 * 1024
+
+# 複数のワーカープロセスの書き込み順と日時が前後する分の余裕（秒）
+TIME_SLACK_SECONDS = 60
+
+# 検索結果の件数の上限
+MAX_QUERY_LIMIT = 1000
+
+# ファイルの同一性の確認に使う先頭のバイト数（ファイルの番号が再利用された場合の判定用）
+HEAD_BYTES = 64
+
+# ログの日時の形式（logger の出力と同じ）
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# ログの各エントリの先頭行（日時 - ロガー名 - レベル - メッセージ）
+_ENTRY_PATTERN = re.compile(rb'^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}) - (\S+) - ([A-Z]+) - ')
+
+
+def log_files(path: str, backup_count: int) -> List[str]:
+    """ログファイルとローテーション済みのファイルのパス（新しい順、存在するもののみ）"""
+    candidates = [path] + [f'{path}.{index}' for index in range(1, backup_count + 1)]
+    return [candidate for candidate in candidates if os.path.exists(candidate)]
+
+
+def tail_lines(paths: Sequence[str], count: int, block_size: int = TAIL_BLOCK_SIZE) -> List[str]:
+    """
+    最後の count 行を取得（paths は新しい順。足りない場合は古いファイルに続けて読み込む）
+    各ファイルは末尾からブロック単位で逆向きに読み込み、必要な行数が揃った時点で止める
+    """
+    collected = []
+    for path in paths:
+        remaining = count - len(collected)
+        if remaining <= 0:
+            break
+        collected = _tail_file(path, remaining, block_size) + collected
+    return [line.decode('utf-8', errors='replace') for line in collected]
+
+
+def _tail_file(path: str, count: int, block_size: int) -> List[bytes]:
+    try:
+        f = open(path, 'rb')
+    except FileNotFoundError:
+        return []
+    with f:
+        position = f.seek(0, os.SEEK_END)
+        blocks = []
+        newlines = 0
+        # 行数+1個の改行が見つかれば、最初の不完全な行を除いても必要な行数が揃う
+        while position > 0 and newlines <= count:
+            size = min(block_size, position)
+            position -= size
+            f.seek(position)
+            block = f.read(size)
+            blocks.append(block)
+            newlines += block.count(b'\n')
+    lines = b''.join(reversed(blocks)).splitlines(keepends=True)
+    if position > 0:
+        lines = lines[1:]
+    return lines[-count:]
+
+
+def parse_time(value: Optional[str]) -> Optional[str]:
+    """検索条件の日時（ISO 8601）をログの日時の形式にする（タイムゾーン付きの場合はローカル時刻に変換）"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f'不正な日時です: {value}')
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed.strftime(TIME_FORMAT)
+
+
+class LogIndex:
+    """
+    ログファイルごとの日時とファイル位置の対応をSQLiteに保存する索引
+    ファイルはデバイス番号とiノード番号で識別するため、ローテーションで名前が変わっても索引はそのまま使える
+    追記された分だけを読み込んで索引を更新する
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        with self._connect() as connection:
+            # 複数のワーカープロセスから同時に読み書きするためWALモードにする
+            connection.execute('PRAGMA journal_mode = WAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS files ('
+                'dev INTEGER NOT NULL, ino INTEGER NOT NULL, name TEXT NOT NULL, head BLOB NOT NULL, '
+                'indexed_size INTEGER NOT NULL, first_time TEXT, last_time TEXT, '
+                'last_point INTEGER NOT NULL, PRIMARY KEY (dev, ino))'
+            )
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS points ('
+                'dev INTEGER NOT NULL, ino INTEGER NOT NULL, offset INTEGER NOT NULL, time TEXT NOT NULL, '
+                'PRIMARY KEY (dev, ino, offset)) WITHOUT ROWID'
+            )
+
+    def query(self, name: str, paths: Sequence[str], start: str = None, end: str = None,
+              level: str = None, path: str = None, limit: int = 100) -> Dict:
+        """
+        ログを検索（paths は新しい順、結果は古い順）
+        start / end: ログの日時の形式（parse_time で変換したもの）、level: レベル名、path: リクエストのパス
+        """
+        limit = max(1, min(int(limit), MAX_QUERY_LIMIT))
+        level = level.upper() if level else None
+        scan_start = _shift(start, -TIME_SLACK_SECONDS) if start else None
+        scan_end = _shift(end, TIME_SLACK_SECONDS) if end else None
+
+        entries = []
+        truncated = False
+        with self._connect() as connection:
+            files = self._refresh(connection, name, paths)
+            for file_path, key, first_time, last_time in reversed(files):
+                # 全てのエントリが検索期間外のファイルは読み込まない
+                if first_time is None:
+                    continue
+                if scan_start and last_time < scan_start:
+                    continue
+                if scan_end and first_time > scan_end:
+                    continue
+                offset = self._seek_offset(connection, key, scan_start)
+                for entry in _read_entries(file_path, offset, scan_end):
+                    if start and entry['timestamp'] < start:
+                        continue
+                    if end and entry['timestamp'] > end:
+                        continue
+                    if level and entry['level'] != level:
+                        continue
+                    if path and not _path_matches(entry['message'], path):
+                        continue
+                    if len(entries) == limit:
+                        truncated = True
+                        break
+                    entries.append(dict(entry, file=os.path.basename(file_path)))
+                if truncated:
+                    break
+        return {'entries': entries, 'truncated': truncated}
+
+    def _refresh(self, connection: sqlite3.Connection, name: str, paths: Sequence[str]) -> List:
+        """各ファイルの索引を追記された分だけ更新し、(パス, 識別子, 最初の日時, 最後の日時) の一覧を返す"""
+        files = []
+        for file_path in paths:
+            try:
+                with open(file_path, 'rb') as f:
+                    stat = os.fstat(f.fileno())
+                    key = (stat.st_dev, stat.st_ino)
+                    files.append((file_path, key, *self._update_file(connection, f, name, key, stat.st_size)))
+            except FileNotFoundError:
+                continue
+
+        # 削除されたファイルの索引を削除
+        current = {key for _, key, _, _ in files}
+        for key in connection.execute('SELECT dev, ino FROM files WHERE name = ?', (name,)).fetchall():
+            if tuple(key) not in current:
+                connection.execute('DELETE FROM files WHERE dev = ? AND ino = ?', key)
+                connection.execute('DELETE FROM points WHERE dev = ? AND ino = ?', key)
+        return files
+
+    def _update_file(self, connection: sqlite3.Connection, f, name: str, key, size: int):
+        head = f.read(HEAD_BYTES)
+        row = connection.execute(
+            'SELECT head, indexed_size, first_time, last_time, last_point FROM files WHERE dev = ? AND ino = ?', key
+        ).fetchone()
+        # 別のファイルに同じ番号が再利用された場合や、ファイルが切り詰められた場合は作り直す
+        common = min(len(head), len(row[0])) if row is not None else 0
+        if row is not None and (head[:common] != row[0][:common] or row[1] > size):
+            connection.execute('DELETE FROM points WHERE dev = ? AND ino = ?', key)
+            row = None
+        indexed_size, first_time, last_time, last_point = (
+            row[1:] if row is not None else (0, None, None, -INDEX_INTERVAL)
+        )
+        if indexed_size == size:
+            return first_time, last_time
+
+        points = []
+        offset = indexed_size
+        f.seek(offset)
+        remainder = b''
+        while True:
+            block = f.read(SCAN_BLOCK_SIZE)
+            if not block:
+                break
+            lines = (remainder + block).split(b'\n')
+            # 書き込み途中の最後の行は次回に読み込む
+            remainder = lines.pop()
+            for line in lines:
+                match = _ENTRY_PATTERN.match(line)
+                if match:
+                    time_text = match.group(1).decode('ascii')
+                    first_time = first_time or time_text
+                    last_time = time_text
+                    if offset - last_point >= INDEX_INTERVAL:
+                        points.append((*key, offset, time_text))
+                        last_point = offset
+                offset += len(line) + 1
+
+        connection.executemany('INSERT OR IGNORE INTO points VALUES (?, ?, ?, ?)', points)
+        connection.execute(
+            'INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (*key, name, head, offset, first_time, last_time, last_point)
+        )
+        return first_time, last_time
+
+    def _seek_offset(self, connection: sqlite3.Connection, key, scan_start: Optional[str]) -> int:
+        """検索期間の開始より前に記録した位置のうち、最も後ろの位置（該当がなければ先頭）"""
+        if not scan_start:
+            return 0
+        row = connection.execute(
+            'SELECT offset FROM points WHERE dev = ? AND ino = ? AND time < ? ORDER BY offset DESC LIMIT 1',
+            (*key, scan_start)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def _connect(self) -> sqlite3.Connection:
+        return _ClosingConnection(sqlite3.connect(self.db_path, timeout=30))
+
+
+class _ClosingConnection:
+    """with文の終了時にコミットして接続を閉じるラッパー"""
+
+    def __init__(self, connection: sqlite3.Connection):
+        self._connection = connection
+
+    def __enter__(self) -> sqlite3.Connection:
+        return self._connection
+
+    def __exit__(self, exc_type, exc, traceback):
+        try:
+            if exc_type is None:
+                self._connection.commit()
+        finally:
+            self._connection.close()
+
+
+def _read_entries(path: str, offset: int, scan_end: Optional[str]):
+    """指定した位置からエントリを順に読み込む（複数行のエントリは続きの行をまとめる）"""
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        current = None
+        remainder = b''
+        while True:
+            block = f.read(SCAN_BLOCK_SIZE)
+            if not block:
+                break
+            lines = (remainder + block).split(b'\n')
+            remainder = lines.pop()
+            for line in lines:
+                match = _ENTRY_PATTERN.match(line)
+                if match is None:
+                    # 複数行のエントリ（エラーログのJSONなど）の続き
+                    if current is not None:
+                        current['message'] += '\n' + line.decode('utf-8', errors='replace')
+                    continue
+                if current is not None:
+                    yield current
+                timestamp = match.group(1).decode('ascii')
+                if scan_end and timestamp > scan_end:
+                    return
+                current = {
+                    'timestamp': timestamp,
+                    'logger': match.group(2).decode('utf-8', errors='replace'),
+                    'level': match.group(3).decode('ascii'),
+                    'message': line[match.end():].decode('utf-8', errors='replace')
+                }
+        if current is not None:
+            yield current
+
+
+def _path_matches(message: str, path: str) -> bool:
+    """アクセスログ（JSON）はリクエストのパスの前方一致、それ以外はメッセージに含まれるかどうか"""
+    if message.startswith('{'):
+        try:
+            data = json.loads(message)
+        except ValueError:
+            data = None
+        if isinstance(data, dict) and isinstance(data.get('path'), str):
+            return data['path'].startswith(path)
+    return path in message
+
+
+def _shift(time_text: str, seconds: int) -> str:
+    return (datetime.strptime(time_text, TIME_FORMAT) + timedelta(seconds=seconds)).strftime(TIME_FORMAT)
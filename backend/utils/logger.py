@@ -1,13 +1,41 @@
 import logging
 import os
+import sys
+import time
+import atexit
+import threading
+import queue
 from datetime import datetime
-from logging.handlers import RotatingFileHandler
 import json
 import traceback
 
+from utils.log_reader import LogIndex, log_files, tail_lines
+
+try:
+    import fcntl
+except ImportError:  # Windowsではファイルロックなし（単一プロセスでの実行を想定）
+    fcntl = None
+
+# ログファイルの最大サイズとローテーションで残す世代数
+MAX_BYTES = 10 * 1024 * 1024  # 10MB
+BACKUP_COUNT = 5
+
+# バックグラウンドの書き込みで一度にまとめて書き込む最大件数
+WRITE_BATCH_SIZE = 1000
+
+# 終了時に未書き込みのログを書き込むまで待つ最大秒数
+SHUTDOWN_TIMEOUT = 5.0
+
+# 書き込みスレッドの停止要求
+_STOP = object()
+
 
 class DebugLogger:
-    """共通のデバッグログ機能を提供するクラス"""
+    """
+    共通のデバッグログ機能を提供するクラス
+    呼び出し元のスレッドでは出力レベルの判定とキューへの登録のみを行い、
+    整形（JSON化・日時の書式化）とファイルへの書き込みはバックグラウンドのスレッドでまとめて行う
+    """
     
     _instance = None
     
@@ -30,121 +58,286 @@ class DebugLogger:
         self.error_log_file = os.path.join(self.log_dir, 'error.log')
         self.access_log_file = os.path.join(self.log_dir, 'access.log')
         
-        # アプリケーションログの設定
-        self.app_logger = self._setup_logger(
+        # アプリケーションログの設定（LOG_LEVEL=DEBUG の場合のみデバッグログを出力）
+        self.app_logger = _LogTarget(
             'app_logger',
             self.app_log_file,
-            logging.INFO
+            _parse_level(os.getenv('LOG_LEVEL', 'INFO'))
         )
         
         # エラーログの設定
-        self.error_logger = self._setup_logger(
+        self.error_logger = _LogTarget(
             'error_logger',
             self.error_log_file,
             logging.ERROR
         )
         
         # アクセスログの設定
-        self.access_logger = self._setup_logger(
+        self.access_logger = _LogTarget(
             'access_logger',
             self.access_log_file,
             logging.INFO
         )
-    
-    def _setup_logger(self, name, log_file, level):
-        """ロガーのセットアップ"""
-        logger = logging.getLogger(name)
-        logger.setLevel(level)
-        
-        # 既存のハンドラーをクリア
-        logger.handlers.clear()
-        
-        # ファイルハンドラー（ローテーション付き）
-        file_handler = RotatingFileHandler(
-            log_file,
-            maxBytes=10 * 1024 * 1024,  # 10MB
-            backupCount=5,
-            encoding='utf-8'
-        )
-        
-        # コンソールハンドラー
-        console_handler = logging.StreamHandler()
-        
-        # フォーマッター
-        formatter = logging.Formatter(
-            '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-            datefmt='%Y-%m-%d %H:%M:%S'
-        )
-        
-        file_handler.setFormatter(formatter)
-        console_handler.setFormatter(formatter)
         
-        logger.addHandler(file_handler)
-        logger.addHandler(console_handler)
+        # ログ検索用の索引（最初の検索時に作成）
+        self._log_index = None
         
-        return logger
+        self._start_writer()
+        # ワーカープロセスの起動（fork）後は、子プロセス側で書き込みスレッドとファイルを開き直す
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+        atexit.register(self.close)
     
     def info(self, message, data=None):
-        """情報ログを記録"""
-        log_entry = self._create_log_entry(message, data)
-        self.app_logger.info(log_entry)
+        """情報ログを記録（data には呼び出し時に内容を作る関数も指定できる）"""
+        if logging.INFO < self.app_logger.level:
+            return
+        self._queue.put(((self.app_logger,), time.time(), logging.INFO, _format_entry, (message, _snapshot(data))))
     
     def error(self, message, error=None, data=None):
         """エラーログを記録"""
         error_info = {
             'message': message,
-            'data': data
+            'data': _snapshot(data)
         }
         
         if error:
             error_info['error_type'] = type(error).__name__
             error_info['error_message'] = str(error)
+            # スタックトレースは例外を処理中のスレッドでしか取得できないため、ここで文字列にする
             error_info['traceback'] = traceback.format_exc()
         
-        log_entry = json.dumps(error_info, ensure_ascii=False, indent=2)
-        self.error_logger.error(log_entry)
-        self.app_logger.error(log_entry)
+        self._queue.put(((self.error_logger, self.app_logger), time.time(), logging.ERROR, _format_error, (error_info,)))
     
     def access(self, method, path, status_code, response_time=None, user_agent=None):
         """アクセスログを記録"""
-        log_data = {
-            'method': method,
-            'path': path,
-            'status_code': status_code,
-            'response_time': response_time,
-            'user_agent': user_agent,
-            'timestamp': datetime.now().isoformat()
-        }
-        log_entry = json.dumps(log_data, ensure_ascii=False)
-        self.access_logger.info(log_entry)
+        if logging.INFO < self.access_logger.level:
+            return
+        now = time.time()
+        self._queue.put((
+            (self.access_logger,), now, logging.INFO, _format_access,
+            (now, method, path, status_code, response_time, user_agent)
+        ))
     
     def debug(self, message, data=None):
-        """デバッグログを記録"""
-        log_entry = self._create_log_entry(f"[DEBUG] {message}", data)
-        self.app_logger.debug(log_entry)
+        """デバッグログを記録（出力しないレベルの場合は何もしない）"""
+        if logging.DEBUG < self.app_logger.level:
+            return
+        self._queue.put((
+            (self.app_logger,), time.time(), logging.DEBUG, _format_entry, (f"[DEBUG] {message}", _snapshot(data))
+        ))
+    
+    def flush(self, timeout=None):
+        """キューに登録済みのログを書き込み終わるまで待つ"""
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
     
-    def _create_log_entry(self, message, data=None):
-        """ログエントリを作成"""
-        if data:
-            return f"{message} - {json.dumps(data, ensure_ascii=False)}"
-        return message
+    def close(self):
+        """未書き込みのログを書き込んでから書き込みスレッドを停止"""
+        if self._writer.is_alive():
+            self._queue.put(_STOP)
+            self._writer.join(SHUTDOWN_TIMEOUT)
     
     def get_recent_logs(self, log_type='app', lines=100):
-        """最近のログを取得"""
-        log_files = {
+        """最近のログを取得（末尾から逆向きに読み込み、足りない場合はローテーション済みのファイルも読み込む）"""
+        log_file = self._log_files().get(log_type, self.app_log_file)
+        
+        # 直前に記録したログも含めるため、書き込みを待ってから読み込む
+        self.flush(SHUTDOWN_TIMEOUT)
+        return tail_lines(log_files(log_file, BACKUP_COUNT), lines)
+    
+    def query_logs(self, log_type, start=None, end=None, level=None, path=None, limit=100):
+        """
+        ローテーション済みのファイルも含めてログを検索（日時の索引から該当する範囲だけを読み込む）
+        start / end はログの日時の形式（'%Y-%m-%d %H:%M:%S'）
+        """
+        log_file = self._log_files().get(log_type)
+        if log_file is None:
+            raise ValueError(f'不正なログの種類です: {log_type}')
+        
+        self.flush(SHUTDOWN_TIMEOUT)
+        if self._log_index is None:
+            self._log_index = LogIndex(os.path.join(self.log_dir, 'log-index.sqlite'))
+        return self._log_index.query(
+            os.path.basename(log_file), log_files(log_file, BACKUP_COUNT),
+            start=start, end=end, level=level, path=path, limit=limit
+        )
+    
+    def _log_files(self):
+        return {
             'app': self.app_log_file,
             'error': self.error_log_file,
             'access': self.access_log_file
         }
-        
-        log_file = log_files.get(log_type, self.app_log_file)
-        
-        if not os.path.exists(log_file):
-            return []
-        
-        with open(log_file, 'r', encoding='utf-8') as f:
-            lines_list = f.readlines()
-            return lines_list[-lines:]
+    
+    def _start_writer(self):
+        # SimpleQueueは登録時にロックを取らないため、呼び出し元の負荷が小さい
+        self._queue = queue.SimpleQueue()
+        self._writer = threading.Thread(target=self._write_loop, name='log-writer', daemon=True)
+        self._writer.start()
+    
+    def _after_fork(self):
+        for target in (self.app_logger, self.error_logger, self.access_logger):
+            target.reopen()
+        self._start_writer()
+    
+    def _write_loop(self):
+        """キューからログを取り出し、ファイルごとにまとめて書き込む"""
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < WRITE_BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            
+            pending = {}
+            waiters = []
+            stop = False
+            for item in batch:
+                if item is _STOP:
+                    stop = True
+                elif isinstance(item, threading.Event):
+                    waiters.append(item)
+                else:
+                    self._render(item, pending)
+            
+            console = []
+            for target, lines in pending.items():
+                text = ''.join(lines)
+                console.append(text)
+                try:
+                    target.write(text.encode('utf-8'))
+                except OSError as e:
+                    sys.stderr.write(f"ログの書き込みに失敗しました: {target.path}: {e}\n")
+            if console:
+                sys.stderr.write(''.join(console))
+                sys.stderr.flush()
+            
+            for waiter in waiters:
+                waiter.set()
+            if stop:
+                return
+    
+    def _render(self, item, pending):
+        targets, created, level, formatter, args = item
+        try:
+            message = formatter(*args)
+        except Exception as e:
+            # ログの整形に失敗しても書き込みスレッドは止めない
+            message = f"ログの整形に失敗しました: {e!r}"
+        asctime = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(created))
+        level_name = logging.getLevelName(level)
+        for target in targets:
+            if level >= target.level:
+                pending.setdefault(target, []).append(f"{asctime} - {target.name} - {level_name} - {message}\n")
+
+
+class _LogTarget:
+    """
+    ログファイルへの追記とサイズによるローテーション
+    複数のワーカープロセスが同じファイルに書き込むため、ロックファイルで排他してからサイズの確認・ローテーション・追記を行い、
+    他のプロセスがローテーションした後は新しいファイルを開き直す
+    """
+    
+    def __init__(self, name, path, level, max_bytes=MAX_BYTES, backup_count=BACKUP_COUNT):
+        self.name = name
+        self.path = path
+        self.level = level
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._fd = None
+        self._lock_fd = None
+        self.reopen()
+    
+    def reopen(self):
+        """ファイルを開き直す（fork後の子プロセスではロックを親プロセスと共有しないよう別に開く）"""
+        for fd in (self._fd, self._lock_fd):
+            if fd is not None:
+                os.close(fd)
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._lock_fd = os.open(self.path + '.lock', os.O_WRONLY | os.O_CREAT, 0o644)
+    
+    def write(self, data):
+        self._lock()
+        try:
+            self._reopen_if_rotated()
+            size = os.fstat(self._fd).st_size
+            if size > 0 and size + len(data) > self.max_bytes:
+                self._rotate()
+            os.write(self._fd, data)
+        finally:
+            self._unlock()
+    
+    def _reopen_if_rotated(self):
+        # 開いているファイルが他のプロセスによって名前を変えられていれば開き直す
+        try:
+            current = os.stat(self.path)
+        except FileNotFoundError:
+            current = None
+        opened = os.fstat(self._fd)
+        if current is None or (current.st_dev, current.st_ino) != (opened.st_dev, opened.st_ino):
+            os.close(self._fd)
+            self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    
+    def _rotate(self):
+        for index in range(self.backup_count - 1, 0, -1):
+            source = f"{self.path}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index + 1}")
+        os.replace(self.path, f"{self.path}.1")
+        os.close(self._fd)
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    
+    def _lock(self):
+        if fcntl is not None:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+    
+    def _unlock(self):
+        if fcntl is not None:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+
+def _parse_level(name):
+    # 不正なレベル名の場合はINFOとする
+    level = logging.getLevelName(name.upper())
+    return level if isinstance(level, int) else logging.INFO
+
+
+def _snapshot(data):
+    """
+    キューに登録する時点の data の内容（書き込みスレッドで文字列にするまでに呼び出し元が変更しても影響しないよう、
+    辞書は複製する。関数を指定した場合は呼び出して作った値をそのまま使う）
+    """
+    if callable(data):
+        return data()
+    if isinstance(data, dict):
+        return dict(data)
+    return data
+
+
+def _format_entry(message, data=None):
+    """ログエントリを作成"""
+    if data:
+        return f"{message} - {json.dumps(data, ensure_ascii=False, default=str)}"
+    return message
+
+
+def _format_error(error_info):
+    return json.dumps(error_info, ensure_ascii=False, indent=2, default=str)
+
+
+def _format_access(created, method, path, status_code, response_time, user_agent):
+    log_data = {
+        'method': method,
+        'path': path,
+        'status_code': status_code,
+        'response_time': response_time,
+        'user_agent': user_agent,
+        'timestamp': datetime.fromtimestamp(created).isoformat()
+    }
+    return json.dumps(log_data, ensure_ascii=False)
 
 
 # シングルトンインスタンス
@@ -168,5 +361,5 @@ def log_access(method, path, status_code, response_time=None, user_agent=None):
 
 
 def log_debug(message, data=None):
-    """デバッグログを記録する便利関数"""
+    """デバッグログを記録する便利関数（data に関数を指定すると、出力する場合のみ呼び出す）"""
     debug_log.debug(message, data)
\ No newline at end of file
@@ -0,0 +1,353 @@
+"""
+処理段階ごとのメトリクス（処理時間のヒストグラムと件数のカウンター）
+計測値はプロセス内で集計し、定期的にプロセスごとのファイルへ書き出す
+/api/metrics では全てのワーカープロセスのファイルを合算して Prometheus のテキスト形式で出力する
+"""
+import atexit
+import bisect
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windowsではファイルロックなし（単一プロセスでの実行を想定）
+    fcntl = None
+
+# 処理時間のヒストグラムの区切り（秒）
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+# メトリクス名
+STAGE_DURATION = 'csvsync_stage_duration_seconds'
+STAGE_ITEMS = 'csvsync_stage_items_total'
+COGNITO_REQUEST_DURATION = 'csvsync_cognito_request_duration_seconds'
+COGNITO_REQUESTS = 'csvsync_cognito_requests_total'
+
+# メトリクスの種類と説明
+METRICS = {
+    STAGE_DURATION: ('histogram', '処理段階ごとの処理時間（内側の処理段階の時間を除く）'),
+    STAGE_ITEMS: ('counter', '処理段階ごとの処理件数（行数・ユーザー数）'),
+    COGNITO_REQUEST_DURATION: ('histogram', 'Cognitoへの操作1件あたりの処理時間（再試行を含む）'),
+    COGNITO_REQUESTS: ('counter', 'Cognitoへの操作の件数（結果別）')
+}
+
+# 集計済みのファイルにまとめた、終了したプロセスの計測値
+ARCHIVE_FILE = 'archive.json'
+
+
+class _StageFrame:
+    """実行中の処理段階（内側の処理段階の時間を集計して、自身の時間から除く）"""
+
+    __slots__ = ('children', 'items')
+
+    def __init__(self):
+        self.children = 0.0
+        self.items = 0
+
+
+class MetricsRegistry:
+    """プロセス内のメトリクスの集計（複数のスレッドから記録できる）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._local = threading.local()
+        self._directory = None
+        self._flush_interval = None
+        self._flusher = None
+        self._stopping = threading.Event()
+        self._token = uuid.uuid4().hex[:8]
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def configure(self, directory: str, flush_interval: float = 5.0):
+        """プロセスごとの計測値を書き出すディレクトリを設定し、定期的な書き出しを開始"""
+        os.makedirs(directory, exist_ok=True)
+        self._directory = directory
+        self._flush_interval = flush_interval
+        self._start_flusher()
+        atexit.register(self._flush_at_exit)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        index = _bucket_index(value)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * (len(DURATION_BUCKETS) + 1), 0.0, 0]
+            histogram[0][index] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        処理段階の処理時間を計測（with文の中で items に処理件数を加える）
+        処理段階が入れ子になった場合は、内側の処理段階の時間を外側から除く
+        """
+        stack = self._stack()
+        frame = _StageFrame()
+        stack.append(frame)
+        start = time.perf_counter()
+        try:
+            yield frame
+        finally:
+            elapsed = time.perf_counter() - start
+            stack.pop()
+            if stack:
+                stack[-1].children += elapsed
+            self._record_stage(name, elapsed - frame.children, frame.items)
+
+    def timed_iter(self, name: str, iterable: Iterable, size: Callable = len) -> Iterator:
+        """
+        イテレータから取り出す処理（CSVのチャンクの解析など）の時間を処理段階として計測
+        取り出した要素を使う側の処理時間は含めず、全て取り出した時点でまとめて記録する
+        """
+        iterator = iter(iterable)
+        frame = _StageFrame()
+        total = 0.0
+        try:
+            while True:
+                stack = self._stack()
+                stack.append(frame)
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    elapsed = time.perf_counter() - start
+                    stack.pop()
+                    total += elapsed
+                    if stack:
+                        stack[-1].children += elapsed
+                frame.items += size(item)
+                yield item
+        finally:
+            self._record_stage(name, total - frame.children, frame.items)
+
+    def snapshot(self) -> Dict:
+        """プロセス内の計測値（ファイルへの書き出し用）"""
+        with self._lock:
+            return {
+                'counters': [[name, labels, value] for (name, labels), value in self._counters.items()],
+                'histograms': [
+                    [name, labels, list(buckets), total, count]
+                    for (name, labels), (buckets, total, count) in self._histograms.items()
+                ]
+            }
+
+    def render(self) -> str:
+        """全てのワーカープロセスの計測値を合算して Prometheus のテキスト形式で出力"""
+        snapshots = [self.snapshot()]
+        if self._directory is not None:
+            with self._directory_lock(shared=True):
+                for path in self._snapshot_files(include_archive=True):
+                    if path != self._snapshot_path():
+                        snapshot = _read_snapshot(path)
+                        if snapshot is not None:
+                            snapshots.append(snapshot)
+        return _format(_merge(snapshots))
+
+    def flush(self):
+        """プロセス内の計測値をファイルに書き出す"""
+        if self._directory is None:
+            return
+        _write_snapshot(self._snapshot_path(), self.snapshot())
+
+    def _record_stage(self, name: str, seconds: float, items: int):
+        self.observe(STAGE_DURATION, seconds, stage=name)
+        if items:
+            self.inc(STAGE_ITEMS, items, stage=name)
+
+    def _stack(self) -> list:
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _start_flusher(self):
+        self._stopping.clear()
+        self._flusher = threading.Thread(target=self._flush_loop, name='metrics-flusher', daemon=True)
+        self._flusher.start()
+
+    def _flush_loop(self):
+        while not self._stopping.wait(self._flush_interval):
+            try:
+                self.flush()
+                self._archive_finished()
+            except OSError:
+                # 書き出しに失敗しても計測は続ける（次回の書き出しで再試行）
+                pass
+
+    def _flush_at_exit(self):
+        self._stopping.set()
+        try:
+            self.flush()
+        except OSError:
+            pass
+
+    def _after_fork(self):
+        # 子プロセスは親プロセスの計測値を引き継がない（親プロセスの分は親プロセスのファイルで集計する）
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._token = uuid.uuid4().hex[:8]
+        self._stopping = threading.Event()
+        if self._directory is not None:
+            self._start_flusher()
+
+    def _archive_finished(self):
+        """終了したプロセスのファイルを集計済みのファイルにまとめる（プロセスごとのファイルが増え続けないようにする）"""
+        finished = [
+            path for path in self._snapshot_files(include_archive=False)
+            if not _process_alive(_file_pid(path))
+        ]
+        if not finished:
+            return
+        with self._directory_lock(shared=False):
+            archive_path = os.path.join(self._directory, ARCHIVE_FILE)
+            snapshots = [snapshot for snapshot in map(_read_snapshot, [archive_path] + finished) if snapshot]
+            _write_snapshot(archive_path, _merge(snapshots))
+            for path in finished:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def _snapshot_path(self) -> str:
+        return os.path.join(self._directory, f'{os.getpid()}-{self._token}.json')
+
+    def _snapshot_files(self, include_archive: bool):
+        for entry in os.scandir(self._directory):
+            if not entry.name.endswith('.json'):
+                continue
+            if entry.name == ARCHIVE_FILE and not include_archive:
+                continue
+            yield entry.path
+
+    @contextmanager
+    def _directory_lock(self, shared: bool):
+        # 集計済みのファイルへまとめている間に合算すると二重に数えるため、ロックファイルで排他する
+        if fcntl is None:
+            yield
+            return
+        fd = os.open(os.path.join(self._directory, '.lock'), os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+
+def _bucket_index(value: float) -> int:
+    # 区切りの値ちょうどはその区切りに含める（Prometheus の le と同じ）
+    return bisect.bisect_left(DURATION_BUCKETS, value)
+
+
+def _merge(snapshots: Iterable[Dict]) -> Dict:
+    counters = {}
+    histograms = {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot['counters']:
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, buckets, total, count in snapshot['histograms']:
+            key = (name, tuple(map(tuple, labels)))
+            current = histograms.setdefault(key, [[0] * len(buckets), 0.0, 0])
+            current[0] = [a + b for a, b in zip(current[0], buckets)]
+            current[1] += total
+            current[2] += count
+    return {
+        'counters': [[name, labels, value] for (name, labels), value in counters.items()],
+        'histograms': [
+            [name, labels, buckets, total, count] for (name, labels), (buckets, total, count) in histograms.items()
+        ]
+    }
+
+
+def _format(snapshot: Dict) -> str:
+    samples = {}
+    for name, labels, value in snapshot['counters']:
+        samples.setdefault(name, []).append(f'{name}{_labels(labels)} {_number(value)}')
+    for name, labels, buckets, total, count in sorted(snapshot['histograms'], key=lambda h: (h[0], h[1])):
+        lines = samples.setdefault(name, [])
+        cumulative = 0
+        for bound, bucket in zip(DURATION_BUCKETS + (float('inf'),), buckets):
+            cumulative += bucket
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append(f'{name}_bucket{_labels(list(labels) + [("le", le)])} {cumulative}')
+        lines.append(f'{name}_sum{_labels(labels)} {_number(total)}')
+        lines.append(f'{name}_count{_labels(labels)} {count}')
+
+    output = []
+    for name in sorted(samples):
+        metric_type, help_text = METRICS.get(name, ('untyped', ''))
+        output.append(f'# HELP {name} {help_text}')
+        output.append(f'# TYPE {name} {metric_type}')
+        output.extend(sorted(samples[name]) if metric_type == 'counter' else samples[name])
+    return '\n'.join(output) + '\n'
+
+
+def _labels(labels) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels) + '}'
+
+
+def _escape(value) -> str:
+    # ラベルの値のバックスラッシュ・二重引用符・改行はエスケープする
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _read_snapshot(path: str) -> Optional[Dict]:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _write_snapshot(path: str, snapshot: Dict):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(snapshot, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def _file_pid(path: str) -> Optional[int]:
+    try:
+        return int(os.path.basename(path).split('-', 1)[0])
+    except ValueError:
+        return None
+
+
+def _process_alive(pid: Optional[int]) -> bool:
+    if pid is None:
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+# シングルトンインスタンス
+metrics = MetricsRegistry()
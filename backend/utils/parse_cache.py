@@ -0,0 +1,136 @@
+"""
+解析済みCSVのキャッシュ
+ファイル内容のハッシュをキーに、読み込んだチャンクを列指向形式（Parquet）でディスクに保存する
+アップロード・プレビュー・実行の各段階や同一ファイルの再アップロードでは、
+エンコーディング判定とCSVの解析を省略してキャッシュからチャンクを読み込む
+"""
+import os
+import shutil
+import tempfile
+import time
+from typing import Iterable, Iterator, Optional
+
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401
+    PARQUET_AVAILABLE = True
+except ImportError:
+    # pyarrowを含めないLambdaパッケージなどではpickle形式で保存する
+    PARQUET_AVAILABLE = False
+
+# 保存形式を変更した場合はバージョンを上げて古いキャッシュを無効化する
+FORMAT_VERSION = 2
+
+
+class ParsedCSVCache:
+    """解析済みチャンクをディスク上にキャッシュするクラス"""
+
+    def __init__(self, base_dir: str, ttl_seconds: int = 24 * 3600,
+                 max_bytes: int = 1024 * 1024 * 1024, max_entries: int = 200):
+        self.base_dir = base_dir
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.suffix = '.parquet' if PARQUET_AVAILABLE else '.pkl'
+        os.makedirs(self.base_dir, exist_ok=True)
+
+    def load(self, key: str) -> Optional[Iterator[pd.DataFrame]]:
+        """キャッシュ済みのチャンクを返す（キャッシュがない場合はNone）"""
+        entry_dir = self._entry_dir(key)
+        try:
+            if time.time() - os.path.getmtime(entry_dir) > self.ttl_seconds:
+                self._remove(entry_dir)
+                return None
+            # 最終アクセス時刻を更新してLRUの順序に反映
+            os.utime(entry_dir)
+            parts = sorted(name for name in os.listdir(entry_dir) if name.endswith(self.suffix))
+        except FileNotFoundError:
+            return None
+        return self._read_parts(entry_dir, parts)
+
+    def store(self, key: str, chunks: Iterable[pd.DataFrame]) -> Iterator[pd.DataFrame]:
+        """
+        チャンクをそのまま返しながらキャッシュに書き込む
+        最後まで読み込まれた場合のみキャッシュを確定し、途中で打ち切られた場合は破棄する
+        """
+        tmp_dir = tempfile.mkdtemp(dir=self.base_dir, prefix='.tmp-')
+        completed = False
+        try:
+            for index, chunk in enumerate(chunks):
+                self._write_part(chunk, os.path.join(tmp_dir, f'part-{index:05d}{self.suffix}'))
+                yield chunk
+            completed = True
+        finally:
+            if completed:
+                self._commit(tmp_dir, self._entry_dir(key))
+                self.evict(keep=key)
+            else:
+                self._remove(tmp_dir)
+
+    def evict(self, keep: str = None):
+        """期限切れのエントリと、上限を超えた古いエントリを削除"""
+        now = time.time()
+        entries = []
+
+        for entry in os.scandir(self.base_dir):
+            if not entry.is_dir():
+                continue
+            try:
+                mtime = entry.stat().st_mtime
+                size = sum(part.stat().st_size for part in os.scandir(entry.path))
+            except FileNotFoundError:
+                # 他のワーカーが先に削除した場合
+                continue
+            if entry.name.startswith('.tmp-'):
+                # 書き込み途中で異常終了したワーカーの残骸を削除
+                if now - mtime > self.ttl_seconds:
+                    self._remove(entry.path)
+                continue
+            if now - mtime > self.ttl_seconds and entry.name != self._entry_name(keep):
+                self._remove(entry.path)
+            else:
+                entries.append((mtime, size, entry.path))
+
+        # 最終アクセスが古い順に、上限内に収まるまで削除
+        entries.sort()
+        total_bytes = sum(size for _, size, _ in entries)
+        count = len(entries)
+        for _, size, path in entries:
+            if total_bytes <= self.max_bytes and count <= self.max_entries:
+                break
+            if os.path.basename(path) == self._entry_name(keep):
+                continue
+            self._remove(path)
+            total_bytes -= size
+            count -= 1
+
+    def _read_parts(self, entry_dir: str, parts: list) -> Iterator[pd.DataFrame]:
+        for name in parts:
+            path = os.path.join(entry_dir, name)
+            if PARQUET_AVAILABLE:
+                yield pd.read_parquet(path)
+            else:
+                yield pd.read_pickle(path)
+
+    def _write_part(self, chunk: pd.DataFrame, path: str):
+        if PARQUET_AVAILABLE:
+            chunk.to_parquet(path)
+        else:
+            chunk.to_pickle(path)
+
+    def _commit(self, tmp_dir: str, entry_dir: str):
+        try:
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            # 他のワーカーが同じ内容を先にキャッシュした場合
+            self._remove(tmp_dir)
+
+    def _remove(self, path: str):
+        shutil.rmtree(path, ignore_errors=True)
+
+    def _entry_name(self, key: Optional[str]) -> Optional[str]:
+        return f'v{FORMAT_VERSION}-{key}' if key else None
+
+    def _entry_dir(self, key: str) -> str:
+        return os.path.join(self.base_dir, self._entry_name(key))
@@ -0,0 +1,489 @@
+"""
+シャードに分割したユーザー同期（map-reduce）
+CSVのユーザーと既存ユーザーをメールアドレスのハッシュでN個のシャードに分け、
+シャードごとに独立して比較・同期（削除対象は同じシャードの既存ユーザーとの比較で決まる）し、最後に結果を合算する
+シャードにはデータを直接渡さず、共有の保存先（S3またはローカルのディレクトリ）に置いた実行単位（run）を参照させる
+- 開始時: CSVをそのまま保存し、既存ユーザーをシャードごとのファイルに分けて保存してから、シャードを起動する
+- 各シャード: CSVを読み込みながら自分のシャードの行のみを残し、自分のシャードの既存ユーザーのみを読み込んで、結果を保存する
+- 合算: 保存されたシャードごとの結果を読み込んで合算する（Lambdaの場合は全シャードの終了後に状態の取得で合算する）
+シャードの実行はローカルのプロセスプール、またはLambdaの非同期呼び出しで行う
+"""
+import functools
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, Iterable, Iterator, List, Mapping, Optional
+
+import pandas as pd
+from botocore.exceptions import ClientError
+
+from utils.aws_clients import get_client
+from utils.cognito_executor import DEFAULT_RATE_LIMITS, error_code
+from utils.csv_analyzer import CSVAnalyzer, process_context
+from utils.field_projection import USER_FIELDS, project_users
+from utils.fingerprint_store import FingerprintStore
+from utils.metrics import metrics
+from utils.user_sync import UserSyncManager
+
+# 射影済みのユーザー（USER_FIELDS の順のカラム）に対するマッピング
+SHARD_MAPPING = {field: index for index, field in enumerate(USER_FIELDS)}
+
+# プレビューとして返す件数（分割しない場合と同じ）
+PREVIEW_SIZE = 10
+
+# 結果が保存されないシャードを失敗とみなすまでの時間（秒、開始から。
+# Lambdaの最大実行時間に、同時実行数の上限により非同期呼び出しがキューで待つ時間を加えたもの）
+SHARD_TIMEOUT_SECONDS = 3600
+
+# 実行単位のID（uuid4の16進数）
+RUN_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+
+def shard_of(email: str, shard_count: int) -> int:
+    """メールアドレスのシャード番号（プロセス・実行環境によらず同じ値になるハッシュを使う）"""
+    digest = hashlib.blake2b(email.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % shard_count
+
+
+def shard_users(chunks: Iterable[pd.DataFrame], mapping: Dict[str, any], shard: int,
+                shard_count: int) -> Iterator[pd.DataFrame]:
+    """CSVのチャンクをマッピングに従って射影し、指定したシャードの行のみを返す（SHARD_MAPPING で比較する）"""
+    for chunk in chunks:
+        users = project_users(chunk, mapping)
+        mask = [shard_of(email, shard_count) == shard for email in users['email'].tolist()]
+        yield users[mask]
+
+
+class LocalShardStorage:
+    """実行単位をローカルのディレクトリに保存（プロセスプールで実行する場合）"""
+
+    def __init__(self, base_dir: str):
+        self.base_dir = base_dir
+        os.makedirs(base_dir, exist_ok=True)
+
+    def spec(self) -> Dict:
+        """シャードに渡す保存先の指定（open_storage で復元する）"""
+        return {'type': 'local', 'path': self.base_dir}
+
+    def put(self, key: str, data: bytes):
+        # 合算時に書き込み途中のファイルが見えないよう、一時ファイルから置き換える
+        path = self._path(key)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            with open(self._path(key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def upload_file(self, key: str, file_path: str):
+        shutil.copyfile(file_path, self._path(key))
+
+    def download_file(self, key: str, file_path: str):
+        shutil.copyfile(self._path(key), file_path)
+
+    def delete_run(self, run_id: str):
+        shutil.rmtree(os.path.join(self.base_dir, run_id), ignore_errors=True)
+
+    def _path(self, key: str) -> str:
+        path = os.path.join(self.base_dir, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+
+class S3ShardStorage:
+    """実行単位をS3に保存（Lambdaで実行する場合。古い実行単位はライフサイクルルールで削除する）"""
+
+    def __init__(self, bucket: str, prefix: str = 'shard-runs'):
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def spec(self) -> Dict:
+        return {'type': 's3', 'bucket': self.bucket, 'prefix': self.prefix}
+
+    def put(self, key: str, data: bytes):
+        get_client('s3').put_object(Bucket=self.bucket, Key=self._key(key), Body=data)
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            response = get_client('s3').get_object(Bucket=self.bucket, Key=self._key(key))
+        except ClientError as e:
+            if error_code(e) == 'NoSuchKey':
+                return None
+            raise
+        return response['Body'].read()
+
+    def upload_file(self, key: str, file_path: str):
+        # 大きなファイルはマルチパートでアップロードされる
+        get_client('s3').upload_file(file_path, self.bucket, self._key(key))
+
+    def download_file(self, key: str, file_path: str):
+        get_client('s3').download_file(self.bucket, self._key(key), file_path)
+
+    def delete_run(self, run_id: str):
+        client = get_client('s3')
+        paginator = client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self._key(f'{run_id}/')):
+            objects = [{'Key': item['Key']} for item in page.get('Contents', [])]
+            if objects:
+                client.delete_objects(Bucket=self.bucket, Delete={'Objects': objects})
+
+    def _key(self, key: str) -> str:
+        return f'{self.prefix}/{key}' if self.prefix else key
+
+
+def open_storage(spec: Dict):
+    """保存先の指定（spec）から保存先を作成"""
+    if spec['type'] == 's3':
+        return S3ShardStorage(spec['bucket'], spec.get('prefix', ''))
+    return LocalShardStorage(spec['path'])
+
+
+def _manifest_key(run_id: str) -> str:
+    return f'{run_id}/manifest.json'
+
+
+def _input_key(run_id: str) -> str:
+    return f'{run_id}/input.csv'
+
+
+def _directory_key(run_id: str, shard: int) -> str:
+    return f'{run_id}/directory/{shard:04d}.jsonl.gz'
+
+
+def _result_key(run_id: str, shard: int) -> str:
+    return f'{run_id}/results/{shard:04d}.json'
+
+
+def sync_shard(task: Dict, cognito_client_factory: Callable = None) -> Dict:
+    """
+    1つのシャードを比較・同期して結果を保存（プロセスプールのワーカー、またはシャード実行用のLambdaで呼び出す）
+    task: 保存先の指定（storage）・実行単位のID（runId）・シャード番号（shard）のみを含む辞書（ShardedSync.tasks で作成）
+    cognito_client_factory: Cognitoのクライアントを作成する関数（ProcessPoolShardBackend で指定した場合のみ）
+    結果が保存済みの場合は再実行しない（Lambdaの非同期呼び出しが再試行された場合に、同じ操作を重複して実行しない）
+    失敗した場合も例外は送出せず、エラーを結果として保存する
+    """
+    storage = open_storage(task['storage'])
+    result_key = _result_key(task['runId'], task['shard'])
+    saved = storage.get(result_key)
+    if saved is not None:
+        return json.loads(saved)
+
+    try:
+        result = _sync_partition(storage, task, cognito_client_factory)
+    except Exception as e:
+        result = _failed_shard(task, e)
+    storage.put(result_key, json.dumps(result, ensure_ascii=False).encode('utf-8'))
+    return result
+
+
+def _sync_partition(storage, task: Dict, client_factory: Optional[Callable]) -> Dict:
+    run_id, shard = task['runId'], task['shard']
+    manifest = json.loads(storage.get(_manifest_key(run_id)))
+    shard_count = manifest['shardCount']
+
+    fingerprint_store = FingerprintStore(manifest['fingerprintPath']) if manifest.get('fingerprintPath') else None
+    sync_manager = UserSyncManager(
+        manifest.get('cognitoUserPoolId'),
+        cognito_client=client_factory() if client_factory is not None else None,
+        max_workers=manifest.get('maxWorkers', 8),
+        rate_limits=manifest.get('rateLimits'),
+        fingerprint_store=fingerprint_store
+    )
+    fd, csv_path = tempfile.mkstemp(suffix='.csv')
+    os.close(fd)
+    try:
+        storage.download_file(_input_key(run_id), csv_path)
+        existing_users = _read_directory(storage.get(_directory_key(run_id, shard)))
+        # CSVはチャンク単位で読み込み、自分のシャードの行のみを比較する（メモリ使用量はシャード数に応じて減る）
+        chunks = shard_users(CSVAnalyzer().read_csv_chunks(csv_path), manifest['mapping'], shard, shard_count)
+        new_users, update_users, delete_users = sync_manager.compare_users(
+            chunks, SHARD_MAPPING, existing_users, full_resync=manifest.get('fullResync', False)
+        )
+        # 全件の再同期でのフィンガープリントの削除は、他のシャードの分も消えないよう開始時に1回だけ行う
+        sync_manager.full_resync = False
+
+        result = {
+            'shard': shard,
+            'summary': {'toAdd': len(new_users), 'toUpdate': len(update_users), 'toDelete': len(delete_users)},
+            'newUsers': new_users[:PREVIEW_SIZE],
+            'updateUsers': update_users[:PREVIEW_SIZE],
+            'deleteUsers': delete_users[:PREVIEW_SIZE]
+        }
+        if not manifest.get('dryRun', True):
+            result['results'] = sync_manager.execute_sync(new_users, update_users, delete_users, dry_run=False)
+        return result
+    finally:
+        os.remove(csv_path)
+        if fingerprint_store is not None:
+            fingerprint_store.close()
+
+
+def _read_directory(data: Optional[bytes]) -> Dict[str, Dict]:
+    """シャードの既存ユーザー（1行ごとに [メールアドレス, ユーザー] のJSONをgzipで圧縮したもの）を読み込む"""
+    if data is None:
+        raise FileNotFoundError('シャードの既存ユーザーが保存されていません')
+    users = {}
+    for line in gzip.decompress(data).splitlines():
+        if line:
+            email, user = json.loads(line)
+            users[email] = user
+    return users
+
+
+def merge_results(shard_results: List[Dict], executed: bool) -> Dict:
+    """
+    シャードごとの結果を合算（プレビュー・エラーはシャードの順に並べる）
+    executed: 同期を実行した場合は True（results を合算する）
+    失敗したシャードは failedShards に含め、件数には含めない
+    """
+    shard_results = sorted(shard_results, key=lambda result: result['shard'])
+    succeeded = [result for result in shard_results if 'error' not in result]
+    merged = {
+        'summary': {
+            key: sum(result['summary'][key] for result in succeeded)
+            for key in ('toAdd', 'toUpdate', 'toDelete')
+        },
+        'shards': [{'shard': result['shard'], **result['summary']} for result in succeeded],
+        'failedShards': [
+            {'shard': result['shard'], 'error': result['error']} for result in shard_results if 'error' in result
+        ]
+    }
+    for key in ('newUsers', 'updateUsers', 'deleteUsers'):
+        merged[key] = [user for result in succeeded for user in result[key]][:PREVIEW_SIZE]
+
+    if executed:
+        results = [result['results'] for result in succeeded]
+        now = datetime.now().isoformat()
+        merged['results'] = {
+            'added': sum(result['added'] for result in results),
+            'updated': sum(result['updated'] for result in results),
+            'deleted': sum(result['deleted'] for result in results),
+            'errors': [error for result in results for error in result['errors']],
+            'startTime': min((result['startTime'] for result in results), default=now),
+            'endTime': max((result['endTime'] for result in results), default=now)
+        }
+        if any(result.get('cancelled') for result in results):
+            merged['results']['cancelled'] = True
+    return merged
+
+
+def _failed_shard(task: Dict, error) -> Dict:
+    return {'shard': task['shard'], 'error': str(error)}
+
+
+class ProcessPoolShardBackend:
+    """
+    シャードをローカルのワーカープロセスで並列に実行（Lambdaを使わない検証・オンプレミスでの実行用）
+    スレッドを持つプロセス（gunicornのワーカーなど）からforkするとロックを保持したまま複製されて停止することがあるため、
+    ワーカープロセスはforkserver（使えない環境ではspawn）で起動する
+    """
+
+    # シャードは呼び出し元と同じホストで実行する（ローカルのフィンガープリントを共有できる）
+    shares_host = True
+
+    def __init__(self, max_workers: int = None, cognito_client_factory: Callable = None):
+        self.max_workers = max_workers
+        # シャードごとにCognitoのクライアントを作成する関数（負荷試験用の差し替え。
+        # タスクはLambdaの呼び出し内容と共通でJSONにするため含めず、ワーカーに別に渡す。pickle できるものにする）
+        self.cognito_client_factory = cognito_client_factory
+        # 同時に実行するシャードの数（レート制限の配分に使う）
+        self.concurrency = max_workers or os.cpu_count() or 1
+
+    def dispatch(self, func: Callable[[Dict], Dict], tasks: List[Dict]) -> List[Dict]:
+        """シャードを実行して終了を待つ（戻り値は起動・実行できなかったシャードのエラー）"""
+        with ProcessPoolExecutor(max_workers=self.max_workers, mp_context=process_context()) as pool:
+            if self.cognito_client_factory is not None:
+                func = functools.partial(func, cognito_client_factory=self.cognito_client_factory)
+            futures = [pool.submit(func, task) for task in tasks]
+            failures = []
+            for task, future in zip(tasks, futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    failures.append(_failed_shard(task, e))
+            return failures
+
+
+class LambdaShardBackend:
+    """
+    シャードごとにLambda（同じ関数のシャード実行モード）を非同期呼び出しする
+    呼び出しは起動の受け付けのみを待ち、シャードの終了は待たない（結果は保存先から合算する）
+    同時実行数はシャード実行用の関数の予約済み同時実行数で concurrency 以下に制限する
+    """
+
+    # シャードは別の実行環境で実行する（/tmp のフィンガープリントは共有できない）
+    shares_host = False
+
+    def __init__(self, function_name: str, max_concurrency: int = 10):
+        self.function_name = function_name
+        # 同時に実行するシャードの数（レート制限の配分に使う）
+        self.concurrency = max_concurrency
+
+    def dispatch(self, func: Callable[[Dict], Dict], tasks: List[Dict]) -> List[Dict]:
+        """シャードの実行を依頼（戻り値は起動を依頼できなかったシャードのエラー）"""
+        client = get_client('lambda')
+        with ThreadPoolExecutor(max_workers=min(len(tasks), 16) or 1) as pool:
+            errors = pool.map(lambda task: self._invoke(client, task), tasks)
+            return [error for error in errors if error is not None]
+
+    def _invoke(self, client, task: Dict) -> Optional[Dict]:
+        try:
+            client.invoke(
+                FunctionName=self.function_name, InvocationType='Event',
+                Payload=json.dumps({'shardTask': task}).encode('utf-8')
+            )
+        except Exception as e:
+            return _failed_shard(task, e)
+        return None
+
+
+class ShardedSync:
+    """
+    ユーザー同期をシャードに分割して実行するクラス
+    backend: dispatch(func, tasks) でシャードを実行するもの（ProcessPoolShardBackend / LambdaShardBackend）
+    storage: 実行単位の保存先（LocalShardStorage / S3ShardStorage。シャードから参照できるものにする）
+    fingerprint_store: 呼び出し元と同じホストで実行する場合のみ指定できる
+        （Lambdaのシャードは別の実行環境の /tmp を参照できないため、フィンガープリントを使わず全件を比較する）
+    rate_limits: 全シャードの合計のレート制限（同時に実行するシャードの数で等分して各シャードに割り当てる）
+    """
+
+    def __init__(self, shard_count: int, backend, storage, cognito_user_pool_id: str = None,
+                 fingerprint_store: FingerprintStore = None, max_workers: int = 8,
+                 rate_limits: Dict[str, float] = None, shard_timeout: int = SHARD_TIMEOUT_SECONDS):
+        if shard_count < 1:
+            raise ValueError('シャード数は1以上を指定してください')
+        if fingerprint_store is not None and not backend.shares_host:
+            raise ValueError('別の実行環境で実行するシャードではフィンガープリントを使用できません')
+        self.shard_count = shard_count
+        self.backend = backend
+        self.storage = storage
+        self.cognito_user_pool_id = cognito_user_pool_id
+        self.fingerprint_store = fingerprint_store
+        self.max_workers = max_workers
+        self.rate_limits = rate_limits
+        self.shard_timeout = shard_timeout
+
+    def run(self, csv_path: str, mapping: Dict[str, any], existing_users: Mapping[str, Dict],
+            dry_run: bool = True, full_resync: bool = False) -> Dict:
+        """シャードの終了を待って合算した結果を返す（終了を待つバックエンド（プロセスプール）用）"""
+        run_id = self.start(csv_path, mapping, existing_users, dry_run=dry_run, full_resync=full_resync)
+        try:
+            return self.status(run_id)
+        finally:
+            self.storage.delete_run(run_id)
+
+    def start(self, csv_path: str, mapping: Dict[str, any], existing_users: Mapping[str, Dict],
+              dry_run: bool = True, full_resync: bool = False) -> str:
+        """
+        実行単位を保存してシャードを起動し、実行単位のIDを返す
+        CSVは解析せずにそのまま保存し、既存ユーザーはストアを走査しながらシャードごとのファイルに書き出す
+        """
+        run_id = uuid.uuid4().hex
+        with metrics.stage('shard_partition') as stage:
+            self.storage.upload_file(_input_key(run_id), csv_path)
+            stage.items += self._write_directory(run_id, existing_users)
+
+        # 各シャードは独立してレート制限するため、ユーザープールのクォータを同時に実行するシャードで分け合う
+        parallel = max(1, min(self.shard_count, self.backend.concurrency))
+        manifest = {
+            'shardCount': self.shard_count,
+            'mapping': mapping,
+            'dryRun': dry_run,
+            'fullResync': full_resync,
+            'cognitoUserPoolId': self.cognito_user_pool_id,
+            'maxWorkers': self.max_workers,
+            'rateLimits': {
+                operation: rate / parallel
+                for operation, rate in dict(DEFAULT_RATE_LIMITS, **(self.rate_limits or {})).items()
+            },
+            'fingerprintPath': self.fingerprint_store.db_path if self.fingerprint_store is not None else None,
+            'createdAt': time.time()
+        }
+        self.storage.put(_manifest_key(run_id), json.dumps(manifest, ensure_ascii=False).encode('utf-8'))
+
+        if not dry_run and full_resync and self.fingerprint_store is not None:
+            # シャードごとに削除すると他のシャードの保存分まで消えるため、実行前にまとめて削除する
+            self.fingerprint_store.clear()
+
+        for failure in self.backend.dispatch(sync_shard, self.tasks(run_id)):
+            self.storage.put(
+                _result_key(run_id, failure['shard']), json.dumps(failure, ensure_ascii=False).encode('utf-8')
+            )
+        return run_id
+
+    def tasks(self, run_id: str) -> List[Dict]:
+        """シャードごとの実行内容（保存先と実行単位への参照のみ）"""
+        return [{'storage': self.storage.spec(), 'runId': run_id, 'shard': shard} for shard in range(self.shard_count)]
+
+    def status(self, run_id: str) -> Dict:
+        """実行単位の状態（run_status を参照）"""
+        return run_status(self.storage, run_id, self.shard_timeout)
+
+    def _write_directory(self, run_id: str, existing_users: Mapping[str, Dict]) -> int:
+        """既存ユーザー（辞書またはDirectoryStore）をシャードごとのファイルに書き出し、件数を返す"""
+        count = 0
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            paths = [os.path.join(tmp_dir, f'{shard}.jsonl.gz') for shard in range(self.shard_count)]
+            files = [gzip.open(path, 'wt', encoding='utf-8') for path in paths]
+            try:
+                for email, user in existing_users.items():
+                    line = json.dumps([email, user], ensure_ascii=False)
+                    files[shard_of(email, self.shard_count)].write(line + '\n')
+                    count += 1
+            finally:
+                for f in files:
+                    f.close()
+            for shard, path in enumerate(paths):
+                self.storage.upload_file(_directory_key(run_id, shard), path)
+        return count
+
+
+def run_status(storage, run_id: str, shard_timeout: int = SHARD_TIMEOUT_SECONDS) -> Dict:
+    """
+    実行単位の状態（completed: 全シャードの結果が揃った場合は True）
+    全シャードの結果が揃った場合は合算した結果（summary・プレビュー・shards・failedShards、同期した場合は results）を含める
+    開始から shard_timeout を過ぎても結果のないシャードは失敗とみなす
+    """
+    if not RUN_ID_PATTERN.match(run_id or ''):
+        raise ValueError('実行単位のIDが不正です')
+    data = storage.get(_manifest_key(run_id))
+    if data is None:
+        raise KeyError(run_id)
+    manifest = json.loads(data)
+    expired = time.time() - manifest['createdAt'] > shard_timeout
+
+    results = []
+    for shard in range(manifest['shardCount']):
+        saved = storage.get(_result_key(run_id, shard))
+        if saved is not None:
+            results.append(json.loads(saved))
+        elif expired:
+            results.append({'shard': shard, 'error': 'シャードの結果が時間内に保存されませんでした'})
+
+    status = {
+        'runId': run_id,
+        'dryRun': manifest['dryRun'],
+        'shardCount': manifest['shardCount'],
+        'completedShards': len(results),
+        'completed': len(results) == manifest['shardCount']
+    }
+    if status['completed']:
+        status.update(merge_results(results, executed=not manifest['dryRun']))
+    return status
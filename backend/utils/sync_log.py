@@ -0,0 +1,93 @@
+"""
+同期の処理ログ（操作ごとの結果）
+同期の実行中に操作が終わるたびにCSVファイルへ追記し、ダウンロード時はファイルを少しずつ読み込んで返す
+（操作件数が多い場合もログ全体をメモリ上に作らない）
+"""
+import csv
+import re
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Iterable, Iterator
+
+# ログの見出し
+LOG_HEADER = ('処理日時', '操作', 'メールアドレス', '結果', 'エラー内容')
+
+# 結果の表記
+RESULT_SUCCESS = '成功'
+RESULT_FAILURE = '失敗'
+RESULT_DRY_RUN = 'ドライラン'
+
+# 追記した行をファイルに書き出す間隔（秒）と行数（どちらかに達したら書き出し、実行中のジョブのログもダウンロードできるようにする）
+FLUSH_INTERVAL = 1.0
+FLUSH_ROWS = 100
+
+# ダウンロード時に一度に読み込むサイズ
+READ_BLOCK_SIZE = 64 * 1024
+
+# ログIDの形式（ジョブIDと同じ32桁の16進数）
+_LOG_ID_PATTERN = re.compile(r'[0-9a-f]{32}')
+
+
+class SyncLogWriter:
+    """処理ログへの追記（複数のワーカースレッドから呼び出せる）"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        # 追記専用で開く（ジョブを再実行した場合は前回の途中までのログに続けて書き込む）
+        self._file = open(path, 'a', encoding='utf-8', newline='')
+        self._writer = csv.writer(self._file)
+        if self._file.tell() == 0:
+            self._writer.writerow(LOG_HEADER)
+        self._pending = 0
+        self._flushed_at = time.monotonic()
+
+    def __enter__(self) -> 'SyncLogWriter':
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.close()
+
+    def record(self, operation: str, email: str, error: Exception = None):
+        """1件の操作の結果を追記"""
+        row = (_now(), operation, email, RESULT_FAILURE if error else RESULT_SUCCESS, str(error) if error else '')
+        with self._lock:
+            self._writer.writerow(row)
+            self._pending += 1
+            if self._pending >= FLUSH_ROWS or time.monotonic() - self._flushed_at >= FLUSH_INTERVAL:
+                self._flush()
+
+    def record_many(self, operation: str, users: Iterable[Dict], result: str = RESULT_SUCCESS):
+        """まとめて処理した操作の結果を追記（ドライランなど、個別に実行しない場合）"""
+        timestamp = _now()
+        with self._lock:
+            self._writer.writerows((timestamp, operation, user['email'], result, '') for user in users)
+            self._flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def _flush(self):
+        self._file.flush()
+        self._pending = 0
+        self._flushed_at = time.monotonic()
+
+
+def log_artifact(log_id: str) -> str:
+    """処理ログのファイル名（セッションに付随して保存）"""
+    if not isinstance(log_id, str) or not _LOG_ID_PATTERN.fullmatch(log_id):
+        raise ValueError('不正なログIDです')
+    return f'sync-log-{log_id}.csv'
+
+
+def iter_log(path: str, block_size: int = READ_BLOCK_SIZE) -> Iterator[bytes]:
+    """処理ログをブロック単位で読み込む（ストリーミングでのダウンロード用）"""
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            yield block
+
+
+def _now() -> str:
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
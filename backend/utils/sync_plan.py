@@ -0,0 +1,44 @@
+"""
+同期計画（プレビューで確定した追加・更新・削除の一覧）の保存と再利用
+比較の入力（CSVの内容・フィールドマッピング・既存ユーザーのスナップショット・フィンガープリントの世代）から
+計画の版（スタンプ）を作り、同じ版の計画は比較をやり直さずにそのまま実行に使う
+計画のファイルは版ごとに別名で保存し、一度書き込んだ後は変更しない
+"""
+import hashlib
+import json
+from typing import Dict, List, Tuple
+
+from utils.diff_store import OPERATIONS, SyncDiff
+from utils.file_hash import content_hash
+
+# 計画の形式の版（比較の仕様を変えた場合に増やし、以前の計画を使わないようにする）
+PLAN_FORMAT_VERSION = 1
+
+
+def plan_stamp(csv_path: str, mapping: Dict, directory_snapshot_id: str = None,
+               fingerprint_generation: int = None, full_resync: bool = False) -> Dict:
+    """比較の入力から計画の版を作成（CSVのハッシュはメモ化されるため、同じファイルの再計算は行わない）"""
+    return {
+        'formatVersion': PLAN_FORMAT_VERSION,
+        'csvHash': content_hash(csv_path),
+        'mapping': mapping,
+        'directorySnapshotId': directory_snapshot_id,
+        'fingerprintGeneration': fingerprint_generation,
+        'fullResync': bool(full_resync)
+    }
+
+
+def plan_id(stamp: Dict) -> str:
+    """計画の版のID（入力が同じであれば同じIDになる）"""
+    payload = json.dumps(stamp, sort_keys=True, ensure_ascii=False).encode('utf-8')
+    return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+
+def plan_artifact(plan_id: str) -> str:
+    """計画のファイル名（セッションに付随して保存）"""
+    return f'plan-{plan_id}.sqlite'
+
+
+def load_plan(plan: SyncDiff) -> Tuple[List[Dict], List[Dict], List[Dict]]:
+    """保存済みの計画から追加・更新・削除の一覧を読み込む"""
+    return tuple(list(plan.iter_operation(operation)) for operation in OPERATIONS)
@@ -0,0 +1,44 @@
+"""
+同期の途中経過
+execute_sync が集計している件数（results）から途中経過を作り、処理速度と残り時間の見積もりを加える
+"""
+import time
+from typing import Dict
+
+# 途中経過に含める直近のエラーの件数
+RECENT_ERRORS = 5
+
+# 件数を集計するキー（execute_sync の results と同じ名前）
+COUNT_KEYS = ('added', 'updated', 'deleted')
+
+
+def progress_counts(results: Dict) -> Dict:
+    """execute_sync の途中経過から件数と直近のエラーを取り出す（操作が終わるたびに呼ばれるため軽い処理にする）"""
+    progress = {key: results[key] for key in COUNT_KEYS}
+    progress['errors'] = len(results['errors'])
+    progress['recentErrors'] = results['errors'][-RECENT_ERRORS:]
+    return progress
+
+
+def progress_event(progress: Dict, now: float = None) -> Dict:
+    """
+    途中経過に処理済み件数・処理速度（件/秒）・残り時間の見積もり（秒）を加える
+    処理速度は同期を開始してからの平均で、開始前や見積もれない場合の残り時間はNone
+    """
+    now = now or time.time()
+    total = sum(progress.get('total', {}).values())
+    processed = sum(progress.get(key, 0) for key in COUNT_KEYS) + progress.get('errors', 0)
+
+    started_at = progress.get('syncStartedAt')
+    elapsed = now - started_at if started_at else 0
+    throughput = processed / elapsed if elapsed > 0 else 0.0
+    eta = (total - processed) / throughput if throughput > 0 else None
+
+    event = dict(progress)
+    event.update({
+        'processed': processed,
+        'totalCount': total,
+        'throughput': round(throughput, 1),
+        'etaSeconds': round(eta, 1) if eta is not None else None
+    })
+    return event
@@ -0,0 +1,224 @@
+"""
+アップロードされたCSVのセッションストア
+ファイルはローカルディスクにそのまま保存し、同一ホスト上の複数ワーカープロセスから共有する
+有効期限（TTL）と合計サイズ・件数の上限を超えたセッションは古い順（LRU）に削除する
+（同期差分・処理ログなどの付随するファイルもサイズに含め、同期ジョブが参照しているセッションは削除しない）
+"""
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+import uuid
+from typing import BinaryIO, Callable, Dict, Iterable, Optional
+
+# セッションIDの形式（パストラバーサル防止のため厳密にチェック）
+SESSION_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+DATA_SUFFIX = '.csv'
+META_SUFFIX = '.json'
+# セッションに付随するファイルを保存するディレクトリ
+ARTIFACT_SUFFIX = '.artifacts'
+
+
+class UploadSessionStore:
+    """アップロードファイルをディスク上で管理するクラス"""
+
+    def __init__(self, base_dir: str, ttl_seconds: int = 3600,
+                 max_bytes: int = 512 * 1024 * 1024, max_sessions: int = 100,
+                 in_use: Callable[[], Iterable[str]] = None):
+        self.base_dir = base_dir
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.max_sessions = max_sessions
+        # 使用中のセッションID（待機中・実行中の同期ジョブが参照するもの）を返す関数
+        # 使用中のセッションは有効期限・上限を超えても削除しない
+        self.in_use = in_use
+        os.makedirs(self.base_dir, exist_ok=True)
+
+    def create(self, stream: BinaryIO, filename: str = None) -> str:
+        """アップロードされたストリームを保存し、新しいセッションIDを返す"""
+        session_id = uuid.uuid4().hex
+
+        # 一時ファイルに書き込んでからリネームし、読み込み途中のファイルを見せない
+        fd, tmp_path = tempfile.mkstemp(dir=self.base_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                shutil.copyfileobj(stream, f, 1024 * 1024)
+            os.replace(tmp_path, self._data_path(session_id))
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        self.save_metadata(session_id, {
+            'filename': filename,
+            'size': os.path.getsize(self._data_path(session_id)),
+            'created_at': time.time()
+        })
+        self.evict(keep=session_id)
+        return session_id
+
+    def get_path(self, session_id: str) -> Optional[str]:
+        """セッションのCSVファイルパスを取得（期限切れ・存在しない場合はNone）"""
+        if not self._is_valid_id(session_id):
+            return None
+
+        path = self._data_path(session_id)
+        try:
+            expired = time.time() - self._last_access(session_id, os.stat(path)) > self.ttl_seconds
+            if expired and session_id not in self._sessions_in_use():
+                self.delete(session_id)
+                return None
+        except FileNotFoundError:
+            return None
+        self._touch(session_id)
+        return path
+
+    def get_metadata(self, session_id: str) -> Optional[Dict]:
+        """セッションのメタデータを取得"""
+        if not self._is_valid_id(session_id):
+            return None
+        try:
+            with open(self._meta_path(session_id), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def save_metadata(self, session_id: str, metadata: Dict):
+        """セッションのメタデータを保存（既存の項目にマージ）"""
+        current = self.get_metadata(session_id) or {}
+        current.update(metadata)
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.base_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(current, f, ensure_ascii=False)
+        os.replace(tmp_path, self._meta_path(session_id))
+
+    def artifact_path(self, session_id: str, name: str) -> Optional[str]:
+        """
+        セッションに付随するファイル（同期差分など）のパス（セッションの削除時に合わせて削除される）
+        保存先のディレクトリはセッションが存在する場合のみ作成する
+        """
+        if not self._is_valid_id(session_id):
+            return None
+        artifact_dir = self._artifact_dir(session_id)
+        if os.path.exists(self._data_path(session_id)):
+            os.makedirs(artifact_dir, exist_ok=True)
+        return os.path.join(artifact_dir, name)
+
+    def delete(self, session_id: str):
+        """セッションを削除（付随するファイルも含む）"""
+        if not self._is_valid_id(session_id):
+            return
+        for path in (self._data_path(session_id), self._meta_path(session_id)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        shutil.rmtree(self._artifact_dir(session_id), ignore_errors=True)
+
+    def evict(self, keep: str = None):
+        """期限切れのセッションと、上限を超えた古いセッションを削除"""
+        now = time.time()
+        sessions = []
+        # 削除しないセッション（今回作成したもの・同期ジョブが参照しているもの）
+        pinned = set(self._sessions_in_use())
+        if keep is not None:
+            pinned.add(keep)
+
+        for entry in os.scandir(self.base_dir):
+            if entry.name.endswith('.tmp'):
+                # 書き込み途中で異常終了したワーカーの残骸を削除
+                self._remove_stale_file(entry, now)
+                continue
+            if entry.name.endswith(ARTIFACT_SUFFIX):
+                # セッションの削除の途中で異常終了した場合など、CSVが残っていない付随ファイルを削除
+                session_id = entry.name[:-len(ARTIFACT_SUFFIX)]
+                if session_id not in pinned and not os.path.exists(self._data_path(session_id)):
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                continue
+            if not entry.name.endswith((DATA_SUFFIX, META_SUFFIX)):
+                # 付随するファイルを base_dir 直下に保存していた以前の形式のファイルは、期限切れになったものを削除
+                if entry.is_file():
+                    self._remove_stale_file(entry, now)
+                continue
+            if not entry.name.endswith(DATA_SUFFIX):
+                continue
+            session_id = entry.name[:-len(DATA_SUFFIX)]
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                # 他のワーカーが先に削除した場合
+                continue
+            last_access = self._last_access(session_id, stat)
+            if now - last_access > self.ttl_seconds and session_id not in pinned:
+                self.delete(session_id)
+            else:
+                sessions.append((last_access, stat.st_size + self._artifact_bytes(session_id), session_id))
+
+        # 最終アクセスが古い順に、上限内に収まるまで削除
+        sessions.sort()
+        total_bytes = sum(size for _, size, _ in sessions)
+        count = len(sessions)
+        for _, size, session_id in sessions:
+            if total_bytes <= self.max_bytes and count <= self.max_sessions:
+                break
+            if session_id in pinned:
+                continue
+            self.delete(session_id)
+            total_bytes -= size
+            count -= 1
+
+    def _last_access(self, session_id: str, data_stat: os.stat_result) -> float:
+        """
+        最終アクセス時刻（メタデータファイルの更新時刻）
+        CSVファイルの更新時刻は内容のハッシュのメモ化（file_hash）のキーに含まれるため、アクセスのたびに変更しない
+        """
+        try:
+            return max(os.path.getmtime(self._meta_path(session_id)), data_stat.st_mtime)
+        except FileNotFoundError:
+            return data_stat.st_mtime
+
+    def _artifact_bytes(self, session_id: str) -> int:
+        """セッションに付随するファイルの合計サイズ"""
+        total = 0
+        try:
+            for entry in os.scandir(self._artifact_dir(session_id)):
+                try:
+                    total += entry.stat().st_size
+                except FileNotFoundError:
+                    pass
+        except FileNotFoundError:
+            pass
+        return total
+
+    def _sessions_in_use(self) -> Iterable[str]:
+        return self.in_use() if self.in_use is not None else ()
+
+    def _touch(self, session_id: str):
+        # 最終アクセス時刻をメタデータファイルに記録してLRUの順序に反映
+        try:
+            os.utime(self._meta_path(session_id))
+        except FileNotFoundError:
+            self.save_metadata(session_id, {})
+
+    def _remove_stale_file(self, entry: os.DirEntry, now: float):
+        try:
+            if now - entry.stat().st_mtime > self.ttl_seconds:
+                os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+
+    def _is_valid_id(self, session_id) -> bool:
+        return isinstance(session_id, str) and bool(SESSION_ID_PATTERN.match(session_id))
+
+    def _data_path(self, session_id: str) -> str:
+        return os.path.join(self.base_dir, session_id + DATA_SUFFIX)
+
+    def _meta_path(self, session_id: str) -> str:
+        return os.path.join(self.base_dir, session_id + META_SUFFIX)
+
+    def _artifact_dir(self, session_id: str) -> str:
+        return os.path.join(self.base_dir, session_id + ARTIFACT_SUFFIX)
@@ -0,0 +1,242 @@
+"""
+既存ユーザー一覧（ディレクトリ）の読み込み
+CognitoのListUsersを順にページングし（ユーザー数の多いプールはメールアドレスの先頭文字ごとの区間に分けて並列に取得）、
+取得した一覧をローカルのスナップショット（索引付きストア）として保存して、有効期限内はAPIを呼び出さずに再利用する
+AWSに接続できない環境では、JSONファイル（またはboto3互換のスタブクライアント）から読み込む
+"""
+import json
+import os
+import string
+import tempfile
+import uuid
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Iterator, List, Mapping
+
+from utils.aws_clients import get_client
+from utils.cognito_executor import TokenBucket, call_with_retry
+from utils.directory_store import FORMAT_VERSION, DirectoryStore, build_store
+from utils.file_hash import content_hash
+from utils.metrics import metrics
+
+# Cognitoのフィルターは前方一致（^=）のみのため、メールアドレスの先頭に使える文字ごとに区間を分ける
+# （ASCII以外の文字で始まるメールアドレスは取得対象外）
+EMAIL_PREFIXES = tuple(string.ascii_lowercase + string.digits + string.ascii_uppercase + "!#$%&'*+-/=?^_`{|}~.")
+
+# ListUsersの1ページあたりの最大件数
+LIST_USERS_PAGE_SIZE = 60
+
+# ListUsersのクォータ（1秒あたりのリクエスト数）
+LIST_USERS_RATE_LIMIT = 30.0
+
+# 区間に分けて並列に取得するユーザー数（推定値）の下限
+# （区間に分けると区間の数だけ必ずListUsersを呼び出すため、少ないプールでは1回のページングの方が速い）
+SEGMENTED_LIST_MIN_USERS = 10000
+
+# 現在のスナップショットを指すファイル（Cognitoから取得した場合）
+CURRENT_SNAPSHOT_FILE = 'current.json'
+
+# 取得する属性（Cognitoの属性名 → 既存ユーザーのフィールド名）
+USER_ATTRIBUTES = {
+    'email': 'email',
+    'name': 'name',
+    'custom:position': 'position',
+    'custom:department': 'department',
+}
+
+
+class CognitoUserLister:
+    """
+    Cognitoのユーザー一覧をページングして取得するクラス
+    ユーザー数の多いプールは区間ごとに並列に取得し、区間のいずれにも当たらないユーザー
+    （ASCII以外の文字で始まるメールアドレスなど）がいる可能性がある場合は、区間に分けずに取得し直す
+    """
+
+    def __init__(self, cognito_client, user_pool_id: str, max_workers: int = 8,
+                 prefixes: tuple = EMAIL_PREFIXES, rate_limit: float = LIST_USERS_RATE_LIMIT,
+                 segmented_min_users: int = SEGMENTED_LIST_MIN_USERS):
+        self.cognito_client = cognito_client
+        self.user_pool_id = user_pool_id
+        self.max_workers = max_workers
+        self.prefixes = prefixes
+        self.segmented_min_users = segmented_min_users
+        self._bucket = TokenBucket(rate_limit)
+
+    def iter_users(self) -> Iterator[Dict]:
+        """
+        全ユーザーを返す（区間に分けた場合は区間の順、区間内はページの順）
+        フィルターが大文字・小文字を区別しない場合は区間が重複するため、同じユーザーが複数回現れることがある
+        """
+        estimated = self._estimated_users()
+        if estimated is None or estimated < self.segmented_min_users:
+            yield from self._list_pages(None)
+            return
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            segments = list(pool.map(self._list_segment, self.prefixes))
+        # 区間で取得できたユーザーが推定値より少ない場合は、区間に当たらないユーザーを取りこぼしている可能性がある
+        found = len({user['email'] for segment in segments for user in segment})
+        if found < estimated:
+            yield from self._list_pages(None)
+            return
+        for segment in segments:
+            yield from segment
+
+    def _estimated_users(self):
+        """プールのユーザー数の推定値（取得できない場合はNone）"""
+        try:
+            response = call_with_retry(
+                lambda: self.cognito_client.describe_user_pool(UserPoolId=self.user_pool_id), self._bucket
+            )
+        except Exception:
+            # DescribeUserPoolの権限がない場合などは、区間に分けずに取得する
+            return None
+        return response.get('UserPool', {}).get('EstimatedNumberOfUsers')
+
+    def _list_segment(self, prefix: str) -> List[Dict]:
+        return list(self._list_pages(prefix))
+
+    def _list_pages(self, prefix) -> Iterator[Dict]:
+        params = {
+            'UserPoolId': self.user_pool_id,
+            'Limit': LIST_USERS_PAGE_SIZE,
+            'AttributesToGet': ['sub'] + list(USER_ATTRIBUTES),
+        }
+        if prefix is not None:
+            params['Filter'] = f'email ^= "{prefix}"'
+        while True:
+            response = call_with_retry(lambda: self.cognito_client.list_users(**params), self._bucket)
+            for user in response.get('Users', []):
+                yield to_directory_user(user)
+            token = response.get('PaginationToken')
+            if not token:
+                return
+            params['PaginationToken'] = token
+
+
+def to_directory_user(cognito_user: Dict) -> Dict:
+    """ListUsersのユーザーを既存ユーザーの形式（JSONファイルと同じ形式）に変換"""
+    attributes = {attr['Name']: attr['Value'] for attr in cognito_user.get('Attributes', [])}
+    user = {
+        'id': attributes.get('sub', cognito_user['Username']),
+        'email': attributes.get('email', cognito_user['Username']),
+    }
+    # Cognitoは空の値の属性を保持しないため、値のない属性は空文字列とする（CSVの空欄と一致させ、毎回更新対象にならないようにする）
+    for attribute, field in USER_ATTRIBUTES.items():
+        if field not in user:
+            user[field] = attributes.get(attribute, '')
+    return user
+
+
+class UserDirectory:
+    """
+    既存ユーザー一覧を取得元から読み込み、スナップショットのストアとして再利用するクラス
+    JSONファイルの場合は内容が変わるまで、Cognitoの場合は有効期限内は同じストアを返す
+    ストアはディスク上に置くため、同一ホストのワーカー間・再起動後も共有される
+    """
+
+    def __init__(self, store_dir: str, source_path: str = None,
+                 cognito_user_pool_id: str = None, cognito_client=None,
+                 ttl_seconds: int = 300, max_workers: int = 8):
+        self.store_dir = store_dir
+        self.source_path = source_path
+        self.cognito_user_pool_id = cognito_user_pool_id
+        self.cognito_client = cognito_client
+        self.ttl_seconds = ttl_seconds
+        self.max_workers = max_workers
+        self.snapshot_id = None
+        self._store = None
+        self._lock = threading.Lock()
+        os.makedirs(self.store_dir, exist_ok=True)
+
+    def load(self, refresh: bool = False) -> Mapping[str, Dict]:
+        """
+        既存ユーザーをメールアドレスをキーとする読み取り専用のマッピングで返す
+        全件はメモリに読み込まず、検索・走査のたびにストアから読み込む
+        """
+        with self._lock, metrics.stage('directory_load'):
+            if self.cognito_user_pool_id:
+                snapshot_id = None if refresh else self._current_snapshot_id()
+                if snapshot_id is None:
+                    snapshot_id = self._refresh_from_cognito()
+            elif self.source_path:
+                snapshot_id = content_hash(self.source_path)
+                if not os.path.exists(self._store_path(snapshot_id)):
+                    build_store(self._store_path(snapshot_id), self._read_source())
+            else:
+                return {}
+
+            if self._store is None or self._store.snapshot_id != snapshot_id:
+                self._store = DirectoryStore(self._store_path(snapshot_id), snapshot_id)
+                self.snapshot_id = snapshot_id
+                self._remove_stale_stores(snapshot_id)
+            return self._store
+
+    def invalidate(self):
+        """同期の実行後など、スナップショットを破棄して次回の読み込みで再取得させる"""
+        with self._lock:
+            try:
+                os.remove(os.path.join(self.store_dir, CURRENT_SNAPSHOT_FILE))
+            except FileNotFoundError:
+                pass
+
+    def _current_snapshot_id(self):
+        path = os.path.join(self.store_dir, CURRENT_SNAPSHOT_FILE)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl_seconds:
+                return None
+            with open(path, 'r', encoding='utf-8') as f:
+                snapshot_id = json.load(f)['snapshotId']
+        except (FileNotFoundError, ValueError, KeyError):
+            return None
+        return snapshot_id if os.path.exists(self._store_path(snapshot_id)) else None
+
+    def _refresh_from_cognito(self) -> str:
+        client = self.cognito_client or get_client('cognito-idp')
+        lister = CognitoUserLister(client, self.cognito_user_pool_id, max_workers=self.max_workers)
+
+        # スナップショットIDは内容から決まるため、一時的な名前で作成してから置き換える
+        building_path = os.path.join(self.store_dir, f'.{uuid.uuid4().hex}.building')
+        snapshot_id = build_store(building_path, lister.iter_users())
+        os.replace(building_path, self._store_path(snapshot_id))
+
+        self._write_current({
+            'snapshotId': snapshot_id,
+            'createdAt': datetime.now().isoformat(),
+            'source': f'cognito:{self.cognito_user_pool_id}'
+        })
+        return snapshot_id
+
+    def _write_current(self, current: Dict):
+        # 他のワーカーが読み込み中でも壊れたファイルが見えないよう、一時ファイルから置き換える
+        fd, tmp_path = tempfile.mkstemp(dir=self.store_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(current, f)
+            os.replace(tmp_path, os.path.join(self.store_dir, CURRENT_SNAPSHOT_FILE))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def _read_source(self) -> Iterator[Dict]:
+        with open(self.source_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return iter(data['users'])
+
+    def _remove_stale_stores(self, keep: str):
+        # 他のワーカーが参照している可能性があるため、有効期限を過ぎた古いストアのみ削除する
+        now = time.time()
+        for name in os.listdir(self.store_dir):
+            if not name.endswith('.sqlite') or name == os.path.basename(self._store_path(keep)):
+                continue
+            path = os.path.join(self.store_dir, name)
+            try:
+                if now - os.path.getmtime(path) > self.ttl_seconds:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _store_path(self, snapshot_id: str) -> str:
+        return os.path.join(self.store_dir, f'v{FORMAT_VERSION}-{snapshot_id}.sqlite')
@@ -1,19 +1,55 @@
 import json
-import boto3
-from typing import Dict, List, Tuple
+import threading
+from typing import Callable, Dict, Iterable, List, Mapping, Tuple, Union
+import numpy as np
 import pandas as pd
 from datetime import datetime
+from functools import partial
+
+from utils.aws_clients import get_client
+from utils.cognito_executor import CognitoSyncExecutor, OperationCancelled
+from utils.directory_store import DirectoryStore, hash_str_rows
+from utils.field_projection import project_users
+from utils.fingerprint_store import FINGERPRINT_FIELDS, FingerprintStore, user_fingerprint
+from utils.metrics import metrics
+from utils.sync_log import RESULT_DRY_RUN, SyncLogWriter
+
+# 既存ユーザーとの比較対象フィールド（変更内容はこの順で出力）
+COMPARE_FIELDS = ('name', 'position', 'department')
+
+# 比較するフィールドに対応するCognitoの属性（比較するフィールドは全てCognitoに書き込む）
+COGNITO_ATTRIBUTES = {
+    'name': 'name',
+    'position': 'custom:position',
+    'department': 'custom:department',
+}
 
 
 class UserSyncManager:
     """ユーザー同期処理を管理するクラス"""
     
-    def __init__(self, cognito_user_pool_id: str = None):
+    def __init__(self, cognito_user_pool_id: str = None, cognito_client=None,
+                 max_workers: int = 8, rate_limits: Dict[str, float] = None,
+                 fingerprint_store: FingerprintStore = None):
         self.cognito_user_pool_id = cognito_user_pool_id
-        if cognito_user_pool_id:
-            self.cognito_client = boto3.client('cognito-idp')
+        if cognito_client is not None:
+            # テスト用のスタブなど、boto3互換のクライアントを差し替え可能
+            self.cognito_client = cognito_client
+        elif cognito_user_pool_id:
+            # クライアントはプロセス内で共有（ウォームスタート時は再作成しない）
+            self.cognito_client = get_client('cognito-idp')
         else:
             self.cognito_client = None
+        
+        # Cognitoへの操作を並列・レート制限付きで実行
+        self.executor = CognitoSyncExecutor(max_workers=max_workers, rate_limits=rate_limits)
+        
+        # 前回の同期結果のフィンガープリント（指定した場合は変更のない行の比較・反映を省略）
+        self.fingerprint_store = fingerprint_store
+        # 比較の結果、既存ユーザーと一致していた行のフィンガープリントと、全件を比較したかどうか
+        # （同期成功時の保存に使用。保存済みの比較結果から同期する場合は呼び出し側で復元する）
+        self.in_sync_fingerprints = {}
+        self.full_resync = False
     
     def load_existing_users(self, file_path: str = None) -> Dict[str, Dict]:
         """既存のSaaSユーザーを読み込み（開発用）"""
@@ -23,67 +59,84 @@ class UserSyncManager:
                 return {user['email']: user for user in data['users']}
         return {}
     
-    def compare_users(self, csv_df: pd.DataFrame, mapping: Dict[str, any], 
-                     existing_users: Dict[str, Dict]) -> Tuple[List[Dict], List[Dict], List[Dict]]:
-        """CSVデータと既存ユーザーを比較"""
+    def compare_users(self, csv_df: Union[pd.DataFrame, Iterable[pd.DataFrame]], mapping: Dict[str, any], 
+                     existing_users: Mapping[str, Dict],
+                     full_resync: bool = False) -> Tuple[List[Dict], List[Dict], List[Dict]]:
+        """
+        CSVデータと既存ユーザーを比較（DataFrameまたはチャンクのイテレータを受け付ける）
+        マッピング対象のフィールドを列単位で射影し、メールアドレスで既存ユーザーと突き合わせる
+        既存ユーザーは辞書、またはディスク上のストア（DirectoryStore）を受け付ける
+        
+        フィンガープリントを保存している場合、前回の同期から値が変わっていない行は比較しない
+        （Cognito側で直接変更された場合などは full_resync=True で全件を比較し直す）
+        """
+        # CSVの解析は別の処理段階として計測されるため、比較の処理時間には含まれない
+        with metrics.stage('compare_users') as stage:
+            return self._compare_users(csv_df, mapping, existing_users, full_resync, stage)
+    
+    def _compare_users(self, csv_df: Union[pd.DataFrame, Iterable[pd.DataFrame]], mapping: Dict[str, any],
+                       existing_users: Mapping[str, Dict], full_resync: bool,
+                       stage) -> Tuple[List[Dict], List[Dict], List[Dict]]:
         new_users = []
         update_users = []
         delete_users = []
         
         # CSVのメールアドレスを取得
         csv_emails = set()
-        email_col = mapping.get('email')
         
-        if email_col is None:
+        if mapping.get('email') is None:
             raise ValueError("メールアドレスフィールドが指定されていません")
         
-        # CSVデータを処理
-        for _, row in csv_df.iterrows():
-            email = str(row.iloc[email_col]).strip()
-            if not email or email == 'nan':
-                continue
-                
-            csv_emails.add(email)
+        if isinstance(existing_users, DirectoryStore):
+            # ストアの場合は属性ハッシュで変更の有無を判定し、変更のあるユーザーのみ読み込む
+            diff_chunk = partial(_diff_against_store, store=existing_users)
+        else:
+            diff_chunk = _dict_differ(existing_users)
+        
+        self.in_sync_fingerprints = {}
+        self.full_resync = full_resync
+        
+        chunks = [csv_df] if isinstance(csv_df, pd.DataFrame) else csv_df
+        
+        # CSVデータをチャンク単位で処理
+        for chunk in chunks:
+            users = project_users(chunk, mapping)
+            csv_emails.update(users['email'].tolist())
+            stage.items += len(users)
             
-            user_data = {
-                'name': self._get_field_value(row, mapping.get('name')),
-                'email': email,
-                'position': self._get_field_value(row, mapping.get('position')),
-                'department': self._get_field_value(row, mapping.get('department'))
-            }
+            fingerprints = None
+            if self.fingerprint_store is not None:
+                # 行のフィンガープリントを一括で計算し、前回の同期から変わっていない行は除外
+                fingerprints = hash_str_rows(*(users[field].tolist() for field in FINGERPRINT_FIELDS))
+                if not full_resync:
+                    users, fingerprints = self._skip_unchanged(users, fingerprints)
             
-            if email in existing_users:
-                # 既存ユーザーの場合、変更をチェック
-                existing = existing_users[email]
-                changes = {}
-                
-                if user_data['name'] != existing.get('name'):
-                    changes['name'] = {
-                        'old': existing.get('name', ''),
-                        'new': user_data['name']
-                    }
-                
-                if user_data['position'] != existing.get('position'):
-                    changes['position'] = {
-                        'old': existing.get('position', ''),
-                        'new': user_data['position']
-                    }
-                
-                if user_data['department'] != existing.get('department'):
-                    changes['department'] = {
-                        'old': existing.get('department', ''),
-                        'new': user_data['department']
-                    }
+            # メールアドレスで既存ユーザーと突き合わせ、フィールドごとに変更をチェック
+            is_existing, changed, existing_records = diff_chunk(users)
+            
+            records = users.to_dict('records')
+            for i, user_data in enumerate(records):
+                if not is_existing[i]:
+                    # 新規ユーザー
+                    new_users.append(user_data)
+                    continue
                 
-                if changes:
+                changed_fields = [field for field in COMPARE_FIELDS if changed[field][i]]
+                if not changed_fields and fingerprints is not None:
+                    self.in_sync_fingerprints[user_data['email']] = fingerprints[i]
+                if changed_fields:
+                    existing = existing_records[user_data['email']]
                     update_users.append({
-                        'email': email,
-                        'changes': changes,
+                        'email': user_data['email'],
+                        'changes': {
+                            field: {
+                                'old': existing.get(field, ''),
+                                'new': user_data[field]
+                            }
+                            for field in changed_fields
+                        },
                         'new_data': user_data
                     })
-            else:
-                # 新規ユーザー
-                new_users.append(user_data)
         
         # 削除対象ユーザーを特定
         for email, user in existing_users.items():
@@ -98,31 +151,29 @@ class UserSyncManager:
         
         return new_users, update_users, delete_users
     
-    def _get_field_value(self, row: pd.Series, col_config: any) -> str:
-        """フィールドの値を取得（複数フィールドの連結対応）"""
-        if col_config is None:
-            return ''
-        
-        # 配列の場合は複数フィールドを連結
-        if isinstance(col_config, list):
-            values = []
-            for idx in col_config:
-                if idx is not None and 0 <= idx < len(row):
-                    value = row.iloc[idx]
-                    if pd.notna(value) and str(value).strip():
-                        values.append(str(value).strip())
-            return ' '.join(values)
-        
-        # 単一の値の場合
-        if isinstance(col_config, int) and 0 <= col_config < len(row):
-            value = row.iloc[col_config]
-            return str(value).strip() if pd.notna(value) else ''
-        
-        return ''
+    def _skip_unchanged(self, users: pd.DataFrame, fingerprints: List[bytes]) -> Tuple[pd.DataFrame, List[bytes]]:
+        """保存済みのフィンガープリントと一致する行を除外"""
+        stored = self.fingerprint_store.get_many(users['email'].tolist())
+        if not stored:
+            return users, fingerprints
+        
+        keep = np.array([
+            stored.get(email) != fingerprint
+            for email, fingerprint in zip(users['email'].tolist(), fingerprints)
+        ], dtype=bool)
+        return users[keep], [fingerprint for fingerprint, k in zip(fingerprints, keep) if k]
     
     def execute_sync(self, new_users: List[Dict], update_users: List[Dict], 
-                    delete_users: List[Dict], dry_run: bool = False) -> Dict:
-        """同期を実行"""
+                    delete_users: List[Dict], dry_run: bool = False,
+                    progress: Callable[[Dict], None] = None,
+                    cancel_event: threading.Event = None,
+                    sync_log: SyncLogWriter = None) -> Dict:
+        """
+        同期を実行
+        progress を指定した場合は操作が終わるたびに途中経過の results を渡して呼び出す（呼び出し中のみ参照可能）
+        cancel_event が設定された場合は未実行の操作を中止し、results['cancelled'] を True にする
+        sync_log を指定した場合は操作が終わるたびに結果を追記する（中止した操作は記録しない）
+        """
         results = {
             'added': 0,
             'updated': 0,
@@ -136,94 +187,203 @@ class UserSyncManager:
             results['added'] = len(new_users)
             results['updated'] = len(update_users)
             results['deleted'] = len(delete_users)
+            if sync_log is not None:
+                for label, users in (('追加', new_users), ('更新', update_users), ('削除', delete_users)):
+                    sync_log.record_many(label, users, RESULT_DRY_RUN)
             results['endTime'] = datetime.now().isoformat()
             return results
         
-        # 新規ユーザー追加
-        for user in new_users:
-            try:
-                if self.cognito_client:
-                    self._create_cognito_user(user)
-                results['added'] += 1
-            except Exception as e:
-                results['errors'].append({
-                    'email': user['email'],
-                    'operation': '追加',
-                    'error': str(e)
-                })
+        # 追加・更新・削除の順に、各操作は並列に実行
+        operations = [
+            ('create', '追加', 'added', new_users, self._create_cognito_user),
+            ('update', '更新', 'updated', update_users, self._update_cognito_user),
+            ('delete', '削除', 'deleted', delete_users, self._delete_cognito_user)
+        ]
         
-        # ユーザー更新
-        for user in update_users:
-            try:
-                if self.cognito_client:
-                    self._update_cognito_user(user)
-                results['updated'] += 1
-            except Exception as e:
-                results['errors'].append({
-                    'email': user['email'],
-                    'operation': '更新',
-                    'error': str(e)
-                })
+        # 途中経過の集計はワーカースレッドから行うため排他する
+        lock = threading.Lock()
+        synced = {}
+        for operation, label, counter, users, func in operations:
+            if cancel_event is not None and cancel_event.is_set():
+                break
+            
+            if not self.cognito_client:
+                results[counter] += len(users)
+                if sync_log is not None:
+                    sync_log.record_many(label, users)
+                if progress is not None:
+                    progress(results)
+                continue
+            
+            def on_done(user: Dict, error: Exception, label=label, counter=counter):
+                with lock:
+                    if error is None:
+                        results[counter] += 1
+                    elif not isinstance(error, OperationCancelled):
+                        results['errors'].append(_error_entry(user, label, error))
+                    if sync_log is not None and not isinstance(error, OperationCancelled):
+                        sync_log.record(label, user['email'], error)
+                    if progress is not None:
+                        progress(results)
+            
+            error_start = len(results['errors'])
+            with metrics.stage(f'execute_{operation}') as stage:
+                _, failures = self.executor.run(
+                    operation, users, func, on_done=on_done, cancel_event=cancel_event
+                )
+                stage.items += len(users)
+            
+            # 完了順に追加したエラーを入力の順に並べ直す
+            with lock:
+                results['errors'][error_start:] = [
+                    _error_entry(user, label, error)
+                    for _, user, error in failures
+                    if not isinstance(error, OperationCancelled)
+                ]
+            
+            failed = {index for index, _, _ in failures}
+            synced[operation] = [user for index, user in enumerate(users) if index not in failed]
         
-        # ユーザー削除
-        for user in delete_users:
-            try:
-                if self.cognito_client:
-                    self._delete_cognito_user(user)
-                results['deleted'] += 1
-            except Exception as e:
-                results['errors'].append({
-                    'email': user['email'],
-                    'operation': '削除',
-                    'error': str(e)
-                })
+        if cancel_event is not None and cancel_event.is_set():
+            results['cancelled'] = True
+        
+        # Cognitoに反映できたユーザーのみフィンガープリントを保存（失敗したユーザーは次回も比較する）
+        if self.fingerprint_store is not None and synced:
+            self._save_fingerprints(synced)
         
         results['endTime'] = datetime.now().isoformat()
         return results
     
+    def _save_fingerprints(self, synced: Dict[str, List[Dict]]):
+        """同期後の状態をフィンガープリントとして保存"""
+        if self.full_resync:
+            # 全件の再同期では、以前のフィンガープリントを破棄して作り直す
+            self.fingerprint_store.clear()
+        
+        fingerprints = dict(self.in_sync_fingerprints)
+        fingerprints.update((user['email'], user_fingerprint(user)) for user in synced.get('create', []))
+        fingerprints.update(
+            (user['email'], user_fingerprint(user['new_data'])) for user in synced.get('update', [])
+        )
+        self.fingerprint_store.update(fingerprints.items())
+        self.fingerprint_store.delete(user['email'] for user in synced.get('delete', []))
+    
     def _create_cognito_user(self, user: Dict):
         """Cognitoにユーザーを作成"""
         if not self.cognito_client:
             return
-            
-        response = self.cognito_client.admin_create_user(
+        
+        # 値が空の属性は送らない（既存ユーザーの取得時は、値のない属性を空文字列として比較する）
+        attributes = [{'Name': 'email', 'Value': user['email']}] + [
+            {'Name': attribute, 'Value': user[field]}
+            for field, attribute in COGNITO_ATTRIBUTES.items()
+            if user.get(field)
+        ]
+        response = self.executor.call('create', lambda: self.cognito_client.admin_create_user(
             UserPoolId=self.cognito_user_pool_id,
             Username=user['email'],
-            UserAttributes=[
-                {'Name': 'email', 'Value': user['email']},
-                {'Name': 'custom:position', 'Value': user['position']},
-                {'Name': 'custom:department', 'Value': user['department']}
-            ],
+            UserAttributes=attributes,
             MessageAction='SUPPRESS'
-        )
+        ))
     
     def _update_cognito_user(self, user: Dict):
-        """Cognitoのユーザー情報を更新"""
+        """Cognitoのユーザー情報を更新（空の値に変わった属性は削除する）"""
         if not self.cognito_client:
             return
             
         attributes = []
+        removed = []
         new_data = user['new_data']
         
-        if 'position' in user['changes']:
-            attributes.append({'Name': 'custom:position', 'Value': new_data['position']})
-        
-        if 'department' in user['changes']:
-            attributes.append({'Name': 'custom:department', 'Value': new_data['department']})
+        for field, attribute in COGNITO_ATTRIBUTES.items():
+            if field not in user['changes']:
+                continue
+            if new_data[field]:
+                attributes.append({'Name': attribute, 'Value': new_data[field]})
+            else:
+                removed.append(attribute)
         
+        # 更新と属性の削除は別のAPI呼び出しのため、それぞれでトークンを取得する
+        # （片方のみ再試行するため、成功した呼び出しを繰り返さない）
         if attributes:
-            response = self.cognito_client.admin_update_user_attributes(
+            response = self.executor.call('update', lambda: self.cognito_client.admin_update_user_attributes(
                 UserPoolId=self.cognito_user_pool_id,
                 Username=user['email'],
                 UserAttributes=attributes
-            )
+            ))
+        
+        if removed:
+            response = self.executor.call('update', lambda: self.cognito_client.admin_delete_user_attributes(
+                UserPoolId=self.cognito_user_pool_id,
+                Username=user['email'],
+                UserAttributeNames=removed
+            ))
     
     def _delete_cognito_user(self, user: Dict):
         """Cognitoからユーザーを削除"""
         if not self.cognito_client:
             return
             
-        response = self.cognito_client.admin_delete_user(
+        response = self.executor.call('delete', lambda: self.cognito_client.admin_delete_user(
             UserPoolId=self.cognito_user_pool_id,
             Username=user['email']
-        )
\ No newline at end of file
+        ))
+
+
+def _dict_differ(existing_users: Dict[str, Dict]):
+    """辞書の既存ユーザーと比較する関数を作成（既存ユーザーは最初に1回だけ列形式に変換する）"""
+    # 比較は既存の値そのものと行う
+    existing_index = pd.Index(list(existing_users.keys()), dtype=object)
+    existing_values = {
+        field: np.array([user.get(field) for user in existing_users.values()], dtype=object)
+        for field in COMPARE_FIELDS
+    }
+    
+    def diff_chunk(users: pd.DataFrame):
+        # メールアドレスで既存ユーザーと結合（-1は新規ユーザー）
+        matches = existing_index.get_indexer(users['email'].tolist())
+        is_existing = matches >= 0
+        
+        changed = {
+            field: np.zeros(len(users), dtype=bool) for field in COMPARE_FIELDS
+        }
+        if is_existing.any():
+            matched = matches[is_existing]
+            for field in COMPARE_FIELDS:
+                new_values = users[field].to_numpy(dtype=object)[is_existing]
+                changed[field][is_existing] = new_values != existing_values[field][matched]
+        return is_existing, changed, existing_users
+    
+    return diff_chunk
+
+
+def _diff_against_store(users: pd.DataFrame, store: DirectoryStore):
+    """ストアの既存ユーザーと比較（属性ハッシュが一致しないユーザーのみフィールド単位で比較する）"""
+    emails = users['email'].tolist()
+    stored_hashes = store.get_hashes(emails)
+    is_existing = np.array([email in stored_hashes for email in emails], dtype=bool)
+    
+    row_hashes = hash_str_rows(*(users[field].tolist() for field in COMPARE_FIELDS))
+    candidates = [
+        i for i in np.flatnonzero(is_existing)
+        if row_hashes[i] != stored_hashes[emails[i]]
+    ]
+    existing_records = store.get_many([emails[i] for i in candidates])
+    
+    changed = {
+        field: np.zeros(len(users), dtype=bool) for field in COMPARE_FIELDS
+    }
+    values = {field: users[field].tolist() for field in COMPARE_FIELDS}
+    for i in candidates:
+        existing = existing_records[emails[i]]
+        for field in COMPARE_FIELDS:
+            changed[field][i] = values[field][i] != existing.get(field)
+    return is_existing, changed, existing_records
+
+
+def _error_entry(user: Dict, label: str, error: Exception) -> Dict:
+    return {
+        'email': user['email'],
+        'operation': label,
+        'error': str(error)
+    }
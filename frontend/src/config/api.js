@@ -35,7 +35,11 @@ export const apiConfig = {
     
     // 同期関連
     syncPreview: getApiUrl('/api/sync/preview'),
+    syncDiff: (sessionId) => getApiUrl(`/api/sync/diff/${sessionId}`),
     syncExecute: getApiUrl('/api/sync/execute'),
+    syncJob: (jobId) => getApiUrl(`/api/sync/jobs/${jobId}`),
+    syncJobEvents: (jobId) => getApiUrl(`/api/sync/jobs/${jobId}/events`),
+    syncJobCancel: (jobId) => getApiUrl(`/api/sync/jobs/${jobId}/cancel`),
     syncDownloadLog: getApiUrl('/api/sync/download-log'),
     
     // マッピング設定関連